@@ -34,6 +34,8 @@ import time
 import crcmod.predefined
 
 import FakeDuino
+import Messages
+import Metrics
 
 class ArduinoComms():
 	def __init__ (self, parent):
@@ -49,6 +51,7 @@ class ArduinoComms():
 		self.serial_connection = None
 		self.fault_condition = False
 		self.connected = False
+		self.metrics = Metrics.GetMetrics()
 		self.ScanForDevices()
 	
 	def Clear(self):
@@ -165,6 +168,7 @@ class ArduinoComms():
 	
 	def Reconnect(self):
 		self.connected = False
+		self.metrics.Inc('coldstage_comms_reconnect_attempts_total')
 		self.ScanForDevices()
 		if self.ConnectByID(self.unique_id) == False:
 			# If we couldn't reconnect by ID, Likely the stage with that ID is no longer connected. 
@@ -247,11 +251,15 @@ class ArduinoComms():
 			else:
 				if all(crc_check_passed) == False:
 					fault_flag = 'c'
+					self.metrics.Inc('coldstage_comms_crc_failures_total', crc_check_passed.count(False))
 					print('Serial comms fault - CRC check failure! Retrying...')
 		except OSError as e:
 			if e.args[0] == 5:
 				fault_flag = 'f'
 				print('Serial comms fault - USB connection failure! Attempting to reconnect...')
+		self.metrics.Inc('coldstage_comms_calls_total')
+		if fault_flag != '':
+			self.metrics.Inc('coldstage_comms_faults_total', code = fault_flag)
 		return fault_flag, responses
 	
 	def __CommsFailureLoop(self):
@@ -259,12 +267,12 @@ class ArduinoComms():
 		success_flag = False
 		retry_flag = True
 		while retry_flag == True:
-			next_message = ('1',)
+			next_message = (0, None)
 			try:
 				next_message = self.parent.mq_front_to_back[0].get(False, None)
 			except:
-				next_message = ('',)
-			if next_message[0] == 'AllShutDown':
+				next_message = (0, None)
+			if next_message[0] == Messages.BackEndOp.ALL_SHUT_DOWN:
 				retry_flag = False
 				success_flag = False
 			else:
@@ -278,27 +286,28 @@ class ArduinoComms():
 	def __AlertFrontendCommsFailure(self):
 		if self.fault_condition == False:
 			# Inform channel 0 front-end of connection failure.
-			self.parent.mq_back_to_front[0].put((2, 'Comms_fault'))
+			self.parent.mq_back_to_front[0].put(Messages.Message(Messages.FrontEndOp.COMMS_FAULT))
 			self.fault_condition = True
 	
 	def __AlertFrontendCommsSuccess(self):
 		if self.fault_condition == True:
 			# Inform channel 0 front-end of re-connection success.
-			self.parent.mq_back_to_front[0].put((2, 'Comms_success'))
+			self.parent.mq_back_to_front[0].put(Messages.Message(Messages.FrontEndOp.COMMS_SUCCESS))
 			self.fault_condition = False
 	
 	def __CheckForFrontendCancel(self):
 		retry_flag = True
-		next_message = ('1',)
+		next_message = (0, None)
 		try:
 			next_message = self.parent.mq_front_to_back[0].get(False, None)
 		except:
-			next_message = ('',)
-		if next_message[0] == 'AllShutDown':
+			next_message = (0, None)
+		if next_message[0] == Messages.BackEndOp.ALL_SHUT_DOWN:
 			retry_flag = False
 		else:
 			time.sleep(0.1)
 			retry_flag = True
+			self.metrics.Inc('coldstage_comms_retries_total')
 		return retry_flag
 	
 	def StageChannelSelect(self, channel_id):
@@ -26,15 +26,17 @@
 """
  
 from multiprocessing import Queue, Process, Event
-import threading as Thread
 import time
 
 import ArduinoComms
 import CoolerChannel
 import Utilities
+import Messages
+import Tracing
+import Metrics
 
 class BackEnd():
-	def __init__ (self, device_parameter_defaults, num_channels, mq_front_to_back, mq_back_to_front, mq_back_to_vlogger, mq_timestamp, event_vlogger_fault, event_back_to_front, video_enabled_flag, comms_unique_id, time_step, timing_flag, drive_mode):
+	def __init__ (self, device_parameter_defaults, num_channels, mq_front_to_back, mq_back_to_front, mq_back_to_vlogger, mq_timestamp, event_vlogger_fault, event_back_to_front, video_enabled_flag, comms_unique_id, time_step, timing_flag, drive_mode, telemetry_ring_names):
 		print('Backend starting.')
 		self.device_parameter_defaults = device_parameter_defaults
 		self.num_channels = num_channels
@@ -45,6 +47,7 @@ class BackEnd():
 		self.mq_back_to_vlogger = mq_back_to_vlogger
 		self.event_vlogger_fault = event_vlogger_fault
 		self.event_back_to_front = event_back_to_front
+		self.telemetry_ring_names = telemetry_ring_names
 		
 		self.setpoint = 0.0
 		self.last_temperature = 0.0
@@ -53,6 +56,20 @@ class BackEnd():
 		self.all_shutdown_initiated = False
 		self.timing_flag = timing_flag
 		self.time_step = time_step
+		self.tick_scheduler = None
+		self.pending_time_step = None
+		self.tick_statistics_report_seconds = self.device_parameter_defaults['tick_statistics_report_seconds']
+		# Spans are traced per channel (tid = channel index), with the tick itself on its own row.
+		self.tracer = Tracing.InitialiseTracer('Back end', self.device_parameter_defaults)
+		self.tick_trace_tid = self.num_channels
+		self.metrics = Metrics.InitialiseMetrics('back_end', self.device_parameter_defaults)
+		self.tracer.SetThreadName(self.tick_trace_tid, 'Tick')
+		for i in range(self.num_channels):
+			self.tracer.SetThreadName(i, 'Channel ' + str(i))
+			self.tracer.SetThreadName(100 + i, 'Channel ' + str(i) + ' logger')
+			# If timing info is on, completed spans are also forwarded to each channel's timing monitor.
+			if self.timing_flag == True:
+				self.tracer.SetForwardQueue(i, self.mq_timestamp[i])
 		self.logging_rates = self.device_parameter_defaults['logging_rate']
 		self.drive_mode = drive_mode
 		self.video_enabled_flag = video_enabled_flag
@@ -62,12 +79,12 @@ class BackEnd():
 		self.comms_success_flag = self.comms_manager.ConnectByID(comms_unique_id)
 		
 		# Instantiate the cooler channels.
-		self.cooler_channels = [CoolerChannel.CoolerChannel(self.device_parameter_defaults, self, i, self.mq_back_to_front[i], self.mq_back_to_vlogger[i], self.event_vlogger_fault[i], self.event_back_to_front[i], self.mq_timestamp[i], self.logging_rates[i], self.drive_mode[i], self.timing_flag, self.video_enabled_flag[i], self.comms_manager, self.time_step, self.device_parameter_defaults['default_pid_coefficients'][i]) for i in range(self.num_channels)]
+		self.cooler_channels = [CoolerChannel.CoolerChannel(self.device_parameter_defaults, self, i, self.mq_back_to_front[i], self.mq_back_to_vlogger[i], self.event_vlogger_fault[i], self.event_back_to_front[i], self.mq_timestamp[i], self.logging_rates[i], self.drive_mode[i], self.timing_flag, self.video_enabled_flag[i], self.comms_manager, self.time_step, self.device_parameter_defaults['default_pid_coefficients'][i], self.telemetry_ring_names[i]) for i in range(self.num_channels)]
 		
 		if self.comms_success_flag == True:
 			# Send the datum time to the front ends via the message queue.
 			for i in range(self.num_channels):
-				self.mq_back_to_front[i].put((1, 'New_datum_time', (time.time() + self.time_step)))
+				self.mq_back_to_front[i].put(Messages.Message(Messages.FrontEndOp.NEW_DATUM_TIME, (time.time() + self.time_step)))
 			print("Backend(s) running.")
 		else:	
 			print('System startup cancelled due to comms failure.')
@@ -81,64 +98,126 @@ class BackEnd():
 	# Backend event loop.
 	def EventLoop(self):
 		while self.shut_down_flag == False:
-			# Block until the drift-free timer sets the flag to begin the current time-step.
-			# Once the flag is set, reset it and then service all channels in sequence.
-			while self.timer_thread_signal.wait():
-				self.timer_thread_signal.clear()
-				
-				# Loop through and update cooler channels.
-				for channel_index in range(self.num_channels):
-					if self.cooler_channels[channel_index].shut_down_flag == False:
-						if self.comms_success_flag == True:
-							# Send messages to the hardware platform to switch to the channel-select state and then select the current channel.
-							self.comms_success_flag, responses = self.comms_manager.StageChannelSelect(channel_index)
-						
-						if self.comms_success_flag == True:
-							# Service the current channel hardware ie - Send Idle or Throttle commands to cold-stage.
-							self.comms_success_flag = self.cooler_channels[channel_index].ServiceHardware()
-						
-						# Iterate through pending control messages from the frontend.
-						next_message = ('1',)
-						while next_message[0] != '':
-							try:
-								next_message = self.mq_front_to_back[channel_index].get(False, None)
-								print(next_message)
-								self.comms_success_flag = self.cooler_channels[channel_index].ServiceMessages(next_message, self.comms_success_flag)
-							except:
-								next_message = ('',)
-						
-						if ((self.comms_success_flag == False) and (self.all_shutdown_initiated == False)):
-							self.AllShutDown()
-				
-				# Poll all channels to determine which are shut down. If they are all shut down then begin the sequence to
-				# shut down the back end and close the application.
-				shut_down_flags = [1 if self.cooler_channels[i].shut_down_flag == True else 0 for i in range(self.num_channels)]
-				if sum(shut_down_flags) == self.num_channels:
-					print('All channels stopped.')
-					self.ShutdownTimer()
-					self.shut_down_flag = True
-					break
+			# Block until the tick scheduler says it is time to begin the current time-step, then service all channels
+			# in sequence.
+			self.tick_scheduler.WaitForTick()
+			tick_start = self.tracer.Now()
+			
+			# Loop through and update cooler channels.
+			for channel_index in range(self.num_channels):
+				if self.cooler_channels[channel_index].shut_down_flag == False:
+					service_start = time.monotonic()
+					service_start_ns = self.tracer.Now()
+					# Each channel decides whether its hardware is due for service this tick (see CoolerChannel.ServiceDue()).
+					service_due = self.cooler_channels[channel_index].ServiceDue()
+					if ((self.comms_success_flag == True) and (service_due == True)):
+						# Send messages to the hardware platform to switch to the channel-select state and then select the current channel.
+						span_start = self.tracer.Now()
+						self.comms_success_flag, responses = self.comms_manager.StageChannelSelect(channel_index)
+						self.tracer.Record('channel_select', span_start, tid = channel_index)
+					
+					if ((self.comms_success_flag == True) and (service_due == True)):
+						# Service the current channel hardware ie - Send Idle or Throttle commands to cold-stage.
+						self.comms_success_flag = self.cooler_channels[channel_index].ServiceHardware()
+					
+					# Iterate through pending control messages from the frontend.
+					next_message = None
+					span_start = self.tracer.Now()
+					while True:
+						try:
+							next_message = self.mq_front_to_back[channel_index].get(False, None)
+						except:
+							break
+						try:
+							self.comms_success_flag = self.cooler_channels[channel_index].ServiceMessages(next_message, self.comms_success_flag)
+						except Exception as error:
+							# Don't let one bad message take the back end down, but don't hide it either.
+							print('Channel ' + str(channel_index) + ' failed to handle message ' + Messages.OpcodeName(next_message[0]) + ': ' + repr(error))
+					
+					if next_message is not None:
+						self.tracer.Record('service_messages', span_start, tid = channel_index)
+					
+					if ((self.comms_success_flag == False) and (self.all_shutdown_initiated == False)):
+						self.AllShutDown()
+					if service_due == True:
+						self.tick_scheduler.ChannelServiced(channel_index, service_start, time.monotonic())
+						self.tracer.Record('channel_service', service_start_ns, tid = channel_index)
+			
+			# Poll all channels to determine which are shut down. If they are all shut down then begin the sequence to
+			# shut down the back end and close the application.
+			shut_down_flags = [1 if self.cooler_channels[i].shut_down_flag == True else 0 for i in range(self.num_channels)]
+			if sum(shut_down_flags) == self.num_channels:
+				print('All channels stopped.')
+				self.ShutdownTimer()
+				self.shut_down_flag = True
+				break
+			
+			# Apply any time-step change requested during this tick before working out when the next one starts.
+			if self.pending_time_step is not None:
+				self.ApplyTimeStep(self.pending_time_step)
+				self.pending_time_step = None
+			
+			self.tracer.Record('tick', tick_start, tid = self.tick_trace_tid)
+			overruns = self.tick_scheduler.overruns
+			skipped_ticks = self.tick_scheduler.skipped_ticks
+			self.tick_scheduler.EndTick()
+			self.UpdateMetrics(tick_start, self.tick_scheduler.overruns - overruns, self.tick_scheduler.skipped_ticks - skipped_ticks)
+			if ((self.tick_statistics_report_seconds > 0.0) and ((time.monotonic() - self.tick_scheduler.statistics_start) >= self.tick_statistics_report_seconds)):
+				print(self.tick_scheduler.Report())
+				self.tick_scheduler.ResetStatistics()
 		
 		# And we are done!
+		Tracing.ExportTracer(self.device_parameter_defaults)
+		self.metrics.Write()
 		print("Backend shut down.")
 	
+	def UpdateMetrics(self, tick_start, overruns, skipped_ticks):
+		self.metrics.Inc('coldstage_ticks_total')
+		self.metrics.Inc('coldstage_tick_overruns_total', overruns)
+		self.metrics.Inc('coldstage_ticks_skipped_total', skipped_ticks)
+		self.metrics.Set('coldstage_tick_duration_seconds', (self.tracer.Now() - tick_start) / 1e9)
+		self.metrics.Set('coldstage_tick_interval_seconds', self.time_step)
+		if self.metrics.WriteDue() == True:
+			# Queue depths are only sampled when the metrics are written.
+			for i in range(self.num_channels):
+				for queue_name, message_queue in [('front_to_back', self.mq_front_to_back[i]), ('back_to_front', self.mq_back_to_front[i]), ('back_to_vlogger', self.mq_back_to_vlogger[i])]:
+					# There is no video queue if the channel has no camera.
+					queue_depth = Utilities.QueueDepth(message_queue) if message_queue is not None else None
+					if queue_depth is not None:
+						self.metrics.Set('coldstage_queue_depth', queue_depth, queue = queue_name, channel = i)
+			self.metrics.Write()
+	
 	def InitialiseTimer(self, interval_seconds):
-		# Create a thread in which the drift-free timer will run. Set up thread events that will allow the triggering of the
-		# back end event loop (by becoming 'set') and kill the timer thread before starting a new one (by becoming 'cleared').
-		self.timer_thread_signal = Thread.Event()
-		self.timer_thread_kill = Thread.Event()
-		self.timer_thread_kill.set()
-		self.timer_thread = Thread.Thread(target = Utilities.DriftFreeTimer, args = (self.timer_thread_signal, self.timer_thread_kill, interval_seconds))
-		self.timer_thread.start()
-		print('Drift-free timer started.')
+		# The tick scheduler runs inline in the event loop, so there is no timer thread to start.
+		self.tick_scheduler = Utilities.TickScheduler(interval_seconds, self.num_channels, self.device_parameter_defaults['tick_overrun_policy'], self.device_parameter_defaults['tick_spin_seconds'])
+		print('Tick scheduler started, interval ' + str(interval_seconds) + ' s.')
+	
+	def SetTimeStep(self, time_step):
+		# Any channel's front end can change the time-step, but all channels share the tick. The change is held until the
+		# end of the current tick so that every channel is serviced at one time-step or the other, never a mix.
+		if time_step > 0.0:
+			self.pending_time_step = time_step
+	
+	def ApplyTimeStep(self, time_step):
+		if time_step == self.time_step:
+			return
+		# Timing statistics are kept separately for each interval.
+		print(self.tick_scheduler.Report())
+		self.time_step = time_step
+		self.tick_scheduler.SetInterval(self.time_step)
+		self.tick_scheduler.ResetStatistics()
+		for i in range(self.num_channels):
+			if self.cooler_channels[i].shut_down_flag == False:
+				self.cooler_channels[i].SetTimeStep(self.time_step)
+			self.mq_back_to_front[i].put(Messages.Message(Messages.FrontEndOp.SET_TIME_STEP, self.time_step))
+		print('Time-step changed to ' + str(self.time_step) + ' s.')
 	
 	def ShutdownTimer(self):
-		self.timer_thread_kill.clear()
-		self.timer_thread.join()
-		print('Drift-free timer stopped.')
+		print(self.tick_scheduler.Report())
+		print('Tick scheduler stopped.')
 	
 	def AllShutDown(self):
 		print('All channels shutting down...')
 		self.all_shutdown_initiated = True
 		for i in range(self.num_channels):
-			self.mq_back_to_front[i].put((2, 'All_shutdown_confirm'))
+			self.mq_back_to_front[i].put(Messages.Message(Messages.FrontEndOp.ALL_SHUTDOWN_CONFIRM))
@@ -0,0 +1,694 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+
+# Benchmarks for the back end and the inter-process paths between the back end and the front end. Run from the Cold Stage
+# directory (the simulated hardware needs air_properties.csv), eg:
+#
+#	python3 Benchmarks.py telemetry --channels 1 2 4 8 16 --time-steps 0.05 0.1 0.2
+#	python3 Benchmarks.py messages
+#	python3 Benchmarks.py backend --channels 1 2 4 --time-steps 0.1 0.2 --logging-rates 1 5
+#	python3 Benchmarks.py frames --resolutions 640x480 1280x720 --frame-rates 4 15
+#	python3 Benchmarks.py overlay
+#
+# Results are printed as a table, or as JSON with --json.
+
+import os
+import sys
+import time
+import json
+import glob
+import queue
+import shutil
+import pickle
+import argparse
+import tempfile
+import numpy as np
+from multiprocessing import Process, Queue, Event
+from PIL import Image, ImageFont, ImageDraw
+
+import TelemetryRing
+import FrameBuffer
+import Overlay
+import Messages
+import Defaults
+import Utilities
+import BackEnd
+
+TELEMETRY_TRANSPORTS = ['legacy', 'consolidated', 'shared_memory']
+
+def TelemetryProducer(transport, num_channels, time_step, duration, mq_telemetry, ring_names, mq_results, start_event):
+	# Stands in for the back end. Every time-step each channel sends one set of readings to the front end in the given
+	# transport format, and the time spent sending is recorded.
+	if transport == 'shared_memory':
+		rings = [TelemetryRing.TelemetryRing(name = ring_names[channel]) for channel in range(num_channels)]
+	start_event.wait()
+	put_times = []
+	ticks = int(duration / time_step)
+	next_tick = time.perf_counter()
+	for tick in range(ticks):
+		next_tick += time_step
+		put_start = time.perf_counter()
+		for channel in range(num_channels):
+			current_time = time.time()
+			temperature = 20.0 - (0.01 * tick)
+			if transport == 'legacy':
+				mq_telemetry[channel].put((1, 'Current_temperature', current_time, temperature))
+				mq_telemetry[channel].put((1, 'Current_PRT_temperature', current_time, temperature + 0.1))
+				mq_telemetry[channel].put((1, 'Current_flowrate', current_time, 15.0))
+				mq_telemetry[channel].put((1, 'Current_setpoint', current_time, -5.0))
+			elif transport == 'consolidated':
+				mq_telemetry[channel].put(Messages.Message(Messages.FrontEndOp.TELEMETRY, current_time, temperature, temperature + 0.1, 15.0, -5.0, 0.5))
+			elif transport == 'shared_memory':
+				rings[channel].Write(current_time, temperature, temperature + 0.1, 15.0, -5.0, 0.5)
+		put_times.append(time.perf_counter() - put_start)
+		sleep_time = next_tick - time.perf_counter()
+		if sleep_time > 0.0:
+			time.sleep(sleep_time)
+	if transport == 'shared_memory':
+		for ring in rings:
+			ring.Close()
+	mq_results.put(put_times)
+
+def PollTelemetry(transport, channel, mq_telemetry, ring):
+	# Stands in for one FrontEnd.UpdatePoll, returning the telemetry received as a structured array.
+	if transport == 'shared_memory':
+		return ring.ReadNew()
+	telemetry_messages = []
+	legacy_record = None
+	most_recent_message = []
+	while most_recent_message != [0, ]:
+		try:
+			most_recent_message = mq_telemetry[channel].get(False, None)
+		except:
+			most_recent_message = [0, ]
+		if most_recent_message[0] == Messages.FrontEndOp.TELEMETRY:
+			telemetry_messages.append(most_recent_message[1])
+		elif most_recent_message[0] == 1:
+			if most_recent_message[1] == 'Current_temperature':
+				# The legacy format needs four messages to build up one record.
+				legacy_record = [most_recent_message[2], most_recent_message[3], np.nan, np.nan, np.nan, np.nan]
+			elif most_recent_message[1] == 'Current_PRT_temperature':
+				legacy_record[2] = most_recent_message[3]
+			elif most_recent_message[1] == 'Current_flowrate':
+				legacy_record[3] = most_recent_message[3]
+			elif most_recent_message[1] == 'Current_setpoint':
+				legacy_record[4] = most_recent_message[3]
+				telemetry_messages.append(tuple(legacy_record))
+	return np.array(telemetry_messages, dtype = TelemetryRing.TELEMETRY_RECORD)
+
+def RunTelemetryBenchmark(transport, num_channels, time_step, duration, poll_interval = 0.25):
+	mq_telemetry = [Queue() for channel in range(num_channels)]
+	mq_results = Queue()
+	start_event = Event()
+	rings = [None for channel in range(num_channels)]
+	ring_names = [None for channel in range(num_channels)]
+	if transport == 'shared_memory':
+		rings = [TelemetryRing.TelemetryRing(capacity = 4096, create = True) for channel in range(num_channels)]
+		ring_names = [ring.name for ring in rings]
+	process_producer = Process(target = TelemetryProducer, args = (transport, num_channels, time_step, duration, mq_telemetry, ring_names, mq_results, start_event))
+	process_producer.start()
+	
+	poll_times = []
+	latencies = []
+	records_received = 0
+	start_event.set()
+	end_time = time.perf_counter() + duration + (2.0 * poll_interval)
+	while time.perf_counter() < end_time:
+		time.sleep(poll_interval)
+		poll_start = time.perf_counter()
+		for channel in range(num_channels):
+			records = PollTelemetry(transport, channel, mq_telemetry, rings[channel])
+			if len(records) > 0:
+				# Latency is from the record being timestamped by the producer to it being processed here, so it includes
+				# the time spent waiting for the next poll.
+				latencies.extend((time.time() - records['timestamp']).tolist())
+				records_received += len(records)
+		poll_times.append(time.perf_counter() - poll_start)
+	put_times = mq_results.get()
+	process_producer.join()
+	
+	dropped_records = 0
+	for ring in rings:
+		if ring is not None:
+			dropped_records += ring.dropped_records
+			ring.Close()
+			ring.Unlink()
+	
+	if transport == 'legacy':
+		messages_per_record = 4
+	elif transport == 'consolidated':
+		messages_per_record = 1
+	else:
+		messages_per_record = 0
+	records_sent = len(put_times) * num_channels
+	return {'transport': transport, 'channels': num_channels, 'time_step': time_step, 'duration': duration, 
+	        'records_sent': records_sent, 'records_received': records_received, 'dropped_records': dropped_records, 
+	        'messages_per_sec': (records_sent * messages_per_record) / duration, 
+	        'put_us_per_tick_mean': 1e6 * float(np.mean(put_times)), 'put_us_per_tick_max': 1e6 * float(np.max(put_times)), 
+	        'poll_us_mean': 1e6 * float(np.mean(poll_times)), 'poll_us_max': 1e6 * float(np.max(poll_times)), 
+	        'latency_ms_mean': 1e3 * float(np.mean(latencies)) if len(latencies) > 0 else None, 
+	        'latency_ms_max': 1e3 * float(np.max(latencies)) if len(latencies) > 0 else None}
+
+# The front end -> back end message names in the order they were tested by the old if/elif chain in 
+# CoolerChannel.ServiceMessages, and a representative message of each type in both formats.
+LEGACY_MESSAGES = [('Throttle', 50.0), ('SetPoint', -20.0), ('Ramp', 1, True, None, [['setpoint', 20.0]]), ('PIDConfig', 1.0, 0.0, 0.5, 1.0), 
+                   ('LoggingRate', 5), ('StartLogging', '/tmp/log.csv', False, False), ('StopLogging',), ('SetTimeStep', 0.2), ('NewDatumTime',), 
+                   ('CalibrationOff',), ('CalibrationOn',), ('SetCalibrationLimit', -30.0), ('Off',), ('ChangeVideoRes', '640x480'), 
+                   ('ChangeLogVideoSplitFlag', True), ('ShutDown',), ('AllShutDown',)]
+
+def LegacyServiceMessages(most_recent_message):
+	# The old string comparison chain, with the handler bodies stripped out.
+	if most_recent_message[0] == 'Throttle':
+		return 0
+	elif most_recent_message[0] == 'SetPoint':
+		return 1
+	elif most_recent_message[0] == 'Ramp':
+		return 2
+	elif most_recent_message[0] == 'PIDConfig':
+		return 3
+	elif most_recent_message[0] == 'LoggingRate':
+		return 4
+	elif most_recent_message[0] == 'StartLogging':
+		return 5
+	elif most_recent_message[0] == 'StopLogging':
+		return 6
+	elif most_recent_message[0] == 'SetTimeStep':
+		return 7
+	elif most_recent_message[0] == 'NewDatumTime':
+		return 8
+	elif most_recent_message[0] == 'CalibrationOff':
+		return 9
+	elif most_recent_message[0] == 'CalibrationOn':
+		return 10
+	elif most_recent_message[0] == 'SetCalibrationLimit':
+		return 11
+	elif most_recent_message[0] == 'Off':
+		return 12
+	elif most_recent_message[0] == 'ChangeVideoRes':
+		return 13
+	elif most_recent_message[0] == 'ChangeLogVideoSplitFlag':
+		return 14
+	elif most_recent_message[0] == 'ShutDown':
+		return 15
+	elif most_recent_message[0] == 'AllShutDown':
+		return 16
+
+def TimePerCall(function, argument, repeats):
+	for repeat in range(repeats // 10):
+		function(argument)
+	start = time.perf_counter_ns()
+	for repeat in range(repeats):
+		function(argument)
+	return (time.perf_counter_ns() - start) / repeats
+
+def RunMessageBenchmark(repeats):
+	# Per-message cost of routing (the old if/elif chain vs the Messages.Dispatcher dict lookup) and of the pickle round 
+	# trip that every message makes through a multiprocessing Queue, for each front end -> back end message type.
+	dispatcher = Messages.Dispatcher('Benchmark')
+	for index, opcode in enumerate(Messages.BackEndOp):
+		dispatcher.RegisterHandler(opcode, lambda payload, index = index: index)
+	results = []
+	for opcode, legacy_message in zip(Messages.BackEndOp, LEGACY_MESSAGES):
+		message = Messages.Message(opcode, *legacy_message[1:])
+		assert dispatcher.Dispatch(message) == LegacyServiceMessages(legacy_message)
+		results.append({'message': opcode.name, 
+		                'legacy_route_ns': TimePerCall(LegacyServiceMessages, legacy_message, repeats), 
+		                'dispatch_route_ns': TimePerCall(dispatcher.Dispatch, message, repeats), 
+		                'legacy_pickle_ns': TimePerCall(lambda m: pickle.loads(pickle.dumps(m)), legacy_message, repeats), 
+		                'dispatch_pickle_ns': TimePerCall(lambda m: pickle.loads(pickle.dumps(m)), message, repeats), 
+		                'legacy_bytes': len(pickle.dumps(legacy_message)), 
+		                'dispatch_bytes': len(pickle.dumps(message))})
+	return results
+
+BACKEND_SERIAL_SPANS = ['channel_select', 'idle_call', 'throttle_call']
+
+def RunQuietly(output_path, target, args):
+	# Run a process target with its console output sent to a file, so it does not mix with the benchmark results.
+	with open(output_path, 'w') as output_file:
+		sys.stdout = output_file
+		sys.stderr = output_file
+		target(*args)
+
+def ProcessCPUSeconds(pid):
+	# User plus system CPU seconds used so far by another process, from /proc (so Linux only, None elsewhere).
+	try:
+		with open('/proc/' + str(pid) + '/stat', 'r') as stat_file:
+			fields = stat_file.read().rsplit(')', 1)[1].split()
+		return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+	except (OSError, ValueError, IndexError, AttributeError):
+		return None
+
+def Statistics(values, scale = 1.0):
+	# Mean, 50th/99th percentile and maximum of values multiplied by scale, or Nones if there are none.
+	if len(values) == 0:
+		return {'mean': None, 'p50': None, 'p99': None, 'max': None}
+	values = np.array(values) * scale
+	return {'mean': float(np.mean(values)), 'p50': float(np.percentile(values, 50)), 'p99': float(np.percentile(values, 99)), 'max': float(np.max(values))}
+
+def LoadTraceSpans(trace_directory, window_start_us, window_end_us):
+	# All complete spans from the trace files written by one run that started inside the measurement window, by name.
+	spans = {}
+	for file_path in glob.glob(os.path.join(trace_directory, '*.json')):
+		with open(file_path, 'r') as trace_file:
+			for event in json.load(trace_file)['traceEvents']:
+				if ((event['ph'] == 'X') and (event['ts'] >= window_start_us) and (event['ts'] < window_end_us)):
+					spans.setdefault(event['name'], []).append(event)
+	return spans
+
+def RunBackEndBenchmark(num_channels, time_step, logging_rate, video_enabled, ticks, keep_output = False, poll_interval = 0.25, video_device = 'synthetic', freeze_detection = False):
+	# Runs the real back end against the simulated hardware (FakeDuino) with a stand-in for the front ends that logs
+	# every channel for the given number of ticks. Tick timing, serial call and log write times are taken from the trace 
+	# spans that the back end records (see Tracing.py), so the back end runs exactly as it would in the GUI. Video runs
+	# use the synthetic camera (see SyntheticCamera.py) unless given a camera number.
+	run_directory = tempfile.mkdtemp(prefix = 'coldstage_benchmark_')
+	trace_directory = os.path.join(run_directory, 'traces')
+	metrics_directory = os.path.join(run_directory, 'metrics')
+	log_directory = os.path.join(run_directory, 'logs')
+	device_parameter_defaults = Defaults.DeviceParameterDefaults()
+	device_parameter_defaults['simulation_number_of_channels'] = num_channels
+	device_parameter_defaults['time_step'] = time_step
+	device_parameter_defaults['logging_rate'] = [logging_rate for i in range(num_channels)]
+	device_parameter_defaults['tick_statistics_report_seconds'] = 0.0
+	device_parameter_defaults['trace_enabled'] = 1
+	device_parameter_defaults['trace_buffer_spans'] = (ticks * num_channels * 10) + 10000
+	device_parameter_defaults['trace_output_directory'] = trace_directory
+	device_parameter_defaults['metrics_output_directory'] = metrics_directory
+	Defaults.ApplyDeviceID(device_parameter_defaults, 0, num_channels)
+	video_enabled_flag = [video_enabled for i in range(num_channels)]
+	
+	mq_front_to_back = [Queue() for i in range(num_channels)]
+	mq_back_to_front = [Queue() for i in range(num_channels)]
+	mq_back_to_vlogger = [Queue() if video_enabled == True else None for i in range(num_channels)]
+	mq_vlogger_to_front = [Queue() if video_enabled == True else None for i in range(num_channels)]
+	event_vlogger_fault = [Event() if video_enabled == True else None for i in range(num_channels)]
+	event_back_to_front = [{'calibration_zeroed_flag': Event(), 'gradient_detect_flag': Event(), 'ramp_running_flag': Event()} for i in range(num_channels)]
+	mq_timestamp = ['' for i in range(num_channels)]
+	telemetry_rings = [TelemetryRing.TelemetryRing(capacity = device_parameter_defaults['telemetry_ring_capacity'], create = True) for i in range(num_channels)]
+	frame_buffers = FrameBuffer.CreateFrameBuffers(device_parameter_defaults, video_enabled_flag)
+	
+	process_vlogger = []
+	if video_enabled == True:
+		# Only needed for the video runs.
+		import VideoHandler
+		process_vlogger = [Process(target = RunQuietly, args = (os.path.join(run_directory, 'video_handler_' + str(i) + '.txt'), VideoHandler.VideoHandler, (i, True, device_parameter_defaults, mq_back_to_vlogger[i], mq_vlogger_to_front[i], mq_timestamp[i], event_vlogger_fault[i], False, video_device, frame_buffers[i].name if frame_buffers[i] is not None else None, telemetry_rings[i].name))) for i in range(num_channels)]
+		for current_vlogger in process_vlogger:
+			current_vlogger.start()
+	back_end_args = (device_parameter_defaults, num_channels, mq_front_to_back, mq_back_to_front, mq_back_to_vlogger, mq_timestamp, event_vlogger_fault, event_back_to_front, video_enabled_flag, 0, time_step, False, device_parameter_defaults['drive_mode'], [telemetry_rings[i].name for i in range(num_channels)])
+	process_back_end = Process(target = RunQuietly, args = (os.path.join(run_directory, 'back_end.txt'), BackEnd.BackEnd, back_end_args))
+	process_back_end.start()
+	
+	# Wait for the back end to send each channel its datum time, which it does once it has connected.
+	for i in range(num_channels):
+		while True:
+			opcode, payload = mq_back_to_front[i].get(timeout = 30.0)
+			if opcode == Messages.FrontEndOp.NEW_DATUM_TIME:
+				break
+			elif opcode == Messages.FrontEndOp.ALL_SHUTDOWN_CONFIRM:
+				raise RuntimeError('Back end failed to start, see ' + os.path.join(run_directory, 'back_end.txt'))
+	for i in range(num_channels):
+		mq_front_to_back[i].put(Messages.Message(Messages.BackEndOp.LOGGING_RATE, logging_rate))
+		mq_front_to_back[i].put(Messages.Message(Messages.BackEndOp.SETPOINT, 10.0))
+		if freeze_detection == True:
+			mq_front_to_back[i].put(Messages.Message(Messages.BackEndOp.FREEZE_DETECTION, True))
+		mq_front_to_back[i].put(Messages.Message(Messages.BackEndOp.START_LOGGING, log_directory, False, False))
+	
+	pids = {'back_end': process_back_end.pid}
+	for i in range(len(process_vlogger)):
+		pids['video_handler_' + str(i)] = process_vlogger[i].pid
+	cpu_start = {name: ProcessCPUSeconds(pid) for name, pid in pids.items()}
+	cpu_start['benchmark'] = time.process_time()
+	window_start_ns = time.perf_counter_ns()
+	window_end = time.perf_counter() + (ticks * time_step)
+	
+	# Stand in for the front end update polls, recording how much is waiting each time.
+	queue_depths = {'front_to_back': [], 'back_to_front': [], 'back_to_vlogger': [], 'vlogger_to_front': [], 'telemetry_ring': []}
+	records_received = 0
+	while time.perf_counter() < window_end:
+		time.sleep(poll_interval)
+		for i in range(num_channels):
+			queue_depths['front_to_back'].append(Utilities.QueueDepth(mq_front_to_back[i]))
+			queue_depths['back_to_front'].append(Utilities.QueueDepth(mq_back_to_front[i]))
+			records = telemetry_rings[i].ReadNew()
+			queue_depths['telemetry_ring'].append(len(records))
+			records_received += len(records)
+			while True:
+				try:
+					mq_back_to_front[i].get(False)
+				except queue.Empty:
+					break
+			if video_enabled == True:
+				queue_depths['back_to_vlogger'].append(Utilities.QueueDepth(mq_back_to_vlogger[i]))
+				if frame_buffers[i] is not None:
+					frame_buffers[i].ReadLatest()
+				else:
+					queue_depths['vlogger_to_front'].append(Utilities.QueueDepth(mq_vlogger_to_front[i]))
+					while True:
+						try:
+							mq_vlogger_to_front[i].get(False)
+						except queue.Empty:
+							break
+	window_end_ns = time.perf_counter_ns()
+	duration = (window_end_ns - window_start_ns) / 1e9
+	cpu_end = {name: ProcessCPUSeconds(pid) for name, pid in pids.items()}
+	cpu_end['benchmark'] = time.process_time()
+	
+	for i in range(num_channels):
+		mq_front_to_back[i].put(Messages.Message(Messages.BackEndOp.STOP_LOGGING))
+		mq_front_to_back[i].put(Messages.Message(Messages.BackEndOp.SHUT_DOWN))
+	for i in range(num_channels):
+		while True:
+			opcode, payload = mq_back_to_front[i].get(timeout = 30.0)
+			if opcode == Messages.FrontEndOp.SHUT_DOWN_CONFIRM:
+				break
+		if ((video_enabled == True) and (frame_buffers[i] is None)):
+			while True:
+				try:
+					mq_vlogger_to_front[i].get(timeout = 0.5)
+				except queue.Empty:
+					break
+	for current_vlogger in process_vlogger:
+		current_vlogger.join()
+	process_back_end.join()
+	for frame_buffer in frame_buffers:
+		if frame_buffer is not None:
+			frame_buffer.Close()
+			frame_buffer.Unlink()
+	dropped_records = 0
+	for telemetry_ring in telemetry_rings:
+		records_received += len(telemetry_ring.ReadNew())
+		dropped_records += telemetry_ring.dropped_records
+		telemetry_ring.Close()
+		telemetry_ring.Unlink()
+	
+	spans = LoadTraceSpans(trace_directory, window_start_ns / 1000.0, window_end_ns / 1000.0)
+	tick_starts = np.array(sorted([span['ts'] for span in spans.get('tick', [])]))
+	tick_durations = [span['dur'] for span in spans.get('tick', [])]
+	serial_durations = []
+	for name in BACKEND_SERIAL_SPANS:
+		serial_durations.extend([span['dur'] for span in spans.get(name, [])])
+	log_rows = sum([span['args']['rows'] for span in spans.get('log_write', [])])
+	log_write_seconds = sum([span['dur'] for span in spans.get('log_write', [])]) / 1e6
+	log_bytes = 0
+	for file_path in glob.glob(os.path.join(log_directory, '*', '*.csv')):
+		log_bytes += os.path.getsize(file_path)
+	
+	result = {'channels': num_channels, 'time_step': time_step, 'logging_rate': logging_rate, 'video': video_enabled, 'duration': duration, 
+	          'ticks': len(tick_starts), 'tick_overruns': len([tick_duration for tick_duration in tick_durations if tick_duration > (time_step * 1e6)])}
+	# Jitter is how far each tick started from one time-step after the previous one.
+	for key, value in Statistics(np.abs(np.diff(tick_starts) - (time_step * 1e6)) if len(tick_starts) > 1 else [], 1e-3).items():
+		result['tick_jitter_ms_' + key] = value
+	for key, value in Statistics(tick_durations, 1e-3).items():
+		result['tick_duration_ms_' + key] = value
+	for key, value in Statistics(serial_durations, 1e-3).items():
+		result['serial_call_ms_' + key] = value
+	result['serial_calls'] = len(serial_durations)
+	result['log_rows'] = log_rows
+	result['log_rows_per_sec'] = log_rows / duration
+	result['log_bytes'] = log_bytes
+	result['log_write_ms_per_row'] = (1e3 * log_write_seconds / log_rows) if log_rows > 0 else None
+	result['frames_written'] = len(spans.get('frame_write', []))
+	result['telemetry_records'] = records_received
+	result['telemetry_dropped'] = dropped_records
+	for name in cpu_start:
+		if ((cpu_start[name] is None) or (cpu_end[name] is None)):
+			result['cpu_percent_' + name] = None
+		else:
+			result['cpu_percent_' + name] = 100.0 * (cpu_end[name] - cpu_start[name]) / duration
+	for name, depths in queue_depths.items():
+		depths = [depth for depth in depths if depth is not None]
+		result['queue_depth_max_' + name] = max(depths) if len(depths) > 0 else None
+	
+	if keep_output == True:
+		result['output_directory'] = run_directory
+	else:
+		shutil.rmtree(run_directory, ignore_errors = True)
+	return result
+
+FRAME_TRANSPORTS = ['queue', 'shared_memory']
+
+def FrameProducer(transport, width, height, frame_rate, duration, mq_frames, frame_buffer_name, mq_results, start_event):
+	# Stands in for a video handler in live view. Each frame is annotated as a PIL image (as VideoHandler does) and sent to
+	# the front end either on the queue, where it is pickled and piped, or through the shared memory frame buffer.
+	if transport == 'shared_memory':
+		frame_buffer = FrameBuffer.FrameBuffer(frame_buffer_name)
+	frame = np.random.randint(0, 256, (height, width, 3), dtype = np.uint8)
+	start_event.wait()
+	put_times = []
+	frames = int(duration * frame_rate)
+	next_frame = time.perf_counter()
+	for frame_number in range(frames):
+		next_frame += 1.0 / frame_rate
+		frame[:16, :16] = frame_number % 256
+		put_start = time.perf_counter()
+		image = Image.fromarray(frame)
+		if transport == 'shared_memory':
+			frame_buffer.Write(np.asarray(image), time.time())
+		else:
+			mq_frames.put(image)
+		put_times.append(time.perf_counter() - put_start)
+		sleep_time = next_frame - time.perf_counter()
+		if sleep_time > 0.0:
+			time.sleep(sleep_time)
+	if transport == 'shared_memory':
+		frame_buffer.Close()
+	mq_results.put(put_times)
+
+def RunFrameBenchmark(transport, width, height, frame_rate, duration, poll_interval = 0.05):
+	# The front end polls every poll_interval and only wants the newest frame, as an image ready for ImageTk.PhotoImage.
+	mq_frames = Queue()
+	mq_results = Queue()
+	start_event = Event()
+	frame_buffer = None
+	frame_buffer_name = None
+	if transport == 'shared_memory':
+		frame_buffer = FrameBuffer.FrameBuffer(max_width = width, max_height = height, create = True)
+		frame_buffer_name = frame_buffer.name
+	process_producer = Process(target = FrameProducer, args = (transport, width, height, frame_rate, duration, mq_frames, frame_buffer_name, mq_results, start_event))
+	process_producer.start()
+	
+	poll_times = []
+	frames_shown = 0
+	cpu_start = {'producer': ProcessCPUSeconds(process_producer.pid), 'front_end': time.process_time()}
+	start_event.set()
+	end_time = time.perf_counter() + duration
+	while time.perf_counter() < end_time:
+		time.sleep(poll_interval)
+		poll_start = time.perf_counter()
+		image = None
+		if frame_buffer is not None:
+			frame, timestamp = frame_buffer.ReadLatest()
+			if frame is not None:
+				image = Image.fromarray(frame)
+		else:
+			while True:
+				try:
+					image = mq_frames.get(False)
+				except queue.Empty:
+					break
+		if image is not None:
+			frames_shown += 1
+		poll_times.append(time.perf_counter() - poll_start)
+	cpu_end = {'producer': ProcessCPUSeconds(process_producer.pid), 'front_end': time.process_time()}
+	put_times = mq_results.get()
+	while True:
+		try:
+			mq_frames.get(timeout = 0.1)
+		except queue.Empty:
+			break
+	process_producer.join()
+	
+	torn_frames = 0
+	if frame_buffer is not None:
+		torn_frames = frame_buffer.torn_frames
+		frame_buffer.Close()
+		frame_buffer.Unlink()
+	result = {'transport': transport, 'resolution': str(width) + 'x' + str(height), 'frame_rate': frame_rate, 'duration': duration, 
+	          'frames_sent': len(put_times), 'frames_shown': frames_shown, 'torn_frames': torn_frames, 
+	          'put_ms_mean': 1e3 * float(np.mean(put_times)), 'poll_ms_mean': 1e3 * float(np.mean(poll_times)), 'poll_ms_max': 1e3 * float(np.max(poll_times))}
+	for name in cpu_start:
+		if ((cpu_start[name] is None) or (cpu_end[name] is None)):
+			result['cpu_percent_' + name] = None
+		else:
+			result['cpu_percent_' + name] = 100.0 * (cpu_end[name] - cpu_start[name]) / duration
+	return result
+
+OVERLAY_TEXT = ['2021/06/01 12:00:00 BST', '#         : 1234', 'T (°C) : -23.456', 'SP (°C): -23.5', 'SIMULATION RUNNING!']
+
+def LegacyOverlay(frame, font):
+	# How VideoHandler used to stamp a logged frame: convert to RGB, make a PIL image and draw the text with FreeType.
+	# (OpenCV is only imported where it is needed, as for the video runs of the back end benchmark.)
+	import cv2
+	rgb_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+	draw_text = ImageDraw.Draw(rgb_image)
+	for i, row in enumerate(OVERLAY_TEXT):
+		draw_text.text((0, i * 10), row, font = font, fill = "#0000FF")
+	return rgb_image
+
+def RunOverlayBenchmark(width, height, repeats):
+	# Per-frame cost of stamping the overlay text on a camera frame, the old way and with Overlay.OverlayRenderer, on
+	# its own (as for a logged frame, written as BGR) and with the RGB conversion needed for the front end.
+	import cv2
+	frame = np.random.randint(0, 256, (height, width, 3), dtype = np.uint8)
+	font = ImageFont.truetype('./DejaVuSansMono.ttf', 12)
+	overlay = Overlay.OverlayRenderer('./DejaVuSansMono.ttf', 12, colour = (255, 0, 0))
+	rgb_frame = np.empty_like(frame)
+	def OverlayOnly(frame):
+		return overlay.Draw(frame.copy(), OVERLAY_TEXT, line_spacing = 10)
+	def OverlayRGB(frame):
+		# As VideoHandler.PublishFrame converts into the frame buffer.
+		return cv2.cvtColor(overlay.Draw(frame.copy(), OVERLAY_TEXT, line_spacing = 10), cv2.COLOR_BGR2RGB, dst = rgb_frame)
+	return {'resolution': str(width) + 'x' + str(height), 
+	        'legacy_us': TimePerCall(lambda frame: LegacyOverlay(frame, font), frame, repeats) / 1e3, 
+	        'overlay_us': TimePerCall(OverlayOnly, frame, repeats) / 1e3, 
+	        'overlay_rgb_us': TimePerCall(OverlayRGB, frame, repeats) / 1e3}
+
+def PrintTable(results, columns):
+	widths = [max(len(column), max([len(FormatValue(result[column])) for result in results])) for column in columns]
+	print('  '.join([column.rjust(width) for column, width in zip(columns, widths)]))
+	for result in results:
+		print('  '.join([FormatValue(result[column]).rjust(width) for column, width in zip(columns, widths)]))
+
+def FormatValue(value):
+	if type(value) is float:
+		return str(round(value, 3))
+	return str(value)
+
+def TelemetryCommand(args):
+	results = []
+	for time_step in args.time_steps:
+		for num_channels in args.channels:
+			for transport in args.transports:
+				result = RunTelemetryBenchmark(transport, num_channels, time_step, args.duration)
+				results.append(result)
+				if args.json == False:
+					print(transport + ', ' + str(num_channels) + ' channels, ' + str(time_step) + ' s time-step done.', file = sys.stderr)
+	if args.json == True:
+		print(json.dumps(results, indent = 2))
+	else:
+		PrintTable(results, ['transport', 'channels', 'time_step', 'records_sent', 'records_received', 'messages_per_sec', 'put_us_per_tick_mean', 
+		                     'put_us_per_tick_max', 'poll_us_mean', 'poll_us_max', 'latency_ms_mean'])
+
+def MessagesCommand(args):
+	results = RunMessageBenchmark(args.repeats)
+	if args.json == True:
+		print(json.dumps(results, indent = 2))
+	else:
+		PrintTable(results, ['message', 'legacy_route_ns', 'dispatch_route_ns', 'legacy_pickle_ns', 'dispatch_pickle_ns', 'legacy_bytes', 'dispatch_bytes'])
+
+def BackEndCommand(args):
+	results = []
+	for video in args.video:
+		for logging_rate in args.logging_rates:
+			for time_step in args.time_steps:
+				for num_channels in args.channels:
+					result = RunBackEndBenchmark(num_channels, time_step, logging_rate, (video == 'on'), args.ticks, args.keep, video_device = args.camera, freeze_detection = args.freeze_detection)
+					results.append(result)
+					if args.json == False:
+						print(str(num_channels) + ' channels, ' + str(time_step) + ' s time-step, logging every ' + str(logging_rate) + ' ticks, video ' + video + ' done.', file = sys.stderr)
+	if args.json == True:
+		print(json.dumps(results, indent = 2))
+	else:
+		PrintTable(results, ['channels', 'time_step', 'logging_rate', 'video', 'ticks', 'tick_overruns', 'tick_jitter_ms_mean', 'tick_jitter_ms_p99', 
+		                     'tick_duration_ms_mean', 'serial_call_ms_mean', 'serial_call_ms_p99', 'log_rows_per_sec', 'cpu_percent_back_end', 
+		                     'queue_depth_max_back_to_front', 'queue_depth_max_telemetry_ring'])
+
+def FramesCommand(args):
+	results = []
+	for frame_rate in args.frame_rates:
+		for resolution in args.resolutions:
+			width, height = [int(i) for i in resolution.split('x')]
+			for transport in args.transports:
+				result = RunFrameBenchmark(transport, width, height, frame_rate, args.duration)
+				results.append(result)
+				if args.json == False:
+					print(transport + ', ' + resolution + ', ' + str(frame_rate) + ' frames/s done.', file = sys.stderr)
+	if args.json == True:
+		print(json.dumps(results, indent = 2))
+	else:
+		PrintTable(results, ['transport', 'resolution', 'frame_rate', 'frames_sent', 'frames_shown', 'torn_frames', 'put_ms_mean', 'poll_ms_mean', 
+		                     'poll_ms_max', 'cpu_percent_producer', 'cpu_percent_front_end'])
+
+def OverlayCommand(args):
+	results = []
+	for resolution in args.resolutions:
+		width, height = [int(i) for i in resolution.split('x')]
+		results.append(RunOverlayBenchmark(width, height, args.repeats))
+	if args.json == True:
+		print(json.dumps(results, indent = 2))
+	else:
+		PrintTable(results, ['resolution', 'legacy_us', 'overlay_us', 'overlay_rgb_us'])
+
+def Main(argv = None):
+	parser = argparse.ArgumentParser(description = 'Cold Stage 4 benchmarks.')
+	subparsers = parser.add_subparsers(dest = 'benchmark')
+	subparsers.required = True
+	
+	parser_telemetry = subparsers.add_parser('telemetry', help = 'Back end to front end telemetry throughput for each transport.')
+	parser_telemetry.add_argument('--channels', type = int, nargs = '+', default = [1, 2, 4, 8, 16])
+	parser_telemetry.add_argument('--time-steps', type = float, nargs = '+', default = [0.05, 0.1, 0.2])
+	parser_telemetry.add_argument('--transports', nargs = '+', choices = TELEMETRY_TRANSPORTS, default = TELEMETRY_TRANSPORTS)
+	parser_telemetry.add_argument('--duration', type = float, default = 2.0, help = 'Seconds per run.')
+	parser_telemetry.add_argument('--json', action = 'store_true')
+	parser_telemetry.set_defaults(function = TelemetryCommand)
+	
+	parser_messages = subparsers.add_parser('messages', help = 'Per-message routing and serialisation cost, old format vs Messages.')
+	parser_messages.add_argument('--repeats', type = int, default = 100000)
+	parser_messages.add_argument('--json', action = 'store_true')
+	parser_messages.set_defaults(function = MessagesCommand)
+	
+	parser_backend = subparsers.add_parser('backend', help = 'The back end control loop running against the simulated hardware.')
+	parser_backend.add_argument('--channels', type = int, nargs = '+', choices = [1, 2, 3, 4], default = [1, 4])
+	parser_backend.add_argument('--time-steps', type = float, nargs = '+', default = [0.2])
+	parser_backend.add_argument('--logging-rates', type = int, nargs = '+', default = [1], help = 'Log every n ticks.')
+	parser_backend.add_argument('--video', nargs = '+', choices = ['off', 'on'], default = ['off'])
+	parser_backend.add_argument('--camera', default = 'synthetic', type = lambda camera: int(camera) if camera.isdigit() else camera, help = 'Video device for the video runs, a camera number or synthetic.')
+	parser_backend.add_argument('--freeze-detection', action = 'store_true', help = 'Run freeze detection on the logged video.')
+	parser_backend.add_argument('--ticks', type = int, default = 100, help = 'Ticks per run.')
+	parser_backend.add_argument('--keep', action = 'store_true', help = 'Keep the logs, traces and console output of each run.')
+	parser_backend.add_argument('--json', action = 'store_true')
+	parser_backend.set_defaults(function = BackEndCommand)
+	
+	parser_frames = subparsers.add_parser('frames', help = 'Video handler to front end frame transport, queue vs shared memory frame buffer.')
+	parser_frames.add_argument('--resolutions', nargs = '+', default = ['320x240', '640x480', '1280x720'])
+	parser_frames.add_argument('--frame-rates', type = float, nargs = '+', default = [4.0, 15.0], help = 'Frames per second sent.')
+	parser_frames.add_argument('--transports', nargs = '+', choices = FRAME_TRANSPORTS, default = FRAME_TRANSPORTS)
+	parser_frames.add_argument('--duration', type = float, default = 3.0, help = 'Seconds per run.')
+	parser_frames.add_argument('--json', action = 'store_true')
+	parser_frames.set_defaults(function = FramesCommand)
+	
+	parser_overlay = subparsers.add_parser('overlay', help = 'Per-frame cost of the text overlay, PIL vs Overlay.OverlayRenderer.')
+	parser_overlay.add_argument('--resolutions', nargs = '+', default = Defaults.DeviceParameterDefaults()['webcam_available_dimensions'])
+	parser_overlay.add_argument('--repeats', type = int, default = 200)
+	parser_overlay.add_argument('--json', action = 'store_true')
+	parser_overlay.set_defaults(function = OverlayCommand)
+	
+	args = parser.parse_args(argv)
+	args.function(args)
+
+if __name__ == '__main__':
+	Main()
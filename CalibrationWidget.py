@@ -35,6 +35,7 @@ import numpy as np
 import csv
 
 import Utilities
+import Messages
 
 class CalibrationWidget():
 	def __init__ (self, parent, channel_id, comms_unique_id, root_tk, device_parameter_defaults, mq_front_to_back, event_back_to_front):
@@ -70,11 +71,11 @@ class CalibrationWidget():
 		self.original_logging_rate = logging_rate
 		
 		# Ensure the stage is 'off' to begin.
-		self.mq_front_to_back.put(('Off',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.OFF))
 		
 		# Set the time-step and logging rate to the calibration defaults.
-		self.mq_front_to_back.put(('SetTimeStep', self.device_parameter_defaults['tc_calibration_time_step']))
-		self.mq_front_to_back.put(('LoggingRate', self.device_parameter_defaults['tc_calibration_logging_rate']))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SET_TIME_STEP, self.device_parameter_defaults['tc_calibration_time_step']))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.LOGGING_RATE, self.device_parameter_defaults['tc_calibration_logging_rate']))
 		
 		# Check if temporary file already exists and if so, delete it.
 		file_exists = os.path.isfile(self.tc_calibration_temp_data_filepath)
@@ -86,7 +87,7 @@ class CalibrationWidget():
 			pass
 		
 		# Zero the thermocouple calibration before logging the calibration ramp.
-		self.mq_front_to_back.put(('CalibrationOff',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.CALIBRATION_OFF))
 		
 		self.mode = 0
 		self.PollEvent()
@@ -109,8 +110,8 @@ class CalibrationWidget():
 				# and then send the command to set the cold-stage to 100% throttle mode to begin the auto-ranging.
 				self.event_back_to_front['gradient_detect_flag'].set()
 				print('Determining minimum temperature at which ' + str(self.device_parameter_defaults['auto_range_min_cooling_rate_per_min']) + ' °C / minute achieveable...')
-				self.mq_front_to_back.put(('SetCalibrationLimit', self.calibration_limit))
-				self.mq_front_to_back.put(('Throttle', self.device_parameter_defaults['auto_range_max_throttle']))
+				self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SET_CALIBRATION_LIMIT, self.calibration_limit))
+				self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.THROTTLE, self.device_parameter_defaults['auto_range_max_throttle']))
 				self.mode = 3
 				repeat_poll_flag = True
 			elif self.mode == 3:
@@ -120,9 +121,9 @@ class CalibrationWidget():
 						minimum_temperature_reached = float(temporary_temperature_file.readline())
 					calibration_table = self.GenerateCalibrationTable(minimum_temperature_reached, self.temperature_steps)
 					# Start the calibration ramp.
-					self.mq_front_to_back.put(('Ramp', 1, True, None, calibration_table))
+					self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.RAMP, 1, True, None, calibration_table))
 					# Start logging.
-					self.mq_front_to_back.put(('StartLogging', self.tc_calibration_temp_data_filepath, True, True))
+					self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.START_LOGGING, self.tc_calibration_temp_data_filepath, True, True))
 					self.event_back_to_front['ramp_running_flag'].set()
 					self.mode = 4
 				repeat_poll_flag = True
@@ -193,18 +194,18 @@ class CalibrationWidget():
 		# If we are in the main ramp part of the auto-calibration clear the 'ramp running' flag.
 		self.event_back_to_front['ramp_running_flag'].clear()
 		# Stop logging.
-		self.mq_front_to_back.put(('StopLogging',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.STOP_LOGGING))
 		# Cancel the ramp if it's running by turning the stage 'off'.
-		self.mq_front_to_back.put(('Off',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.OFF))
 		# Check if temporary file already exists and if so, delete it.
 		file_exists = os.path.isfile(self.tc_calibration_temp_data_filepath)
 		if file_exists:
 			os.remove(self.tc_calibration_temp_data_filepath)
 		# Re-load and enable the former thermocouple calibration.
-		self.mq_front_to_back.put(('CalibrationOn',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.CALIBRATION_ON))
 		# Revert to the original time_step and logging_rate.
-		self.mq_front_to_back.put(('SetTimeStep', self.original_time_step))
-		self.mq_front_to_back.put(('LoggingRate', self.original_logging_rate))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SET_TIME_STEP, self.original_time_step))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.LOGGING_RATE, self.original_logging_rate))
 		self.parent.UnbindParentClicks(self.parent.top)
 		if self.parent.video_enabled == True:
 			self.parent.UnbindParentClicks(self.parent.video_window)
@@ -213,8 +214,8 @@ class CalibrationWidget():
 		
 	def Finish(self):
 		# Revert to the original time_step and logging_rate.
-		self.mq_front_to_back.put(('SetTimeStep', self.original_time_step))
-		self.mq_front_to_back.put(('LoggingRate', self.original_logging_rate))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SET_TIME_STEP, self.original_time_step))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.LOGGING_RATE, self.original_logging_rate))
 		
 		# We now have the calibration ramp data recorded. Next we need to parse it to get our averaged multi-point
 		# calibration data, then we need to fit that to get the calibration coefficients. Lastly, we backup the old
@@ -316,9 +317,9 @@ class CalibrationWidget():
 		new_temp_limit_file.close()
 		
 		# Re-load and enable the thermocouple calibration (freshly updated!).
-		self.mq_front_to_back.put(('CalibrationOn',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.CALIBRATION_ON))
 		# Turn the stage 'off'.
-		self.mq_front_to_back.put(('Off',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.OFF))
 		
 		# And we are done!
 		print('*** AUTO-CALIBRATION COMPLETE ***')
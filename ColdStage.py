@@ -35,74 +35,39 @@ import tkinter as tk
 import tkinter.constants
 import tkinter.messagebox
 import os
+import argparse
 
 import StartUpConfig
+import Defaults
 import FrontEnd
 import BackEnd
 import VideoHandler
 import Utilities
+import TelemetryRing
+import FrameBuffer
+import Tracing
+import Profiling
+import WebService
 
 class CoolerControl():
-	def __init__ (self):
-		self.device_parameter_defaults = {
-			# Device defaults.
-			'comms_baud_rate': 57600,
-			'timing_info_flag' : 0,
-			'time_step' : 0.2,
-			# Simulation defaults.
-			'simulation_number_of_channels': 1,
-			'simulation_peltier_power_ratio': 8.0,
-			'simulation_hsk_temp_variation_active': False,
-			'simulation_hsk_temp_variation_amplitude': 0.5,
-			'simulation_hsk_temp_variation_period': 40.0,
-			'simulation_display_hsk_temp': False,
-			# Channel defaults.
-			#	Logging
-			'stop_logging_at_profile_end_flag' : [1, 1, 1, 1],
-			'start_logging_at_profile_start_flag' : [1, 1, 1, 1],
-			'logging_rate' : [1, 5, 5, 5],
-			#	Plotting
-			'enable_plotting_flag' : [1, 0, 0, 0],
-			'plot_update_rate' : [5, 5, 5, 5],
-			'plot_span' : [2000, 2000, 2000, 2000],
-			#	Video
-			'webcam_image_file_format': '.jpg',
-			'webcam_available_dimensions' : ["320x240", "640x480", "800x600", "1280x720"],
-			'webcam_default_dimensions': ["640x480", "320x240", "320x240", "320x240"],
-			'log_video_split_flag' : [0, 0, 0, 0],
-			#	Control
-			'drive_mode' : [2, 2, 2, 2],
-			'default_pid_coefficients': [{'P' : 0.0, 'I': 0.0, 'D': 0.0, 'power_multiplier': 1.0}, {'P' : 0.0, 'I': 0.0, 'D': 0.0, 'power_multiplier': 1.0}, {'P' : 0.0, 'I': 0.0, 'D': 0.0, 'power_multiplier': 1.0}, {'P' : 0.0, 'I': 0.0, 'D': 0.0, 'power_multiplier': 1.0}],
-			'user_pid_coefficients_filepath': ['./calibrations/*/channel_' + str(i) + '/user_pid_coefficients.csv' for i in range(4)],
-			'max_temperature_limit': [30.0, 30.0, 30.0, 30.0],
-			'min_temperature_limit': [-45.0, -45.0, -45.0, -45.0],
-			'overload_fault_threshold_seconds': 10.0,
-			#	Calibration:
-			'tc_calibration_time_step': 0.2,
-			'tc_calibration_logging_rate': 5,
-			'auto_range_max_throttle': 100.0,
-			'auto_range_min_cooling_rate_per_min': -1.0,
-			'calibration_fit_polynomial_order': 7,
-			'auto_calibration_temperature_steps': 10,
-			'prt_calibration_coeffs_filepath' : ['./calibrations/*/channel_' + str(i) + '/prt_calibration_coeffs.csv' for i in range(4)],
-			'tc_calibration_temp_data_filepath': ['./calibrations/*/channel_' + str(i) + '/tc_calibration_log_data_TEMP.csv' for i in range(4)],
-			'tc_calibration_final_data_filepath': ['./calibrations/*/channel_' + str(i) + '/tc_calibration_log_data.csv' for i in range(4)],
-			'tc_calibration_coeffs_filepath' : ['./calibrations/*/channel_' + str(i) + '/tc_calibration_coeffs.csv' for i in range(4)],
-			'calibrated_temp_limits_filepath': ['./calibrations/*/channel_' + str(i) + '/calibrated_temp_limits.csv' for i in range(4)],
-			#	Ramping
-			'path_to_ramp_profile' : ["./ramp_profile.csv" for i in range(4)],
-			'ramp_repeats' : [1, 1, 1, 1]
-		}
+	def __init__ (self, parameter_overrides = None):
+		self.device_parameter_defaults = Defaults.DeviceParameterDefaults()
+		# Launch options (see below) replace the defaults of the same name.
+		if parameter_overrides is not None:
+			self.device_parameter_defaults.update(parameter_overrides)
 		
 		self.start_up_config = StartUpConfig.StartUpConfig(self.device_parameter_defaults)
 		self.action = self.start_up_config.action.get()
 		
 		if self.action == 'start':
+			Tracing.InitialiseTracer('Front end', self.device_parameter_defaults)
 			self.comms_baud = self.device_parameter_defaults['comms_baud_rate']
 			self.comms_unique_id = self.start_up_config.device_unique_id.get()
 			self.comms_port = self.start_up_config.device_port.get()
 			self.num_channels = self.start_up_config.device_number_of_channels.get()
-			self.video_device_id = [int(self.start_up_config.camera_id.get()), 0, 0, 0]
+			# A camera number, or the synthetic camera (see SyntheticCamera.py).
+			camera_id = self.start_up_config.camera_id.get()
+			self.video_device_id = [int(camera_id) if camera_id.isdigit() else camera_id, 0, 0, 0]
 			self.video_enabled = [not bool(self.start_up_config.video_disabled_flag.get()), 0, 0, 0]
 			self.timing_flag = self.device_parameter_defaults['timing_info_flag']
 			self.time_step = self.device_parameter_defaults['time_step']
@@ -114,13 +79,7 @@ class CoolerControl():
 			elif self.num_channels > 4:
 				self.num_channels = 4
 			
-			# Replace wildcards (*) in the default paths with unique device identifier.
-			self.device_parameter_defaults['prt_calibration_coeffs_filepath'] = [self.device_parameter_defaults['prt_calibration_coeffs_filepath'][i].split('*')[0] + str(self.comms_unique_id) + self.device_parameter_defaults['prt_calibration_coeffs_filepath'][i].split('*')[1] for i in range(self.num_channels)]
-			self.device_parameter_defaults['tc_calibration_temp_data_filepath'] = [self.device_parameter_defaults['tc_calibration_temp_data_filepath'][i].split('*')[0] + str(self.comms_unique_id) + self.device_parameter_defaults['tc_calibration_temp_data_filepath'][i].split('*')[1] for i in range(self.num_channels)]
-			self.device_parameter_defaults['tc_calibration_final_data_filepath'] = [self.device_parameter_defaults['tc_calibration_final_data_filepath'][i].split('*')[0] + str(self.comms_unique_id) + self.device_parameter_defaults['tc_calibration_final_data_filepath'][i].split('*')[1] for i in range(self.num_channels)]
-			self.device_parameter_defaults['tc_calibration_coeffs_filepath'] = [self.device_parameter_defaults['tc_calibration_coeffs_filepath'][i].split('*')[0] + str(self.comms_unique_id) + self.device_parameter_defaults['tc_calibration_coeffs_filepath'][i].split('*')[1] for i in range(self.num_channels)]
-			self.device_parameter_defaults['calibrated_temp_limits_filepath'] = [self.device_parameter_defaults['calibrated_temp_limits_filepath'][i].split('*')[0] + str(self.comms_unique_id) + self.device_parameter_defaults['calibrated_temp_limits_filepath'][i].split('*')[1] for i in range(self.num_channels)]
-			self.device_parameter_defaults['user_pid_coefficients_filepath'] = [self.device_parameter_defaults['user_pid_coefficients_filepath'][i].split('*')[0] + str(self.comms_unique_id) + self.device_parameter_defaults['user_pid_coefficients_filepath'][i].split('*')[1] for i in range(self.num_channels)]
+			Defaults.ApplyDeviceID(self.device_parameter_defaults, self.comms_unique_id, self.num_channels)
 			self.simulation_flag = (self.comms_port == 'none')
 			
 			# Create a root tkinter window, and then hide it.
@@ -135,8 +94,22 @@ class CoolerControl():
 			self.mq_back_to_front = [Queue() for i in range(self.num_channels)]
 			self.mq_back_to_vlogger = [Queue() if self.video_enabled[i] == True else None for i in range(self.num_channels)]
 			
-			# Image queue(s).
+			# Per-tick telemetry goes from the back end to the front ends through shared memory ring buffers (if enabled),
+			# leaving the back_to_front queues for events only.
+			if self.device_parameter_defaults['telemetry_transport'] == 'shared_memory':
+				self.telemetry_rings = [TelemetryRing.TelemetryRing(capacity = self.device_parameter_defaults['telemetry_ring_capacity'], create = True) for i in range(self.num_channels)]
+				self.telemetry_ring_names = [self.telemetry_rings[i].name for i in range(self.num_channels)]
+			else:
+				self.telemetry_rings = [None for i in range(self.num_channels)]
+				self.telemetry_ring_names = [None for i in range(self.num_channels)]
+			
+			# Remote viewers (if enabled) are served from this process, from the telemetry the front ends receive.
+			WebService.StartService(self.device_parameter_defaults, self.mq_front_to_back)
+			
+			# Image queue(s), or shared memory frame buffers (if enabled) so that frames are never pickled.
 			self.mq_vlogger_to_front = [Queue() if self.video_enabled[i] == True else None for i in range(self.num_channels)]
+			self.frame_buffers = FrameBuffer.CreateFrameBuffers(self.device_parameter_defaults, self.video_enabled)
+			self.frame_buffer_names = [frame_buffer.name if frame_buffer is not None else None for frame_buffer in self.frame_buffers]
 			# Video fault multiprocessing event.
 			self.event_vlogger_fault = [Event() if self.video_enabled[i] == True else None for i in range(self.num_channels)]
 			# Calibration logging trigger multiprocessing event.
@@ -146,29 +119,38 @@ class CoolerControl():
 			self.InitialiseTimingMonitors(self.timing_flag)
 			
 			# Spawn required video handler processes.
-			self.process_vlogger = [Process(target = VideoHandler.VideoHandler, args = (i, self.simulation_flag, self.device_parameter_defaults, self.mq_back_to_vlogger[i], self.mq_vlogger_to_front[i], self.mq_timestamp[i], self.event_vlogger_fault[i], self.timing_flag, self.video_device_id[i])) for i in range(self.num_channels) if self.video_enabled[i] == True]
+			self.process_vlogger = [Process(target = Profiling.ProfiledTarget(VideoHandler.VideoHandler, 'video_handler', self.device_parameter_defaults), args = (i, self.simulation_flag, self.device_parameter_defaults, self.mq_back_to_vlogger[i], self.mq_vlogger_to_front[i], self.mq_timestamp[i], self.event_vlogger_fault[i], self.timing_flag, self.video_device_id[i], self.frame_buffer_names[i], self.telemetry_ring_names[i])) for i in range(self.num_channels) if self.video_enabled[i] == True]
 			for current_vlogger in self.process_vlogger:
 				current_vlogger.start()
 			
 			# Create instance(s) of the front end object and create a Tkinter variable that it can set when it/they close(s).
 			# These will be polled to determine when all front end windows are closed so we can end the root window mainloop().
 			self.close_action = [tk.StringVar(self.root_tk) for i in range(self.num_channels)]
-			self.front_ends = [FrontEnd.FrontEnd(self, self.root_tk, self.device_parameter_defaults, self.num_channels, i, self.comms_unique_id, self.close_action[i], self.mq_front_to_back[i], self.mq_back_to_front[i], self.mq_vlogger_to_front[i], self.event_back_to_front[i], self.timing_flag, self.timing_monitor[i], self.timing_monitor_kill[i], self.mq_timestamp[i], self.time_step, self.video_enabled[i], self.plotting_enabled[i]) for i in range(self.num_channels)]
+			self.front_ends = [FrontEnd.FrontEnd(self, self.root_tk, self.device_parameter_defaults, self.num_channels, i, self.comms_unique_id, self.close_action[i], self.mq_front_to_back[i], self.mq_back_to_front[i], self.mq_vlogger_to_front[i], self.event_back_to_front[i], self.timing_flag, self.timing_monitor[i], self.timing_monitor_kill[i], self.mq_timestamp[i], self.time_step, self.video_enabled[i], self.plotting_enabled[i], self.telemetry_rings[i], self.frame_buffers[i]) for i in range(self.num_channels)]
 			
 			# Setup a process to run the back end. Pass Queue()s, Event()s etc to allow inter-process communication.
-			self.process_back_end = Process(target = BackEnd.BackEnd, args = (self.device_parameter_defaults, self.num_channels, self.mq_front_to_back, self.mq_back_to_front, self.mq_back_to_vlogger, self.mq_timestamp, self.event_vlogger_fault, self.event_back_to_front, self.video_enabled, self.comms_unique_id, self.time_step, self.timing_flag, self.drive_mode))
+			self.process_back_end = Process(target = Profiling.ProfiledTarget(BackEnd.BackEnd, 'back_end', self.device_parameter_defaults), args = (self.device_parameter_defaults, self.num_channels, self.mq_front_to_back, self.mq_back_to_front, self.mq_back_to_vlogger, self.mq_timestamp, self.event_vlogger_fault, self.event_back_to_front, self.video_enabled, self.comms_unique_id, self.time_step, self.timing_flag, self.drive_mode, self.telemetry_ring_names))
 			self.process_back_end.start()
 			
 			# First call of the function that polls to check if all front end windows have been closed, then spin the root
 			# Tkinter window mainloop() to generate and begin servicing the GUI elements.
 			self.ClosePoll()
+			front_end_profiler = Profiling.Start('front_end', self.device_parameter_defaults)
 			self.root_tk.mainloop()	# That's it, we're live folks!
+			Profiling.Stop(front_end_profiler)
 			
 			# When the user exits and the tkinter mainloop quits, having sent the appropriate shutdown command
 			# to the back end, we wait for it and the video handler to complete, rejoin them, and finish.
 			for current_vlogger in self.process_vlogger:
 				current_vlogger.join()
 			self.process_back_end.join()
+			# With the back end and video handlers finished we can release the telemetry and frame shared memory.
+			for shared_buffer in self.telemetry_rings + self.frame_buffers:
+				if shared_buffer is not None:
+					shared_buffer.Close()
+					shared_buffer.Unlink()
+			WebService.StopService()
+			Tracing.ExportTracer(self.device_parameter_defaults)
 			print('Application closed.')
 		else:
 			print('Application closed.')
@@ -190,7 +172,7 @@ class CoolerControl():
 			self.timing_monitor_kill = [Event() for i in range(self.num_channels)]
 			for i in range(self.num_channels):
 				self.timing_monitor_kill[i].set()
-			self.timing_monitor = [Process(target = Utilities.TimingMonitor, args = (i, self.mq_timestamp[i], self.timing_monitor_kill[i])) for i in range(self.num_channels)]
+			self.timing_monitor = [Process(target = Profiling.ProfiledTarget(Utilities.TimingMonitor, 'timing_monitor', self.device_parameter_defaults), args = (i, self.mq_timestamp[i], self.timing_monitor_kill[i], self.device_parameter_defaults)) for i in range(self.num_channels)]
 			for i in range(self.num_channels):
 				self.timing_monitor[i].start()
 				print('Timing monitor ' + str(i) + ' started...')
@@ -230,4 +212,16 @@ class CoolerControl():
 
 				
 if __name__ == '__main__':
-	cooler_control = CoolerControl()
+	parser = argparse.ArgumentParser(description = 'Cold Stage 4.')
+	parser.add_argument('--profile', nargs = '+', choices = Profiling.PROCESS_NAMES, metavar = 'PROCESS', help = 'Profile these processes: ' + ', '.join(Profiling.PROCESS_NAMES) + '.')
+	parser.add_argument('--profiler', choices = Profiling.PROFILERS, help = 'cprofile (the default) or sampling.')
+	parser.add_argument('--profile-dir', help = 'Where to write the profiles.')
+	args = parser.parse_args()
+	parameter_overrides = {}
+	if args.profile is not None:
+		parameter_overrides['profile_processes'] = args.profile
+	if args.profiler is not None:
+		parameter_overrides['profiler'] = args.profiler
+	if args.profile_dir is not None:
+		parameter_overrides['profile_output_directory'] = args.profile_dir
+	cooler_control = CoolerControl(parameter_overrides)
@@ -35,9 +35,13 @@ import numpy as np
 import Utilities
 import RampManager
 import Logger
+import TelemetryRing
+import Messages
+import Tracing
+import Metrics
 
 class CoolerChannel():
-	def __init__ (self, device_parameter_defaults, backend_object, channel_id, mq_back_to_front, mq_back_to_vlogger, event_vlogger_fault, event_back_to_front, mq_timestamp, logging_rate, drive_mode, timing_flag, video_enabled_flag, comms_manager, time_step, pid_coeffs):
+	def __init__ (self, device_parameter_defaults, backend_object, channel_id, mq_back_to_front, mq_back_to_vlogger, event_vlogger_fault, event_back_to_front, mq_timestamp, logging_rate, drive_mode, timing_flag, video_enabled_flag, comms_manager, time_step, pid_coeffs, telemetry_ring_name):
 		self.current_time = time.time()
 		
 		self.device_parameter_defaults = device_parameter_defaults
@@ -45,15 +49,52 @@ class CoolerChannel():
 		self.channel_id = channel_id
 		self.drive_mode = drive_mode
 		self.comms_manager = comms_manager
-		self.time_step = time_step
+		# Each channel has its own service cadence, in whole back end ticks. While active (or logging) the hardware is 
+		# serviced every active_service_ticks ticks, and the ramp and PID controller are timed to match. While idle and 
+		# not logging it is only serviced about once every idle_service_period seconds, leaving the serial link free for
+		# the channels that need it. Front end messages are handled every tick regardless.
+		self.active_service_ticks = max(1, int(device_parameter_defaults['active_service_ticks'][channel_id]))
+		self.idle_service_period = float(device_parameter_defaults['idle_service_period'][channel_id])
+		self.ticks_since_service = 0
+		self.base_time_step = time_step
+		self.time_step = self.base_time_step * self.active_service_ticks
 		self.pid_coeffs = pid_coeffs
 		self.logging_rate = logging_rate
 		
 		self.mq_back_to_front = mq_back_to_front
 		self.mq_back_to_vlogger = mq_back_to_vlogger
 		self.mq_timestamp = mq_timestamp
+		self.tracer = Tracing.GetTracer()
+		self.metrics = Metrics.GetMetrics()
 		self.event_vlogger_fault = event_vlogger_fault
 		self.event_back_to_front = event_back_to_front
+		# If we have been given a shared memory telemetry ring, per-tick readings go to the front end through it rather 
+		# than through the back_to_front queue.
+		if telemetry_ring_name is not None:
+			self.telemetry_ring = TelemetryRing.TelemetryRing(telemetry_ring_name)
+		else:
+			self.telemetry_ring = None
+		
+		# Handlers for the messages from the front end, see ServiceMessages().
+		self.message_dispatcher = Messages.Dispatcher('Channel ' + str(channel_id) + ' back end')
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.THROTTLE, self.HandleThrottle)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.SETPOINT, self.HandleSetPoint)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.RAMP, self.HandleRamp)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.PID_CONFIG, self.HandlePIDConfig)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.LOGGING_RATE, self.HandleLoggingRate)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.START_LOGGING, self.HandleStartLogging)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.STOP_LOGGING, self.HandleStopLogging)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.SET_TIME_STEP, self.HandleSetTimeStep)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.NEW_DATUM_TIME, self.HandleNewDatumTime)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.CALIBRATION_OFF, self.HandleCalibrationOff)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.CALIBRATION_ON, self.HandleCalibrationOn)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.SET_CALIBRATION_LIMIT, self.HandleSetCalibrationLimit)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.OFF, self.HandleOff)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.CHANGE_VIDEO_RES, self.HandleChangeVideoRes)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.CHANGE_LOG_VIDEO_SPLIT_FLAG, self.HandleChangeLogVideoSplitFlag)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.FREEZE_DETECTION, self.HandleFreezeDetection)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.SHUT_DOWN, self.HandleShutDown)
+		self.message_dispatcher.RegisterHandler(Messages.BackEndOp.ALL_SHUT_DOWN, self.HandleAllShutDown)
 		
 		self.mode = 'idle'
 		self.shut_down_flag = False
@@ -69,6 +110,11 @@ class CoolerChannel():
 		self.log_start_on_profile_start_flag = self.device_parameter_defaults['start_logging_at_profile_start_flag'][self.channel_id]
 		self.log_end_on_profile_end_flag = self.device_parameter_defaults['stop_logging_at_profile_end_flag'][self.channel_id]
 		self.log_video_split_flag = self.device_parameter_defaults['log_video_split_flag'][self.channel_id]
+		# If set, the video handler looks for droplets freezing in the frames of the next log started.
+		self.freeze_detection_flag = False
+		self.log_segment_max_bytes = self.device_parameter_defaults['log_segment_max_bytes'][self.channel_id]
+		self.log_segment_max_seconds = self.device_parameter_defaults['log_segment_max_seconds'][self.channel_id]
+		self.logger_queue_max_rows = self.device_parameter_defaults['logger_queue_max_rows'][self.channel_id]
 		
 		self.setpoint = 'NA'
 		self.throttle_setting = 0.0
@@ -108,28 +154,25 @@ class CoolerChannel():
 		self.backend_object.comms_success_flag = success_flag
 		
 	def ServiceHardware(self):
-		# Send starting timestamp for this update.
-		if self.timing_flag == True:
-			self.mq_timestamp.put([1, time.time()])
+		service_start = self.tracer.Now()
 		comms_success_flag = False	
 		if self.video_enabled_flag == True:
 			if self.video_fault_flag == False:
 				if self.event_vlogger_fault.is_set() == True:
 					self.video_fault_flag = True
-					self.mq_back_to_front.put((2, 'Video_fault'))
+					self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.VIDEO_FAULT))
 			else:
 				if self.event_vlogger_fault.is_set() == False:
 					self.video_fault_flag = False
-					self.mq_back_to_front.put((2, 'Video_success'))
+					self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.VIDEO_SUCCESS))
 		
 		if self.mode == 'idle':
-			# Write timestamp 2 - Initial timestep 'Idle' command sent to Arduino.
-			if self.timing_flag:
-				self.mq_timestamp.put([2, time.time()])
 			# Send the 'Idle' command to the Arduino and receive the current temperature.
 			# We then send the idle command we expect 2 replies (temperature, relative humidity)
 			self.current_time = time.time()
+			span_start = self.tracer.Now()
 			comms_success_flag, responses = self.comms_manager.StageIdle(self.channel_id)
+			self.tracer.Record('idle_call', span_start, tid = self.channel_id)
 		# If the cooler is running in setpoint mode (ie, in 'setpoint', 'precooling' or 'ramping' mode):
 		elif ((self.mode == 'setpoint') or (self.mode == 'profile_setpoint') or (self.mode == 'holding') or (self.mode == 'precooling') or (self.mode == 'ramping') or (self.mode == 'throttle')):
 			if ((self.mode == 'setpoint') or (self.mode == 'profile_setpoint') or (self.mode == 'holding') or (self.mode == 'precooling') or (self.mode == 'ramping')):
@@ -150,8 +193,10 @@ class CoolerChannel():
 						self.event_back_to_front['ramp_running_flag'].clear()
 					if message_to_front_end[0] == True:
 						# If we've reached the end of a state in the ramp profile, update the mode display with the new state.
-						self.mq_back_to_front.put((2, 'Set_mode_label', message_to_front_end[1]))
+						self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_MODE_LABEL, message_to_front_end[1]))
 						print(message_to_front_end[1])
+						if ramp_state_change[0] == True:
+							self.SetLoggerRampState(ramp_state_change[1])
 						if ((self.force_video_off == False) and (self.video_enabled_flag == True) and (ramp_state_change[0] == True) and (self.logging_flag == True) and (self.log_video_split_flag == True)):
 							# Change the video logger path if splitting the video log according to state.
 							self.SwitchVideoLogPath(self.base_log_path + ramp_state_change[1] + '/')
@@ -162,7 +207,9 @@ class CoolerChannel():
 			# When we call out with a throttle command, the command itself expects one reply (a newline character)
 			# We then send the throttle value itself, expecting one reply (temperature).
 			self.current_time = time.time()
+			span_start = self.tracer.Now()
 			comms_success_flag, responses = self.comms_manager.StageThrottle(self.throttle_setting, self.channel_id)
+			self.tracer.Record('throttle_call', span_start, tid = self.channel_id)
 		
 		if comms_success_flag == True:
 			self.last_temperature = self.temperature
@@ -208,9 +255,6 @@ class CoolerChannel():
 			#~self.temperature_rates['2nd_derivative'] = (self.temperature_rates['1st_derivative'] - self.temperature_rates['old_1st_derivative']) / self.time_step
 			
 			if self.shut_down_flag == False:
-				# Write timestamp 3 - Final timestep reply received from Arduino.
-				if self.timing_flag:
-					self.mq_timestamp.put([3, self.current_time])
 				# If logging, send data to various loggers via queue and event flag.
 				if self.logging_flag == True:
 					if self.logging_sub_counter >= self.logging_rate:
@@ -220,12 +264,14 @@ class CoolerChannel():
 						if ((self.video_enabled_flag == True) and (self.force_video_off == False)):
 							if self.video_fault_flag == False:
 								if self.event_vlogger_fault.is_set() == False:
-									self.mq_back_to_vlogger.put(('Go', {'index': str(self.logging_counter), 'temp': str(round(self.temperature, 3)), 'setpoint': sp, 'timestamp': self.current_time}))
+									span_start = self.tracer.Now()
+									self.mq_back_to_vlogger.put(Messages.Message(Messages.VideoOp.CAPTURE, str(self.logging_counter), str(round(self.temperature, 3)), sp, self.current_time))
+									self.tracer.Record('video_trigger', span_start, tid = self.channel_id)
 									log_file_video_fault_flag = ''
 								else:
 									log_file_video_fault_flag = 'VIDEO_FAULT'
 									self.video_fault_flag = True
-									self.mq_back_to_front.put((2, 'Video_fault'))
+									self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.VIDEO_FAULT))
 							else:
 								log_file_video_fault_flag = 'VIDEO_FAULT'
 						else:
@@ -234,31 +280,39 @@ class CoolerChannel():
 							log_throttle_value = 'NA'
 						else:
 							log_throttle_value = str(round(self.throttle_setting, 2))
-						self.mq_back_to_logger.put((str(round(self.current_time - self.logging_start_time, 3)) + ', ' + str(self.logging_counter) + ', ' + str(sp) + ', ' + str(round(self.temperature, 3)) + ', ' + str(round(self.PRT_temperature, 3)) + ', ' + str(round(self.flow_rate, 3)) + ', ' + log_throttle_value + ', ' + log_file_video_fault_flag))
+						span_start = self.tracer.Now()
+						self.logger_queue.Put((str(round(self.current_time - self.logging_start_time, 3)) + ', ' + str(self.logging_counter) + ', ' + str(sp) + ', ' + str(round(self.temperature, 3)) + ', ' + str(round(self.PRT_temperature, 3)) + ', ' + str(round(self.flow_rate, 3)) + ', ' + log_throttle_value + ', ' + log_file_video_fault_flag))
+						self.tracer.Record('log_enqueue', span_start, tid = self.channel_id)
 						self.logging_sub_counter = 1
 						self.logging_counter += 1
 					else:
 						self.logging_sub_counter += 1
-						if self.timing_flag == True:
-							self.mq_timestamp.put([0,])
+				# Send this time-step's readings to the front end, either as a record in the shared memory telemetry ring,
+				# or as a single consolidated telemetry message on the queue.
+				if ((self.setpoint_flag == True) and (self.setpoint != 'NA')):
+					telemetry_setpoint = self.setpoint
+				else:
+					telemetry_setpoint = np.nan
+				if self.mode == 'idle':
+					telemetry_throttle = np.nan
+				else:
+					telemetry_throttle = self.throttle_setting
+				span_start = self.tracer.Now()
+				if self.telemetry_ring is not None:
+					self.telemetry_ring.Write(self.current_time, self.temperature, self.PRT_temperature, self.flow_rate, telemetry_setpoint, telemetry_throttle)
 				else:
-					# If we aren't logging, write the current timestamp queue terminator.
-					if self.timing_flag:
-						self.mq_timestamp.put([0,])
-				# Send current temperature / setpoint message to front end via queue.
-				self.mq_back_to_front.put((1, 'Current_temperature', self.current_time, self.temperature))
-				self.mq_back_to_front.put((1, 'Current_PRT_temperature', self.current_time, self.PRT_temperature))
-				self.mq_back_to_front.put((1, 'Current_flowrate', self.current_time, self.flow_rate))
-				if self.setpoint_flag == True:
-					self.mq_back_to_front.put((1, 'Current_setpoint', self.current_time, self.setpoint))
+					self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.TELEMETRY, self.current_time, self.temperature, self.PRT_temperature, self.flow_rate, telemetry_setpoint, telemetry_throttle))
+				self.tracer.Record('telemetry_publish', span_start, tid = self.channel_id)
+				self.UpdateMetrics(telemetry_setpoint, telemetry_throttle)
 				
 				# Check for coolant flow fault start/end and update front end.
 				if ((self.flow_rate < 1.0) and (self.flow_fault_flag == False)):
 					self.flow_fault_flag = True
-					self.mq_back_to_front.put((2, 'Flow_fault'))
+					self.metrics.Inc('coldstage_flow_faults_total', channel = self.channel_id)
+					self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.FLOW_FAULT))
 				elif ((self.flow_rate > 1.0) and (self.flow_fault_flag == True)):
 					self.flow_fault_flag = False
-					self.mq_back_to_front.put((2, 'Flow_success'))
+					self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.FLOW_SUCCESS))
 				
 				#~# Check for peltier module overload fault start/end and update front end.
 				#~if self.mode != 'idle':
@@ -279,82 +333,150 @@ class CoolerChannel():
 							#~self.overload_fault_flags['confirmed'] = False
 							#~self.mq_back_to_front.put((2, 'Overload_fault_end'))
 						
+		self.tracer.Record('service_hardware', service_start, tid = self.channel_id)
 		return comms_success_flag
 	
+	def UpdateMetrics(self, setpoint, throttle):
+		self.metrics.Set('coldstage_temperature_celsius', self.temperature, channel = self.channel_id)
+		self.metrics.Set('coldstage_prt_temperature_celsius', self.PRT_temperature, channel = self.channel_id)
+		self.metrics.Set('coldstage_flow_rate_litres_per_minute', self.flow_rate, channel = self.channel_id)
+		self.metrics.Set('coldstage_setpoint_celsius', setpoint, channel = self.channel_id)
+		self.metrics.Set('coldstage_throttle_percent', throttle, channel = self.channel_id)
+		self.metrics.Set('coldstage_logging', int(self.logging_flag), channel = self.channel_id)
+	
 	def ServiceMessages(self, most_recent_message, comms_success_flag):
-		if most_recent_message[0] == 'Throttle':
-			self.SwitchToThrottleMode(new_throttle_setting = float(most_recent_message[1]))
-		elif most_recent_message[0] == 'SetPoint':
-			self.SwitchToSetpointMode(new_setpoint = float(most_recent_message[1]))
-		elif most_recent_message[0] == 'Ramp':
-			self.SwitchToRampMode(profile_repeats = most_recent_message[1], log_end_on_profile_end = most_recent_message[2], profile_path = most_recent_message[3], profile_table = most_recent_message[4])
-		elif most_recent_message[0] == 'PIDConfig':
-			self.pid_coeffs['P'] = float(most_recent_message[1])
-			self.pid_coeffs['I'] = float(most_recent_message[2])
-			self.pid_coeffs['D'] = float(most_recent_message[3])
-			self.pid_coeffs['power_multiplier'] = float(most_recent_message[4])
-			self.pd.SetCoeffs(self.pid_coeffs)
-			self.StoreControlCoeffs()
-		elif most_recent_message[0] == 'LoggingRate':
-			self.logging_rate = float(most_recent_message[1])
-		elif most_recent_message[0] == 'StartLogging':
-			if self.logging_flag == False:
-				self.log_file_path = most_recent_message[1]
-				self.force_video_off = bool(most_recent_message[2])
-				self.force_log_data_file_path = bool(most_recent_message[3])
-				self.StartLogging(self.force_video_off, self.force_log_data_file_path)
-		elif most_recent_message[0] == 'StopLogging':
-			if self.logging_flag == True:
-				self.ShutdownLogger()
-				if ((self.video_enabled_flag == True) and (self.force_video_off == False)):
-					self.StopVideo()
-		elif most_recent_message[0] == 'SetTimeStep':
-			self.time_step = float(most_recent_message[1])
-			self.backend_object.ShutdownTimer()
-			self.backend_object.InitialiseTimer(self.time_step)
-			self.ramp_manager.SetTimeStep(self.time_step)
-			self.pd.time_step = self.time_step
-		elif most_recent_message[0] == 'NewDatumTime':
-			self.datum_time = time.time()
-			self.mq_back_to_front.put((2, 'New_datum_time', self.datum_time))
-		elif most_recent_message[0] == 'CalibrationOff':
-			self.DisableTCCalibration()
-			self.DisableTempLimits()
-		elif most_recent_message[0] == 'CalibrationOn':
-			self.EnableTCCalibration()
-			self.LoadTempLimits()
-		elif most_recent_message[0] == 'SetCalibrationLimit':
-			if most_recent_message[1] is not None:
-				self.calibration_limit = float(most_recent_message[1])
-			else:
-				self.calibration_limit = most_recent_message[1]
-		elif most_recent_message[0] == 'Off':
-			self.mq_back_to_front.put((2, 'Set_mode_label', 'Idle'))
-			self.setpoint_flag = False
-			self.setpoint = 'NA'
-			self.ramping_flag = False
-			self.mode = 'idle'
-			if ((self.force_video_off == False) and (self.video_enabled_flag == True) and (self.log_video_split_flag == True) and (self.logging_flag == True)):
-				self.SwitchVideoLogPath(self.base_log_path + self.mode + '/')
-			if comms_success_flag == True:
-				comms_success_flag, responses = self.comms_manager.StageThrottle(0.0, self.channel_id)
-		elif most_recent_message[0] == 'ChangeVideoRes':
-			x_resolution = int(most_recent_message[1].split('x')[0])
-			y_resolution = int(most_recent_message[1].split('x')[1])
-			self.SwitchVideoCaptureResolution(x_resolution, y_resolution)
-		elif most_recent_message[0] == 'ChangeLogVideoSplitFlag':
-			self.log_video_split_flag == most_recent_message[1]
-		elif most_recent_message[0] == 'ShutDown':
-			self.ShutDown(comms_success_flag)
-		elif most_recent_message[0] == 'AllShutDown':
-			self.backend_object.AllShutDown()
+		# Every handler is passed the message payload and the current comms success flag, and returns the (possibly
+		# updated) comms success flag. A message with no handler leaves the flag as it was.
+		result = self.message_dispatcher.Dispatch(most_recent_message, comms_success_flag)
+		return comms_success_flag if result is None else result
+	
+	def HandleThrottle(self, payload, comms_success_flag):
+		self.SwitchToThrottleMode(new_throttle_setting = float(payload.throttle))
+		return comms_success_flag
+	
+	def HandleSetPoint(self, payload, comms_success_flag):
+		self.SwitchToSetpointMode(new_setpoint = float(payload.setpoint))
+		return comms_success_flag
+	
+	def HandleRamp(self, payload, comms_success_flag):
+		self.SwitchToRampMode(profile_repeats = payload.repeats, log_end_on_profile_end = payload.log_end_on_profile_end, profile_path = payload.profile_path, profile_table = payload.profile_table)
+		return comms_success_flag
+	
+	def HandlePIDConfig(self, payload, comms_success_flag):
+		self.pid_coeffs['P'] = float(payload.P)
+		self.pid_coeffs['I'] = float(payload.I)
+		self.pid_coeffs['D'] = float(payload.D)
+		self.pid_coeffs['power_multiplier'] = float(payload.power_multiplier)
+		self.pd.SetCoeffs(self.pid_coeffs)
+		self.StoreControlCoeffs()
+		return comms_success_flag
+	
+	def HandleLoggingRate(self, payload, comms_success_flag):
+		self.logging_rate = float(payload.logging_rate)
+		return comms_success_flag
+	
+	def HandleStartLogging(self, payload, comms_success_flag):
+		if self.logging_flag == False:
+			self.log_file_path = payload.file_path
+			self.force_video_off = bool(payload.force_video_off)
+			self.force_log_data_file_path = bool(payload.force_log_data_file_path)
+			self.StartLogging(self.force_video_off, self.force_log_data_file_path)
+		return comms_success_flag
+	
+	def HandleStopLogging(self, payload, comms_success_flag):
+		if self.logging_flag == True:
+			self.ShutdownLogger()
+			if ((self.video_enabled_flag == True) and (self.force_video_off == False)):
+				self.StopVideo()
+		return comms_success_flag
+	
+	def HandleSetTimeStep(self, payload, comms_success_flag):
+		# All channels share the back end tick, so the back end re-times every channel (see SetTimeStep() below).
+		self.backend_object.SetTimeStep(float(payload.time_step))
+		return comms_success_flag
+	
+	def HandleNewDatumTime(self, payload, comms_success_flag):
+		self.datum_time = time.time()
+		self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.NEW_DATUM_TIME, self.datum_time))
+		return comms_success_flag
+	
+	def HandleCalibrationOff(self, payload, comms_success_flag):
+		self.DisableTCCalibration()
+		self.DisableTempLimits()
+		return comms_success_flag
+	
+	def HandleCalibrationOn(self, payload, comms_success_flag):
+		self.EnableTCCalibration()
+		self.LoadTempLimits()
+		return comms_success_flag
+	
+	def HandleSetCalibrationLimit(self, payload, comms_success_flag):
+		if payload.calibration_limit is not None:
+			self.calibration_limit = float(payload.calibration_limit)
+		else:
+			self.calibration_limit = payload.calibration_limit
+		return comms_success_flag
+	
+	def HandleOff(self, payload, comms_success_flag):
+		self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_MODE_LABEL, 'Idle'))
+		self.setpoint_flag = False
+		self.setpoint = 'NA'
+		self.ramping_flag = False
+		self.mode = 'idle'
+		self.SetLoggerRampState(self.mode)
+		if ((self.force_video_off == False) and (self.video_enabled_flag == True) and (self.log_video_split_flag == True) and (self.logging_flag == True)):
+			self.SwitchVideoLogPath(self.base_log_path + self.mode + '/')
+		if comms_success_flag == True:
+			comms_success_flag, responses = self.comms_manager.StageThrottle(0.0, self.channel_id)
+		return comms_success_flag
+	
+	def HandleChangeVideoRes(self, payload, comms_success_flag):
+		x_resolution = int(payload.resolution.split('x')[0])
+		y_resolution = int(payload.resolution.split('x')[1])
+		self.SwitchVideoCaptureResolution(x_resolution, y_resolution)
+		return comms_success_flag
+	
+	def HandleChangeLogVideoSplitFlag(self, payload, comms_success_flag):
+		self.log_video_split_flag = payload.log_video_split_flag
+		return comms_success_flag
+	
+	def HandleFreezeDetection(self, payload, comms_success_flag):
+		self.freeze_detection_flag = bool(payload.freeze_detection_flag)
+		return comms_success_flag
+	
+	def HandleShutDown(self, payload, comms_success_flag):
+		self.ShutDown(comms_success_flag)
 		return comms_success_flag
 	
+	def HandleAllShutDown(self, payload, comms_success_flag):
+		self.backend_object.AllShutDown()
+		return comms_success_flag
+	
+	def ServiceDue(self):
+		# Called by the back end once per tick, returns True if the hardware should be serviced this tick.
+		self.ticks_since_service += 1
+		if ((self.mode == 'idle') and (self.logging_flag == False)):
+			service_ticks = max(self.active_service_ticks, int(round(self.idle_service_period / self.base_time_step)))
+		else:
+			service_ticks = self.active_service_ticks
+		if self.ticks_since_service >= service_ticks:
+			self.ticks_since_service = 0
+			return True
+		return False
+	
+	def SetTimeStep(self, time_step):
+		# Called by the back end between ticks with the new tick interval, so the ramp, hold and PID timing all change 
+		# together.
+		self.base_time_step = time_step
+		self.time_step = self.base_time_step * self.active_service_ticks
+		self.ramp_manager.SetTimeStep(self.time_step)
+		self.pd.SetTimeStep(self.time_step)
+	
 	def SwitchVideoLogPath(self, new_video_path):
-		self.mq_back_to_vlogger.put(('Path', new_video_path))
+		self.mq_back_to_vlogger.put(Messages.Message(Messages.VideoOp.PATH, new_video_path))
 	
 	def SwitchVideoCaptureResolution(self, x, y):
-		self.mq_back_to_vlogger.put(('Resolution', x, y))
+		self.mq_back_to_vlogger.put(Messages.Message(Messages.VideoOp.RESOLUTION, x, y))
 	
 	def StartLogging(self, force_video_off, force_log_data_file_path):
 		self.logging_flag = True
@@ -362,10 +484,15 @@ class CoolerChannel():
 			self.base_log_path = self.log_file_path + '/channel_' + str(self.channel_id) + '/'
 			print('Creating base log folder ' + self.base_log_path)
 			os.makedirs(self.base_log_path)
-			self.InitialiseLogger(self.base_log_path + 'log_data.csv')
+			self.InitialiseLogger(self.base_log_path + 'log_data.csv', self.log_segment_max_bytes, self.log_segment_max_seconds)
 		else:
+			# Forced log file paths (ie, auto-calibration) are read back as a single file, so are never split into segments.
 			self.base_log_path = self.log_file_path
-			self.InitialiseLogger(self.base_log_path)
+			self.InitialiseLogger(self.base_log_path, 0, 0.0)
+		if self.ramping_flag == False:
+			self.SetLoggerRampState(self.mode)
+		else:
+			self.SetLoggerRampState(self.ramp_manager.GetRampState())
 		if ((self.video_enabled_flag == True) and (force_video_off == False)):
 			if self.log_video_split_flag == True:
 				if self.ramping_flag == False:
@@ -375,36 +502,48 @@ class CoolerChannel():
 					self.SwitchVideoLogPath(self.base_log_path + current_ramp_state + '/')
 			else:
 				self.SwitchVideoLogPath(self.base_log_path)
+			if self.freeze_detection_flag == True:
+				# The freezing table goes next to log_data.csv, whatever the video path.
+				self.mq_back_to_vlogger.put(Messages.Message(Messages.VideoOp.FREEZE_DETECTION, self.base_log_path))
 			self.StartVideo()
-		self.mq_back_to_front.put((2, 'Set_logging_label', 'ON'))
+		self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_LOGGING_LABEL, 'ON'))
 	
 	def StartVideo(self):
-		self.mq_back_to_vlogger.put(('Logon',))
+		self.mq_back_to_vlogger.put(Messages.Message(Messages.VideoOp.LOG_ON))
 	
 	def StopVideo(self):
-		self.mq_back_to_vlogger.put(('Logoff',))
+		self.mq_back_to_vlogger.put(Messages.Message(Messages.VideoOp.LOG_OFF))
 	
-	def InitialiseLogger(self, file_path):
+	def InitialiseLogger(self, file_path, segment_max_bytes, segment_max_seconds):
 		# Create a thread in which the data-logger will run (so that the back end loop never has to wait on file access).
 		self.logging_flag = True
 		self.logging_sub_counter = 1
 		self.logging_counter = 0
 		self.logging_start_time = time.time()
-		self.mq_back_to_logger = Queue()
-		self.logger_thread = Thread.Thread(target = Logger.Logger, args = (self.mq_back_to_logger, file_path))
+		# The logger thread lives in this process, so it is fed through a bounded in-process queue rather than a 
+		# multiprocessing Queue (which would pickle every row and pass it through a pipe).
+		self.logger_queue = Logger.LoggerQueue(self.logger_queue_max_rows)
+		self.logger_thread = Thread.Thread(target = Logger.Logger, args = (self.logger_queue, file_path, segment_max_bytes, segment_max_seconds, 100 + self.channel_id, self.channel_id))
 		self.logger_thread.start()
 		print('Logger for channel ' + str(self.channel_id) + ' started...')
 		message_to_logger = 'Time (secs), Frame Number, Setpoint (°C), TC Temperature (°C), PRT Temperature (°C), Coolant Flowrate (L/min), Throttle (%)'
 		if self.video_enabled_flag == True:
 			message_to_logger = message_to_logger + ', Video Fault Flag'
-		self.mq_back_to_logger.put((message_to_logger))
+		self.logger_queue.PutControl(message_to_logger)
+	
+	def SetLoggerRampState(self, ramp_state):
+		# Let the logger know which state of the ramp profile we are in, so it can be recorded in the log segment manifest.
+		if self.logging_flag == True:
+			self.logger_queue.PutControl(('RampState', ramp_state))
 	
 	def ShutdownLogger(self):
-		self.mq_back_to_logger.put('Shutdown')
+		self.logger_queue.Shutdown()
 		self.logger_thread.join()
 		print('Logger for channel ' + str(self.channel_id) + ' stopped...')
+		if self.logger_queue.dropped_rows > 0:
+			print('WARNING: ' + str(self.logger_queue.dropped_rows) + ' of ' + str(self.logger_queue.dropped_rows + self.logger_queue.queued_rows) + ' log rows for channel ' + str(self.channel_id) + ' were dropped as the logger could not keep up!')
 		self.logging_flag = False
-		self.mq_back_to_front.put((2, 'Set_logging_label', 'OFF'))
+		self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_LOGGING_LABEL, 'OFF'))
 	
 	def ShutDown(self, comms_success_flag):
 		self.setpoint_flag = False
@@ -416,17 +555,19 @@ class CoolerChannel():
 			self.ShutdownLogger()
 		if self.video_enabled_flag == True:
 			self.ShutdownVideo()
+		if self.telemetry_ring is not None:
+			self.telemetry_ring.Close()
 		self.shut_down_flag = True
 		print('Channel ' + str(self.channel_id) + ' shut down.')
 		# This is the big one! When the tkinter event loop ends following the arrival of the shutdown command below,
 		# we drop back into the runtime file and the main process ends after join()ing the back end and video handling
 		# processes.
-		self.mq_back_to_front.put('ShutDownConfirm')
+		self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SHUT_DOWN_CONFIRM))
 		
 	def ShutdownVideo(self):
 		# We will use the mpevent between vlogger and backend to detect when the video logging process has finished.
 		self.event_vlogger_fault.set()
-		self.mq_back_to_vlogger.put(('ShutDown',))
+		self.mq_back_to_vlogger.put(Messages.Message(Messages.VideoOp.SHUT_DOWN))
 		# Wait here until the mpevent from the vlogger is cleared to indicate that the vlogger process has flushed the 
 		# vlogger_to_front queue and stopped.
 		while self.event_vlogger_fault.is_set() == True:
@@ -445,7 +586,7 @@ class CoolerChannel():
 			self.temperature_limits['min'] = calibrated_min_temp_limit
 			# ~print('    Max = ' + '{:0.2f}'.format(calibrated_max_temp_limit) + ' °C')
 			# ~print('    Min = ' + '{:0.2f}'.format(calibrated_min_temp_limit) + ' °C')
-			self.mq_back_to_front.put((2, 'Set_temp_limits', '{:0.2f}'.format(self.temperature_limits['max']), '{:0.2f}'.format(self.temperature_limits['min'])))
+			self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_TEMP_LIMITS, '{:0.2f}'.format(self.temperature_limits['max']), '{:0.2f}'.format(self.temperature_limits['min'])))
 			print('Calibrated temperature limits found:')
 		else:
 			print('No calibrated minimum temperature limits found, defaulting to:')
@@ -463,7 +604,7 @@ class CoolerChannel():
 				self.pid_coeffs['I'] = float(pid_coefficients_file.readline())
 				self.pid_coeffs['D'] = float(pid_coefficients_file.readline())
 				self.pid_coeffs['power_multiplier'] = float(pid_coefficients_file.readline())
-			self.mq_back_to_front.put((2, 'Set_temp_control_coeffs', str(self.pid_coeffs['P']), str(self.pid_coeffs['I']), str(self.pid_coeffs['D']), str(self.pid_coeffs['power_multiplier'])))
+			self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_TEMP_CONTROL_COEFFS, str(self.pid_coeffs['P']), str(self.pid_coeffs['I']), str(self.pid_coeffs['D']), str(self.pid_coeffs['power_multiplier'])))
 			print('User configured temperature control coefficients found:')
 		else:
 			print('No calibrated minimum temperature limits found, defaulting to:')
@@ -491,7 +632,7 @@ class CoolerChannel():
 		print("-----------------------------------------------------------------------------------")
 		self.temperature_limits['min'] = hard_min_limit
 		self.temperature_limits['max'] = hard_max_limit
-		self.mq_back_to_front.put((2, 'Set_temp_limits', '{:0.2f}'.format(hard_max_limit), '{:0.2f}'.format(hard_min_limit)))
+		self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_TEMP_LIMITS, '{:0.2f}'.format(hard_max_limit), '{:0.2f}'.format(hard_min_limit)))
 	
 	def LoadCalibration(self, identity_string, calibration_path):
 		print("--------------------------------------------------------------------------------")
@@ -527,23 +668,25 @@ class CoolerChannel():
 		self.event_back_to_front['calibration_zeroed_flag'].set()
 	
 	def SwitchToSetpointMode(self, new_setpoint):
-		self.mq_back_to_front.put((2, 'Set_mode_label', 'Setpoint = ' + str(new_setpoint) + ' °C.'))
+		self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_MODE_LABEL, 'Setpoint = ' + str(new_setpoint) + ' °C.'))
 		self.mode = 'setpoint'
 		self.setpoint_flag = True
 		self.setpoint = new_setpoint
 		self.pd.Initialise(self.temperature, self.setpoint)
 		if self.ramping_flag == True:
 			self.ramping_flag = False
+		self.SetLoggerRampState(self.mode)
 		if ((self.force_video_off == False) and (self.video_enabled_flag == True) and (self.log_video_split_flag == True) and (self.logging_flag == True)):
 			self.SwitchVideoLogPath(self.base_log_path + self.mode + '/')
 	
 	def SwitchToThrottleMode(self, new_throttle_setting):
-		self.mq_back_to_front.put((2, 'Set_mode_label', 'Throttle = ' + str(new_throttle_setting) + ' %.'))
+		self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_MODE_LABEL, 'Throttle = ' + str(new_throttle_setting) + ' %.'))
 		self.mode = 'throttle'
 		self.setpoint_flag = False
 		self.setpoint = 'NA'
 		self.throttle_setting = new_throttle_setting
 		self.ramping_flag = False
+		self.SetLoggerRampState(self.mode)
 		if ((self.force_video_off == False) and (self.video_enabled_flag == True) and (self.log_video_split_flag == True) and (self.logging_flag == True)):
 			self.SwitchVideoLogPath(self.base_log_path + self.mode + '/')
 		self.rolling_gradient = RollingGradient(window_width = 10, first_sample = [self.temperature, self.current_time])
@@ -556,8 +699,10 @@ class CoolerChannel():
 		self.pd.Initialise(self.temperature, self.setpoint)
 		self.log_end_on_profile_end_flag = log_end_on_profile_end
 		if message_to_front_end[0] == True:
-			self.mq_back_to_front.put((2, 'Set_mode_label', message_to_front_end[1]))
+			self.mq_back_to_front.put(Messages.Message(Messages.FrontEndOp.SET_MODE_LABEL, message_to_front_end[1]))
 			print(message_to_front_end[1])
+		if ramp_state_change[0] == True:
+			self.SetLoggerRampState(ramp_state_change[1])
 		if ((self.force_video_off == False) and (self.logging_flag == True) and (self.video_enabled_flag == True) and (ramp_state_change[0] == True) and (self.log_video_split_flag == True)):
 			self.SwitchVideoLogPath(self.base_log_path + ramp_state_change[1] + '/')
 
@@ -0,0 +1,147 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# The default device and channel parameters, kept apart from ColdStage.py so that they can be imported without Tk (ie,
+# by the benchmarks).
+
+def DeviceParameterDefaults():
+	# A new dictionary every call, as the callers modify it.
+	return {
+		# Device defaults.
+		'comms_baud_rate': 57600,
+		'timing_info_flag' : 0,
+		'time_step' : 0.2,
+		'tick_overrun_policy' : 'skip',	# 'skip', 'catch_up' or 'stretch'
+		'tick_spin_seconds' : 0.001,	# Spin (rather than sleep) for this long before each tick deadline.
+		'tick_statistics_report_seconds' : 300.0,	# Print tick timing statistics this often, 0 = only at shutdown.
+		'trace_enabled' : 1,	# Record trace spans in each process, written out as Chrome trace JSON on exit.
+		'trace_buffer_spans' : 50000,	# Most recent spans kept per process.
+		'trace_output_directory' : './traces/',
+		'timing_monitor_report_seconds' : 10.0,	# Timing monitor span latency summary interval (with timing_info_flag on).
+		'metrics_enabled' : 0,	# Write Prometheus text format metrics from the back end and video handlers (see Metrics.py), for an exporter to collect.
+		'metrics_output_directory' : './metrics/',	# One <process name>.prom file per process, eg for the node_exporter textfile collector.
+		'metrics_write_seconds' : 5.0,	# Interval between metrics file writes.
+		'profile_processes' : [],	# Any of 'front_end', 'back_end', 'video_handler', 'timing_monitor' (see Profiling.py).
+		'profiler' : 'cprofile',	# 'cprofile' or 'sampling'
+		'profile_sample_interval_seconds' : 0.005,
+		'profile_output_directory' : './profiles/',
+		'stack_dump_on_signal' : 1,	# Print every thread's stack to the console on SIGUSR1 (not on Windows).
+		'web_service_enabled' : 0,	# Serve telemetry, events and commands over HTTP/WebSocket (see WebService.py).
+		'web_service_host' : '127.0.0.1',	# '0.0.0.0' (or the LAN address) to allow other machines, which also needs web_service_token.
+		'web_service_port' : 8765,
+		'web_service_token' : '',	# If set, clients must add ?token=<token> to every request. Required unless the host is loopback.
+		'web_service_client_queue_length' : 1000,	# Messages held for a slow client before its oldest are dropped.
+		'telemetry_transport' : 'shared_memory',	# 'shared_memory' or 'queue'
+		'telemetry_ring_capacity' : 4096,
+		'frame_transport' : 'shared_memory',	# 'shared_memory' or 'queue', for frames from the video handlers to the front ends.
+		'frame_buffer_slots' : 3,	# Frames held in each shared memory frame buffer.
+		# Simulation defaults.
+		'simulation_number_of_channels': 1,
+		'simulation_peltier_power_ratio': 8.0,
+		'simulation_hsk_temp_variation_active': False,
+		'simulation_hsk_temp_variation_amplitude': 0.5,
+		'simulation_hsk_temp_variation_period': 40.0,
+		'simulation_display_hsk_temp': False,
+		# Channel defaults.
+		#	Logging
+		'stop_logging_at_profile_end_flag' : [1, 1, 1, 1],
+		'start_logging_at_profile_start_flag' : [1, 1, 1, 1],
+		'logging_rate' : [1, 5, 5, 5],
+		#	(Split long logs into numbered segment files once either limit is reached, 0 = no limit.)
+		'log_segment_max_bytes' : [0, 0, 0, 0],
+		'log_segment_max_seconds' : [0.0, 0.0, 0.0, 0.0],
+		#	(Rows buffered for the logger thread before new rows are dropped.)
+		'logger_queue_max_rows' : [10000, 10000, 10000, 10000],
+		#	Plotting
+		'enable_plotting_flag' : [1, 0, 0, 0],
+		'plot_update_rate' : [5, 5, 5, 5],
+		'plot_span' : [2000, 2000, 2000, 2000],
+		#	Video
+		'webcam_image_file_format': '.jpg',
+		'video_capture_rate' : 10.0,	# Frames read from the camera per second (0 = as fast as the camera delivers them).
+		'video_frame_ring_length' : 8,	# Recent frames kept, so each logged frame can be the one read closest to its temperature reading.
+		'frame_writer_threads' : 1,	# Threads saving logged frames. With one, frames are written in the order they were captured.
+		'frame_writer_queue_length' : 32,	# Logged frames that may wait for a frame writer before frame_writer_fill_policy applies.
+		'frame_writer_fill_policy' : 'block',	# 'block', 'drop_oldest' or 'degrade' (see VideoHandler.FrameWriterPool).
+		'frame_writer_quality' : 75,	# JPEG quality of logged frames.
+		'frame_writer_degraded_quality' : 50,	# JPEG quality used by the 'degrade' fill policy.
+		'video_output_mode' : 'frames',	# 'frames' (one webcam_image_file_format file per logged frame) or 'container' (see VideoContainer.py).
+		'video_container_fourcc' : 'MJPG',	# Codec for 'container' mode, eg 'MJPG' (at frame_writer_quality) or 'FFV1' (lossless).
+		'video_container_extension' : '.avi',
+		'video_container_fps' : 10.0,	# Playback rate written to the containers.
+		'frame_change_trigger_enabled' : 0,	# Only store logged frames that have changed (see VideoHandler.FrameChangeTrigger), skipped frames refer to the last stored frame in frame_log.csv.
+		'frame_change_threshold' : 8.0,	# Grey levels any part of the downsampled frame must change by for a frame to be stored.
+		'frame_change_downsample' : 8,	# Factor frames are shrunk by before they are compared.
+		'frame_keyframe_interval' : 60,	# Logged frames after which one is stored regardless (0 = never).
+		#	Freeze detection (drop assays, see FreezeDetection.py)
+		'freeze_detection_enabled_flag' : True,	# Used by the drop assay wizard.
+		'freeze_detection_threshold' : 20.0,	# Grey levels a droplet's mean must step by to count as frozen.
+		'freeze_detection_min_droplet_area' : 30,	# Droplet area limits, in pixels.
+		'freeze_detection_max_droplet_area' : 20000,
+		'freeze_detection_reference_frames' : 3,	# Frames a droplet's mean is compared with.
+		#	Synthetic camera (video device 'synthetic', see SyntheticCamera.py)
+		'synthetic_camera_droplets' : 48,
+		'synthetic_camera_fps' : 30.0,	# Frames delivered per second.
+		'synthetic_camera_noise' : 6,	# Grey levels of camera noise.
+		'synthetic_camera_room_temperature' : 20.0,	# Stage temperature until the first telemetry arrives.
+		'synthetic_camera_seed' : 0,	# Same seed, same droplets and nucleation temperatures.
+		'synthetic_camera_nucleation_mean' : -20.0,	# Mean and standard deviation of the droplets' nucleation temperatures.
+		'synthetic_camera_nucleation_spread' : 5.0,
+		'webcam_available_dimensions' : ["320x240", "640x480", "800x600", "1280x720"],
+		'webcam_default_dimensions': ["640x480", "320x240", "320x240", "320x240"],
+		'log_video_split_flag' : [0, 0, 0, 0],
+		#	Control
+		'drive_mode' : [2, 2, 2, 2],
+		#	(Service the hardware every n ticks while active, and about once per idle period (seconds) while idle and not logging.)
+		'active_service_ticks' : [1, 1, 1, 1],
+		'idle_service_period' : [1.0, 1.0, 1.0, 1.0],
+		'default_pid_coefficients': [{'P' : 0.0, 'I': 0.0, 'D': 0.0, 'power_multiplier': 1.0}, {'P' : 0.0, 'I': 0.0, 'D': 0.0, 'power_multiplier': 1.0}, {'P' : 0.0, 'I': 0.0, 'D': 0.0, 'power_multiplier': 1.0}, {'P' : 0.0, 'I': 0.0, 'D': 0.0, 'power_multiplier': 1.0}],
+		'user_pid_coefficients_filepath': ['./calibrations/*/channel_' + str(i) + '/user_pid_coefficients.csv' for i in range(4)],
+		'max_temperature_limit': [30.0, 30.0, 30.0, 30.0],
+		'min_temperature_limit': [-45.0, -45.0, -45.0, -45.0],
+		'overload_fault_threshold_seconds': 10.0,
+		#	Calibration:
+		'tc_calibration_time_step': 0.2,
+		'tc_calibration_logging_rate': 5,
+		'auto_range_max_throttle': 100.0,
+		'auto_range_min_cooling_rate_per_min': -1.0,
+		'calibration_fit_polynomial_order': 7,
+		'auto_calibration_temperature_steps': 10,
+		'prt_calibration_coeffs_filepath' : ['./calibrations/*/channel_' + str(i) + '/prt_calibration_coeffs.csv' for i in range(4)],
+		'tc_calibration_temp_data_filepath': ['./calibrations/*/channel_' + str(i) + '/tc_calibration_log_data_TEMP.csv' for i in range(4)],
+		'tc_calibration_final_data_filepath': ['./calibrations/*/channel_' + str(i) + '/tc_calibration_log_data.csv' for i in range(4)],
+		'tc_calibration_coeffs_filepath' : ['./calibrations/*/channel_' + str(i) + '/tc_calibration_coeffs.csv' for i in range(4)],
+		'calibrated_temp_limits_filepath': ['./calibrations/*/channel_' + str(i) + '/calibrated_temp_limits.csv' for i in range(4)],
+		#	Ramping
+		'path_to_ramp_profile' : ["./ramp_profile.csv" for i in range(4)],
+		'ramp_repeats' : [1, 1, 1, 1]
+	}
+
+def ApplyDeviceID(device_parameter_defaults, unique_id, num_channels):
+	# Replace wildcards (*) in the default paths with unique device identifier.
+	for key in ['prt_calibration_coeffs_filepath', 'tc_calibration_temp_data_filepath', 'tc_calibration_final_data_filepath', 'tc_calibration_coeffs_filepath', 'calibrated_temp_limits_filepath', 'user_pid_coefficients_filepath']:
+		device_parameter_defaults[key] = [device_parameter_defaults[key][i].split('*')[0] + str(unique_id) + device_parameter_defaults[key][i].split('*')[1] for i in range(num_channels)]
@@ -30,6 +30,8 @@ from tkinter import NORMAL, DISABLED
 import tkinter.constants, tkinter.ttk
 from os import path
 
+import Messages
+
 class DropAssayWidget():
 	def __init__ (self, parent, channel_id, root_tk, device_parameter_defaults, mq_front_to_back, event_back_to_front):
 		self.device_parameter_defaults = device_parameter_defaults
@@ -55,15 +57,15 @@ class DropAssayWidget():
 		# Modes 0 = adjusting to room temp
 		self.mode = 0
 		# Ensure the stage is 'off' to begin.
-		self.mq_front_to_back.put(('Off',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.OFF))
 		# Store existing log_video_split_flag value and turn it off.
 		self.existing_video_log_split_flag = video_log_split_flag
-		self.mq_front_to_back.put(('ChangeLogVideoSplitFlag', False))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.CHANGE_LOG_VIDEO_SPLIT_FLAG, False))
 		# Store existing time-step and logging rate and then set the time-step to 0.2 seconds (5 Hz) and logging rate of every 5th point (1 Hz).
 		self.existing_time_step = time_step
 		self.existing_logging_rate = logging_rate
-		self.mq_front_to_back.put(('SetTimeStep', 0.2))
-		self.mq_front_to_back.put(('LoggingRate', 5))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SET_TIME_STEP, 0.2))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.LOGGING_RATE, 5))
 		self.SetDisplay(0)
 		self.PollEvent()
 	
@@ -154,7 +156,7 @@ class DropAssayWidget():
 			if success == True:	
 				self.assay_parameters['room_temp'] = room_temp
 				self.event_back_to_front['ramp_running_flag'].set()
-				self.mq_front_to_back.put(('Ramp', 1, False, None, [['setpoint', self.assay_parameters['room_temp']]]))
+				self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.RAMP, 1, False, None, [['setpoint', self.assay_parameters['room_temp']]]))
 				self.SetDisplay(1)
 				self.mode = 1
 			else:
@@ -201,15 +203,18 @@ class DropAssayWidget():
 			self.action_button_next.configure(text = "Finish assay")
 			self.action_button_abort.configure(state = DISABLED)
 			self.event_back_to_front['ramp_running_flag'].set()
-			self.mq_front_to_back.put(('Ramp', 1, True, None, [['ramp', self.assay_parameters['start_temp'], self.assay_parameters['end_temp'], self.assay_parameters['ramp_rate']]]))
-			self.mq_front_to_back.put(('StartLogging', self.assay_parameters['log_path'], False, False))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.RAMP, 1, True, None, [['ramp', self.assay_parameters['start_temp'], self.assay_parameters['end_temp'], self.assay_parameters['ramp_rate']]]))
+			# Find the droplets freezing as the assay runs, with the frozen fraction vs temperature written next to the log.
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.FREEZE_DETECTION, self.device_parameter_defaults['freeze_detection_enabled_flag']))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.START_LOGGING, self.assay_parameters['log_path'], False, False))
 			self.SetDisplay(5);
 			self.mode = 5
 		elif self.mode == 5:
 			# Stop logging.
-			self.mq_front_to_back.put(('StopLogging',))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.STOP_LOGGING))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.FREEZE_DETECTION, False))
 			# Cancel the ramp if it's running by turning the stage 'off'.
-			self.mq_front_to_back.put(('SetPoint', self.assay_parameters['room_temp']))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SETPOINT, self.assay_parameters['room_temp']))
 			self.event_back_to_front['ramp_running_flag'].clear()
 			self.action_button_abort.configure(state = NORMAL)
 			self.action_button_next.configure(text = "Next Assay")
@@ -306,12 +311,13 @@ class DropAssayWidget():
 			self.modal_interface_window.destroy()
 			self.modal_interface_window = False
 		# Stop the logger if it's running
-		self.mq_front_to_back.put(('StopLogging',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.STOP_LOGGING))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.FREEZE_DETECTION, False))
 		# Cancel the ramp if it's running by turning the stage 'off'.
-		self.mq_front_to_back.put(('Off',))
-		self.mq_front_to_back.put(('ChangeLogVideoSplitFlag', self.existing_video_log_split_flag))
-		self.mq_front_to_back.put(('SetTimeStep', self.existing_time_step))
-		self.mq_front_to_back.put(('LoggingRate', self.existing_logging_rate))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.OFF))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.CHANGE_LOG_VIDEO_SPLIT_FLAG, self.existing_video_log_split_flag))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SET_TIME_STEP, self.existing_time_step))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.LOGGING_RATE, self.existing_logging_rate))
 		self.parent.UnbindParentClicks(self.parent.top)
 		if self.parent.video_enabled == True:
 			self.parent.UnbindParentClicks(self.parent.video_window)
@@ -0,0 +1,140 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from TelemetryRing import AttachSharedMemory
+
+# Per-slot header. A slot's sequence number is zeroed while the frame in it is being replaced.
+FRAME_SLOT_HEADER = np.dtype([('sequence', np.uint64), ('timestamp', np.float64), ('width', np.uint64), ('height', np.uint64)])
+
+class FrameBuffer():
+	def __init__ (self, name = None, max_width = 1280, max_height = 720, slots = 3, create = False):
+		# Raw RGB frames from a video handler to its front end in shared memory, so that frames are never pickled and
+		# piped through a queue. The block starts with a header of four uint64s (the sequence number of the latest frame,
+		# the number of slots and the maximum frame width and height), then a FRAME_SLOT_HEADER for each slot, then the
+		# slots themselves, each big enough for one max_width x max_height RGB frame. A frame is stored contiguously at the
+		# start of its slot whatever its size, so the producer can convert a frame straight into the slot (see BeginWrite()).
+		#
+		# The producer writes each frame into the next slot in turn and only then publishes its sequence number, so the
+		# reader always finds the newest complete frame in the slot the header points to. With three slots the producer
+		# can write two more frames while the reader is copying one before it touches that slot again, and if it does
+		# the reader sees the slot's sequence number change and returns nothing rather than a torn frame. The reader
+		# only ever wants the newest frame, so there is no queue to drain and older frames are simply overwritten.
+		self.header_size = 32
+		if create == True:
+			frame_size = max_width * max_height * 3
+			self.shared_memory = shared_memory.SharedMemory(name = name, create = True, size = self.header_size + (slots * (FRAME_SLOT_HEADER.itemsize + frame_size)))
+		else:
+			self.shared_memory = AttachSharedMemory(name)
+		self.name = self.shared_memory.name
+		self.header = np.ndarray((4,), dtype = np.uint64, buffer = self.shared_memory.buf, offset = 0)
+		if create == True:
+			self.header[:] = (0, slots, max_width, max_height)
+		self.slots = int(self.header[1])
+		self.max_width = int(self.header[2])
+		self.max_height = int(self.header[3])
+		self.slot_headers = np.ndarray((self.slots,), dtype = FRAME_SLOT_HEADER, buffer = self.shared_memory.buf, offset = self.header_size)
+		if create == True:
+			self.slot_headers[:] = 0
+		self.frames_offset = self.header_size + (self.slots * FRAME_SLOT_HEADER.itemsize)
+		self.slot_size = self.max_width * self.max_height * 3
+		self.write_sequence = None
+		# Readers start from the current frame, and keep their own sequence number so any number of them can follow it.
+		self.read_sequence = 0
+		self.torn_frames = 0
+	
+	def SlotFrame(self, slot, width, height):
+		return np.ndarray((height, width, 3), dtype = np.uint8, buffer = self.shared_memory.buf, offset = self.frames_offset + (slot * self.slot_size))
+	
+	def BeginWrite(self, width, height):
+		# Return the height x width x 3 array in the next slot for the producer to fill with an RGB frame, eg
+		# 'cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst = frame_buffer.BeginWrite(width, height))', then publish it with
+		# EndWrite(). Frames bigger than the buffer are cropped.
+		sequence = int(self.header[0]) + 1
+		slot = sequence % self.slots
+		self.slot_headers['sequence'][slot] = 0
+		self.write_sequence = sequence
+		self.slot_headers['width'][slot] = min(width, self.max_width)
+		self.slot_headers['height'][slot] = min(height, self.max_height)
+		return self.SlotFrame(slot, int(self.slot_headers['width'][slot]), int(self.slot_headers['height'][slot]))
+	
+	def EndWrite(self, timestamp = 0.0):
+		slot = self.write_sequence % self.slots
+		self.slot_headers['timestamp'][slot] = timestamp
+		self.slot_headers['sequence'][slot] = self.write_sequence
+		# Publish the frame.
+		self.header[0] = self.write_sequence
+	
+	def Write(self, frame, timestamp = 0.0):
+		# frame is a height x width x 3 uint8 RGB array.
+		slot_frame = self.BeginWrite(frame.shape[1], frame.shape[0])
+		slot_frame[...] = frame[:slot_frame.shape[0], :slot_frame.shape[1]]
+		self.EndWrite(timestamp)
+	
+	def ReadLatest(self):
+		# Return (frame, timestamp) for the newest frame if it has not been read before, otherwise (None, None). The frame
+		# is a copy, so it stays valid after the producer moves on.
+		sequence = int(self.header[0])
+		if ((sequence == 0) or (sequence == self.read_sequence)):
+			return None, None
+		slot = sequence % self.slots
+		slot_sequence, timestamp, width, height = self.slot_headers[slot].tolist()
+		if slot_sequence != sequence:
+			self.torn_frames += 1
+			return None, None
+		frame = self.SlotFrame(slot, width, height).copy()
+		if int(self.slot_headers['sequence'][slot]) != sequence:
+			# The producer lapped us while we were copying.
+			self.torn_frames += 1
+			return None, None
+		self.read_sequence = sequence
+		return frame, timestamp
+	
+	def Close(self):
+		# Release our views of the block before closing it, or the buffer can't be released.
+		self.header = None
+		self.slot_headers = None
+		self.shared_memory.close()
+	
+	def Unlink(self):
+		# Only the process that created the buffer should call this, once all other processes are finished with it.
+		self.shared_memory.unlink()
+
+def MaximumDimensions(device_parameter_defaults):
+	# The largest frame any channel can be switched to, so the buffer never needs to be re-allocated.
+	dimensions = [[int(i) for i in resolution.split('x')] for resolution in device_parameter_defaults['webcam_available_dimensions'] + device_parameter_defaults['webcam_default_dimensions']]
+	return max([dimension[0] for dimension in dimensions]), max([dimension[1] for dimension in dimensions])
+
+def CreateFrameBuffers(device_parameter_defaults, video_enabled):
+	# One frame buffer per channel with video, if the frame transport is shared memory, otherwise Nones.
+	if device_parameter_defaults['frame_transport'] != 'shared_memory':
+		return [None for channel_video_enabled in video_enabled]
+	max_width, max_height = MaximumDimensions(device_parameter_defaults)
+	return [FrameBuffer(max_width = max_width, max_height = max_height, slots = device_parameter_defaults['frame_buffer_slots'], create = True) if channel_video_enabled == True else None
+	        for channel_video_enabled in video_enabled]
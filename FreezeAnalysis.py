@@ -0,0 +1,211 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# Offline freeze analysis of a logged drop assay session, eg:
+#
+#	python3 FreezeAnalysis.py ./logs/assay_1/channel_0 --workers 8
+#
+# The droplets are located in the first logged frame (see FreezeDetection.py), then the frames are decoded in a pool
+# of worker processes, chunk_frames at a time, each worker reducing its frames to per-droplet mean intensities before
+# returning them. Only those intensity series come back to this process, so memory doesn't grow with the size of the
+# frames however long the session, and decoding (which is most of the work) scales with the number of workers. Each
+# droplet's freezing frame is its largest intensity step, and is joined by frame number to the temperature logged for
+# that frame in log_data.csv.
+#
+# Frames can be one image file per frame (in the channel directory, or its per ramp state subdirectories if the video
+# was split) or video containers with their indexes (see VideoContainer.py). The results go to RESULTS_FILE_NAME, one
+# row per droplet, and PLOT_FILE_NAME, the frozen fraction against temperature.
+
+import os
+import csv
+import glob
+import time
+import argparse
+import multiprocessing
+import cv2
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+import Defaults
+import FreezeDetection
+import VideoContainer
+
+RESULTS_FILE_NAME = 'freeze_analysis.csv'
+PLOT_FILE_NAME = 'freeze_analysis.png'
+IMAGE_FILE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff']
+# The top left corner of logged frames covered by the text overlay (see VideoHandler.Capture()), which changes every 
+# frame so mustn't be mistaken for part of a droplet.
+OVERLAY_REGION = (200, 60)
+
+def FindFrames(session_directory):
+	# Returns a list of (frame number, image file path or video container directory), sorted by frame number.
+	frames = {}
+	for index_path in glob.glob(os.path.join(session_directory, '**', VideoContainer.INDEX_FILE_NAME), recursive = True):
+		reader = VideoContainer.VideoContainerReader(os.path.dirname(index_path))
+		for frame_number in reader.FrameNumbers():
+			frames[frame_number] = ('container', reader.directory)
+	for file_path in glob.glob(os.path.join(session_directory, '**', '*.*'), recursive = True):
+		stem, extension = os.path.splitext(os.path.basename(file_path))
+		if ((stem.isdigit() == True) and (extension.lower() in IMAGE_FILE_EXTENSIONS)):
+			frames[int(stem)] = ('file', file_path)
+	return [(frame_number, ) + frames[frame_number] for frame_number in sorted(frames.keys())]
+
+def LoadTemperatures(session_directory):
+	# Frame number -> TC temperature, from log_data.csv (or all of its segments).
+	temperatures = {}
+	file_paths = glob.glob(os.path.join(session_directory, 'log_data.csv')) + sorted(glob.glob(os.path.join(session_directory, 'log_data_[0-9]*.csv')))
+	for file_path in file_paths:
+		with open(file_path, 'r', encoding = 'utf-8') as log_file:
+			for row in csv.reader(log_file, skipinitialspace = True):
+				try:
+					temperatures[int(row[1])] = float(row[3])
+				except (ValueError, IndexError):
+					# The header row.
+					pass
+	return temperatures
+
+# Set in each worker process by InitialiseWorker().
+_worker = {}
+
+def InitialiseWorker(roi_pixels, roi_labels, areas, reduction):
+	# The workers are processes already, so OpenCV's own threads would only compete with each other.
+	cv2.setNumThreads(1)
+	_worker['roi_pixels'] = roi_pixels
+	_worker['roi_labels'] = roi_labels
+	_worker['areas'] = areas
+	_worker['reduction'] = reduction
+	_worker['readers'] = {}
+
+def LoadFrame(frame_number, kind, location, reduction, readers):
+	# The frame as greyscale, shrunk by reduction (1, 2, 4 or 8), which for JPEGs is done while decoding and so is much
+	# quicker than decoding in full.
+	if kind == 'file':
+		flags = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}[reduction]
+		grey_frame = cv2.imread(location, flags)
+		if grey_frame is None:
+			raise IOError('Could not read frame ' + location)
+		return grey_frame
+	if location not in readers:
+		readers[location] = VideoContainer.VideoContainerReader(location)
+	grey_frame = FreezeDetection.Greyscale(readers[location].Frame(frame_number))
+	if reduction > 1:
+		grey_frame = cv2.resize(grey_frame, ((grey_frame.shape[1] + reduction - 1) // reduction, (grey_frame.shape[0] + reduction - 1) // reduction), interpolation = cv2.INTER_AREA)
+	return grey_frame
+
+def ChunkMeans(chunk):
+	# Worker: the droplet means of each frame in chunk, as a (frames x droplets) array.
+	means = np.empty((len(chunk), len(_worker['areas'])), dtype = np.float32)
+	for row, (frame_number, kind, location) in enumerate(chunk):
+		grey_frame = LoadFrame(frame_number, kind, location, _worker['reduction'], _worker['readers'])
+		means[row] = FreezeDetection.RoiMeans(grey_frame, _worker['roi_pixels'], _worker['roi_labels'], _worker['areas'])
+	return means
+
+def AnalyseSession(session_directory, output_directory = None, workers = None, chunk_frames = 64, reduction = 1, threshold = None, window = 3):
+	device_parameter_defaults = Defaults.DeviceParameterDefaults()
+	if output_directory is None:
+		output_directory = session_directory
+	if workers is None:
+		workers = os.cpu_count()
+	if threshold is None:
+		threshold = device_parameter_defaults['freeze_detection_threshold']
+	if reduction not in [1, 2, 4, 8]:
+		raise ValueError('Frame reduction must be 1, 2, 4 or 8.')
+	
+	frames = FindFrames(session_directory)
+	if len(frames) == 0:
+		raise ValueError('No logged frames found in ' + session_directory)
+	temperatures = LoadTemperatures(session_directory)
+	if len(temperatures) == 0:
+		raise ValueError('No log_data.csv found in ' + session_directory)
+	
+	first_frame = LoadFrame(*frames[0], reduction, {})
+	labels, areas, centroids = FreezeDetection.LocateDroplets(first_frame, device_parameter_defaults['freeze_detection_min_droplet_area'] / (reduction ** 2),
+	                                                          device_parameter_defaults['freeze_detection_max_droplet_area'] / (reduction ** 2),
+	                                                          (OVERLAY_REGION[0] // reduction, OVERLAY_REGION[1] // reduction))
+	roi_pixels, roi_labels = FreezeDetection.RoiPixels(labels)
+	print(str(len(frames)) + ' frames, ' + str(len(areas)) + ' droplets.')
+	
+	start_time = time.perf_counter()
+	series = np.empty((len(frames), len(areas)), dtype = np.float32)
+	chunks = [frames[i:i + chunk_frames] for i in range(0, len(frames), chunk_frames)]
+	with multiprocessing.Pool(workers, initializer = InitialiseWorker, initargs = (roi_pixels, roi_labels, areas, reduction)) as pool:
+		for chunk_number, means in enumerate(pool.imap(ChunkMeans, chunks)):
+			series[chunk_number * chunk_frames:(chunk_number * chunk_frames) + len(means)] = means
+	elapsed = time.perf_counter() - start_time
+	print('Decoded ' + str(len(frames)) + ' frames in ' + str(round(elapsed, 2)) + ' s (' + str(round(len(frames) / elapsed, 1)) + ' frames/s, ' + str(workers) + ' workers).')
+	
+	freezing_rows, steps = FreezeDetection.DetectFreezingSteps(series, threshold, window)
+	freezing_temperatures = np.full(len(areas), np.nan)
+	with open(os.path.join(output_directory, RESULTS_FILE_NAME), 'w', encoding = 'utf-8') as results_file:
+		results_file.write('Droplet, X (px), Y (px), Area (px), Freezing Frame Number, Freezing Temperature (°C), Intensity Step\n')
+		for droplet in range(len(areas)):
+			if freezing_rows[droplet] >= 0:
+				frame_number = frames[freezing_rows[droplet]][0]
+				freezing_temperatures[droplet] = temperatures.get(frame_number, np.nan)
+				frozen_text = str(frame_number) + ', ' + str(freezing_temperatures[droplet])
+			else:
+				frozen_text = 'NA, NA'
+			results_file.write(str(droplet + 1) + ', ' + str(round(centroids[droplet][0] * reduction, 1)) + ', ' + str(round(centroids[droplet][1] * reduction, 1)) + ', ' + 
+			                   str(int(areas[droplet] * (reduction ** 2))) + ', ' + frozen_text + ', ' + str(round(float(steps[droplet]), 2)) + '\n')
+	PlotFrozenFraction(freezing_temperatures, len(areas), os.path.join(output_directory, PLOT_FILE_NAME))
+	print(str(np.count_nonzero(np.isfinite(freezing_temperatures))) + ' of ' + str(len(areas)) + ' droplets froze, results in ' + os.path.join(output_directory, RESULTS_FILE_NAME))
+	return freezing_temperatures
+
+def PlotFrozenFraction(freezing_temperatures, droplets, file_path):
+	frozen_temperatures = np.sort(freezing_temperatures[np.isfinite(freezing_temperatures)])[::-1]
+	figure, (fraction_axes, histogram_axes) = plt.subplots(1, 2, figsize = (10, 4))
+	if len(frozen_temperatures) > 0:
+		fraction_axes.step(frozen_temperatures, np.arange(1, len(frozen_temperatures) + 1) / max(1, droplets), where = 'post')
+		histogram_axes.hist(frozen_temperatures, bins = min(30, max(1, len(frozen_temperatures))))
+	fraction_axes.invert_xaxis()
+	fraction_axes.set_xlabel('Temperature (°C)')
+	fraction_axes.set_ylabel('Frozen fraction')
+	fraction_axes.set_ylim(0.0, 1.0)
+	histogram_axes.invert_xaxis()
+	histogram_axes.set_xlabel('Freezing temperature (°C)')
+	histogram_axes.set_ylabel('Droplets')
+	figure.suptitle(str(len(frozen_temperatures)) + ' of ' + str(droplets) + ' droplets frozen')
+	figure.tight_layout()
+	figure.savefig(file_path, dpi = 100)
+	plt.close(figure)
+
+def Main(argv = None):
+	parser = argparse.ArgumentParser(description = 'Find the freezing temperatures of the droplets in a logged drop assay.')
+	parser.add_argument('session', help = 'Channel log directory, containing log_data.csv and the logged frames.')
+	parser.add_argument('--output', help = 'Directory for the results, default the session directory.')
+	parser.add_argument('--workers', type = int, default = None, help = 'Decoding processes, default one per core.')
+	parser.add_argument('--chunk-frames', type = int, default = 64, help = 'Frames handed to a worker at a time.')
+	parser.add_argument('--reduction', type = int, default = 1, help = 'Shrink frames by 1, 2, 4 or 8 as they are decoded.')
+	parser.add_argument('--threshold', type = float, default = None, help = 'Smallest intensity step counted as freezing, in grey levels.')
+	parser.add_argument('--window', type = int, default = 3, help = 'Frames averaged either side of a step.')
+	args = parser.parse_args(argv)
+	AnalyseSession(args.session, args.output, args.workers, args.chunk_frames, args.reduction, args.threshold, args.window)
+
+if __name__ == '__main__':
+	Main()
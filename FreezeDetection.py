@@ -0,0 +1,170 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# Finding droplets freezing in the video of a drop assay, live as frames are logged (see VideoHandler.Capture()) or
+# offline from a logged session.
+#
+# The droplets are located once, in the first frame, as the regions that contrast with the background (on whichever
+# side of it they are, as long as they cover less of the frame than it does) and fall within an area range. Each
+# droplet is then reduced to its mean intensity in every frame, all of them together with one np.bincount() over the
+# droplet pixels, and a droplet is taken to have frozen the first time its mean steps away from the average of its last few
+# frames by more than a threshold (freezing turns a clear droplet opaque).
+#
+# Live, the droplets are written to DROPLETS_FILE_NAME and each frame in which any froze to FREEZING_TABLE_FILE_NAME, 
+# next to log_data.csv, giving the frozen fraction against temperature as the assay runs.
+
+import os
+import cv2
+import numpy as np
+
+DROPLETS_FILE_NAME = 'droplets.csv'
+FREEZING_TABLE_FILE_NAME = 'freezing_data.csv'
+
+def Greyscale(frame):
+	if frame.ndim == 2:
+		return frame
+	return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+def LocateDroplets(grey_frame, min_area = 30, max_area = 20000, exclude_region = None):
+	# Returns (labels, areas, centroids), where labels is an int32 array the size of the frame giving the droplet number
+	# (1 - n) of each pixel, or 0 for none, and areas and centroids (x, y) are indexed by droplet number - 1. If given,
+	# exclude_region is the (width, height) of a region in the top left corner to leave out, eg the text overlay on
+	# logged frames.
+	blurred_frame = cv2.GaussianBlur(grey_frame, (5, 5), 0)
+	threshold, mask = cv2.threshold(blurred_frame, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+	if np.count_nonzero(mask) > (mask.size / 2):
+		mask = cv2.bitwise_not(mask)
+	mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+	if exclude_region is not None:
+		mask[:exclude_region[1], :exclude_region[0]] = 0
+	num_regions, region_labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity = 8)
+	areas = stats[:, cv2.CC_STAT_AREA]
+	# Region 0 is the background.
+	keep = (areas >= min_area) & (areas <= max_area)
+	keep[0] = False
+	droplet_numbers = np.zeros(num_regions, dtype = np.int32)
+	droplet_numbers[keep] = np.arange(1, np.count_nonzero(keep) + 1, dtype = np.int32)
+	return droplet_numbers[region_labels], areas[keep], centroids[keep]
+
+def RoiPixels(labels):
+	# The flat indices of the pixels in any droplet, and the droplet (0 - n-1) each is in, so that only those pixels
+	# need to be visited in every frame.
+	roi_pixels = np.flatnonzero(labels)
+	return roi_pixels, labels.ravel()[roi_pixels] - 1
+
+def RoiMeans(grey_frame, roi_pixels, roi_labels, areas):
+	# Mean intensity of every droplet in grey_frame.
+	sums = np.bincount(roi_labels, weights = grey_frame.ravel()[roi_pixels], minlength = len(areas))
+	return sums / areas
+
+def DetectFreezingSteps(series, threshold, window = 3):
+	# Offline detection over whole intensity series (frames x droplets). For every droplet, finds the frame where the
+	# mean of the window frames from it on differs most from the mean of the window frames before it, all droplets and 
+	# frames at once using cumulative sums. Returns (freezing frames, steps), where freezing frames are row indices into
+	# series, or -1 for droplets whose largest step is no bigger than threshold.
+	frames, droplets = series.shape
+	if frames < 2:
+		return np.full(droplets, -1), np.zeros(droplets)
+	window = max(1, min(int(window), frames // 2))
+	cumulative = np.vstack((np.zeros((1, droplets)), np.cumsum(series, axis = 0, dtype = np.float64)))
+	splits = np.arange(window, frames - window + 1)
+	steps = ((cumulative[splits + window] - cumulative[splits]) - (cumulative[splits] - cumulative[splits - window])) / window
+	largest = np.argmax(np.abs(steps), axis = 0)
+	step = steps[largest, np.arange(droplets)]
+	return np.where(np.abs(step) > threshold, splits[largest], -1), step
+
+class FreezeDetector():
+	def __init__ (self, threshold = 20.0, min_area = 30, max_area = 20000, reference_frames = 3):
+		self.threshold = float(threshold)
+		self.min_area = min_area
+		self.max_area = max_area
+		self.reference_frames = max(1, int(reference_frames))
+		self.labels = None
+		self.areas = None
+		self.centroids = None
+		self.droplets = 0
+	
+	def Start(self, frame):
+		# Locate the droplets in frame (BGR or greyscale), and forget any previous ones.
+		grey_frame = Greyscale(frame)
+		self.labels, self.areas, self.centroids = LocateDroplets(grey_frame, self.min_area, self.max_area)
+		self.droplets = len(self.areas)
+		self.roi_pixels, self.roi_labels = RoiPixels(self.labels)
+		self.frozen = np.zeros(self.droplets, dtype = bool)
+		self.freezing_temperatures = np.full(self.droplets, np.nan)
+		# The droplet means of the last reference_frames frames, oldest first.
+		self.history = RoiMeans(grey_frame, self.roi_pixels, self.roi_labels, self.areas)[np.newaxis, :]
+		return self.droplets
+	
+	def Update(self, frame, temperature):
+		# Returns the numbers (0 - n-1) of the droplets that froze in frame, and records temperature as their freezing
+		# temperature.
+		means = RoiMeans(Greyscale(frame), self.roi_pixels, self.roi_labels, self.areas)
+		step = np.abs(means - self.history.mean(axis = 0))
+		newly_frozen = np.flatnonzero((step > self.threshold) & (self.frozen == False))
+		self.frozen[newly_frozen] = True
+		self.freezing_temperatures[newly_frozen] = temperature
+		self.history = np.vstack((self.history, means))[-self.reference_frames:]
+		return newly_frozen
+	
+	def FrozenFraction(self):
+		if self.droplets == 0:
+			return 0.0
+		return np.count_nonzero(self.frozen) / self.droplets
+
+class FreezeDetectionStage():
+	def __init__ (self, detector, directory):
+		# Runs detector on each logged frame, writing its results to directory (see the top of the file). The droplets
+		# are located in the first frame.
+		self.detector = detector
+		self.directory = directory
+		self.table_file = None
+	
+	def Process(self, frame, frame_index, temperature):
+		if self.table_file is None:
+			self.Start(frame)
+			return
+		newly_frozen = self.detector.Update(frame, temperature)
+		if len(newly_frozen) > 0:
+			self.table_file.write(frame_index + ', ' + str(round(temperature, 3)) + ', ' + ' '.join([str(droplet + 1) for droplet in newly_frozen]) + ', ' + 
+			                      str(np.count_nonzero(self.detector.frozen)) + ', ' + str(round(self.detector.FrozenFraction(), 4)) + '\n')
+	
+	def Start(self, frame):
+		droplets = self.detector.Start(frame)
+		print('Freeze detection found ' + str(droplets) + ' droplets.')
+		with open(os.path.join(self.directory, DROPLETS_FILE_NAME), 'w', encoding = 'utf-8') as droplets_file:
+			droplets_file.write('Droplet, X (px), Y (px), Area (px)\n')
+			for droplet in range(droplets):
+				droplets_file.write(str(droplet + 1) + ', ' + str(round(self.detector.centroids[droplet][0], 1)) + ', ' + str(round(self.detector.centroids[droplet][1], 1)) + ', ' + 
+				                    str(self.detector.areas[droplet]) + '\n')
+		self.table_file = open(os.path.join(self.directory, FREEZING_TABLE_FILE_NAME), 'w', buffering = 1, encoding = 'utf-8')
+		self.table_file.write('Frame Number, Temperature (°C), Droplets Frozen, Total Frozen, Frozen Fraction\n')
+	
+	def Close(self):
+		if self.table_file is not None:
+			self.table_file.close()
+			self.table_file = None
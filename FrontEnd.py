@@ -43,9 +43,13 @@ from os import makedirs, path
 
 import CalibrationWidget
 import DropAssayWidget
+import TelemetryRing
+import Messages
+import Tracing
+import WebService
 
 class FrontEnd():
-	def __init__ (self, parent, root_tk, device_parameter_defaults, num_channels, channel_id, comms_unique_id, close_action, mq_front_to_back, mq_back_to_front, mq_vlogger_to_front, event_back_to_front, timing_flag, timing_monitor, timing_monitor_kill, mq_timestamp, time_step, video_enabled, plotting_enabled):
+	def __init__ (self, parent, root_tk, device_parameter_defaults, num_channels, channel_id, comms_unique_id, close_action, mq_front_to_back, mq_back_to_front, mq_vlogger_to_front, event_back_to_front, timing_flag, timing_monitor, timing_monitor_kill, mq_timestamp, time_step, video_enabled, plotting_enabled, telemetry_ring, frame_buffer = None):
 		self.parent = parent
 		self.device_parameter_defaults = device_parameter_defaults
 		self.num_channels = num_channels
@@ -57,6 +61,8 @@ class FrontEnd():
 		self.mq_back_to_front = mq_back_to_front
 		self.mq_vlogger_to_front = mq_vlogger_to_front
 		self.event_back_to_front = event_back_to_front
+		self.telemetry_ring = telemetry_ring
+		self.frame_buffer = frame_buffer
 		
 		self.timing_flag = timing_flag
 		self.timing_monitor = timing_monitor
@@ -102,6 +108,24 @@ class FrontEnd():
 		self.drop_assay_widget = DropAssayWidget.DropAssayWidget(self, self.channel_id, self.root_tk, self.device_parameter_defaults, 
 																	self.mq_front_to_back, self.event_back_to_front)
 		
+		# Handlers for the messages from the back end, see UpdatePoll().
+		self.telemetry_messages = []
+		self.message_dispatcher = Messages.Dispatcher('Channel ' + str(self.channel_id) + ' front end')
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.TELEMETRY, self.HandleTelemetry)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.NEW_DATUM_TIME, self.HandleNewDatumTime)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_MODE_LABEL, self.HandleSetModeLabel)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_TEMP_LIMITS, self.HandleSetTempLimits)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_TEMP_CONTROL_COEFFS, self.HandleSetTempControlCoeffs)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_LOGGING_LABEL, self.HandleSetLoggingLabel)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.ALL_SHUTDOWN_CONFIRM, self.HandleAllShutdownConfirm)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.COMMS_FAULT, self.HandleCommsFault)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.COMMS_SUCCESS, self.HandleCommsSuccess)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.FLOW_FAULT, self.HandleFlowFault)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.FLOW_SUCCESS, self.HandleFlowSuccess)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.VIDEO_FAULT, self.HandleVideoFault)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.VIDEO_SUCCESS, self.HandleVideoSuccess)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_TIME_STEP, self.HandleSetTimeStep)
+		
 		# Run UpdatePoll to begin checking for messages from the backend process.
 		self.UpdatePoll()
 	
@@ -114,126 +138,45 @@ class FrontEnd():
 			# Function calls itself to run in 500 milliseconds time.
 			self.update_poll_id = self.top.after(250, self.UpdatePoll)
 		
-		most_recent_message = []
-		while most_recent_message != [0, ]:
+		poll_start = Tracing.GetTracer().Now()
+		self.telemetry_messages = []
+		while True:
 			try:
 				most_recent_message = self.mq_back_to_front.get(False, None)
 			except:
-				most_recent_message = [0, ]
-			if most_recent_message[0] == 1:
-				if most_recent_message[1] == 'Current_temperature':
-					self.sub_tick += 1
-					current_temp = round(most_recent_message[3], 3)
-					self.times.append((most_recent_message[2] - self.datum_time))
-					self.temperatures.append(current_temp)
-					self.label_current_temp_reading.configure(text = current_temp)
-					if (current_temp > 0.0):
-						self.label_current_temp_reading.configure(foreground = "red")
-					else:
-						self.label_current_temp_reading.configure(foreground = "blue")
-				elif most_recent_message[1] == 'Current_PRT_temperature':
-					current_PRT_temp = round(most_recent_message[3], 3)
-					self.label_current_PRT_temp_reading.configure(text = current_PRT_temp)
-					if (current_PRT_temp > 0.0):
-						self.label_current_PRT_temp_reading.configure(foreground = "red")
-					else:
-						self.label_current_PRT_temp_reading.configure(foreground = "blue")
-				elif most_recent_message[1] == 'Current_setpoint':
-					if most_recent_message[3] != 'NA':
-						self.setpoint_times.append((most_recent_message[2] - self.datum_time))
-						self.setpoint_temperatures.append(most_recent_message[3])
-				elif most_recent_message[1] == 'Current_flowrate':
-					current_flowrate = round(float(most_recent_message[3]), 3)
-					self.label_current_flowrate_reading.configure(text = str(current_flowrate))
-					if current_flowrate < 5.0:
-						self.label_current_flowrate_reading.configure(foreground = "red")
-					else:
-						self.label_current_flowrate_reading.configure(foreground = "black")
-			elif most_recent_message[0] == 2:
-				if most_recent_message[1] == 'New_datum_time':
-					self.datum_time = float(most_recent_message[2])
-					self.times = []
-					self.temperatures = []
-					self.setpoint_times = []
-					self.setpoint_temperatures = []
-					if self.plotting_enabled == True:
-						self.InitialisePlot()
-						self.UpdatePlot()
-						self.sub_tick = 0
-				elif most_recent_message[1] == 'Set_mode_label':
-					if most_recent_message[2] == 'Idle':
-						self.setpoint_times = []
-						self.setpoint_temperatures = []
-					elif most_recent_message[2].startswith('End of profile'):
-						self.EnableFrontEndRampControls()
-						if ((self.logging_flag == True) and (self.checkButton_pr_log_end_on_profile_end_value.get() == True)):
-							# Reset the logging controls to their default state.
-							#~self.checkButton_log_video_split.configure(state = NORMAL)
-							#~self.button_log_off.configure(state = DISABLED)
-							#~self.button_log_on.configure(state = DISABLED)
-							#~self.button_log_select.configure(state = NORMAL)
-							self.EnableFrontEndLoggingControls()
-							self.logging_flag = False
-					self.label_mode.configure(text = most_recent_message[2])
-				elif most_recent_message[1] == 'Set_temp_limits':
-					self.temperature_limits['max'] = float(most_recent_message[2])
-					self.temperature_limits['min'] = float(most_recent_message[3])
-					self.label_current_max_limit_reading.configure(text = str(self.temperature_limits['max']))
-					self.label_current_min_limit_reading.configure(text = str(self.temperature_limits['min']))
-					self.entry_simple_ramp_end_temp.delete(0, "end")
-					self.entry_simple_ramp_end_temp.insert(0, str(self.temperature_limits['min']))
-					self.entry_simple_ramp_start_temp.delete(0, "end")
-					if self.temperature_limits['max'] < 0.0:
-						self.entry_simple_ramp_start_temp.insert(0, str(self.temperature_limits['max']))
-					else:
-						self.entry_simple_ramp_start_temp.insert(0, "0.0")
-				elif most_recent_message[1] == 'Set_temp_control_coeffs':
-					self.entry_P.delete(0, "end")
-					# ~self.entry_I.delete(0, "end")
-					self.entry_D.delete(0, "end")
-					self.entry_power_multiplier.delete(0, "end")
-					self.entry_P.insert(0, most_recent_message[2])
-					# ~self.entry_I.insert(0, most_recent_message[3])
-					self.entry_D.insert(0, most_recent_message[4])
-					self.entry_power_multiplier.insert(0, most_recent_message[5])
-				elif most_recent_message[1] == 'Set_logging_label':
-					self.label_logging_reading.configure(text = most_recent_message[2])
-				elif most_recent_message[1] == 'All_shutdown_confirm':
-					self.ShutDown()
-				elif most_recent_message[1] == 'Comms_fault':
-					if self.comms_fault_warning_open == False:
-						self.OpenCommsFaultAlert()
-				elif most_recent_message[1] == 'Comms_success':
-					if self.comms_fault_warning_open == True:
-						self.CloseCommsFaultAlert()
-						print('Transient comms fault lasting ' + str(round(time.time() - (self.comms_fault_timestamp), 1)) + ' seconds occurred.')
-				elif most_recent_message[1] == 'Flow_fault':
-					if self.flow_fault_warning_open == False:
-						self.OpenFlowFaultAlert()
-				elif most_recent_message[1] == 'Flow_success':
-					if self.flow_fault_warning_open == True:
-						self.CloseFlowFaultAlert()
-						print('Transient coolant flow fault lasting ' + str(round((time.time() - self.flow_fault_timestamp), 1)) + ' seconds occurred.')
-				elif most_recent_message[1] == 'Video_fault':
-					if self.video_fault_warning_open == False:
-						print('Video source disconnected!')
-						self.OpenVideoFaultAlert()
-				elif most_recent_message[1] == 'Video_success':
-					if self.video_fault_warning_open == True:
-						print('Video source successfully connected.')
-						print('Transient video device fault lasting ' + str(round(time.time() - (self.video_fault_timestamp), 1)) + ' seconds occurred.')
-						self.CloseVideoFaultAlert()
+				break
+			self.message_dispatcher.Dispatch(most_recent_message)
+			if most_recent_message[0] != Messages.FrontEndOp.TELEMETRY:
+				WebService.Publish(self.channel_id, 'event', most_recent_message)
+		
+		# Process all the telemetry received since the last poll in one go, whether it came from the shared memory ring
+		# or as messages on the queue.
+		if self.telemetry_ring is not None:
+			records = self.telemetry_ring.ReadNew()
+		else:
+			records = np.array(self.telemetry_messages, dtype = TelemetryRing.TELEMETRY_RECORD)
+		if len(records) > 0:
+			self.ProcessTelemetry(records)
+			WebService.Publish(self.channel_id, 'telemetry', records)
 		
 		if ((self.plotting_enabled == True) and (self.sub_tick >= self.update_rate)):
+			span_start = Tracing.GetTracer().Now()
 			self.UpdatePlot()
+			Tracing.GetTracer().Record('plot_update', span_start, tid = self.channel_id)
 			self.sub_tick = 0
 		if self.video_enabled == True:
 			last_frame_on_queue = [0,]
-			while self.mq_vlogger_to_front.qsize() > 0:
-				try:
-					last_frame_on_queue = self.mq_vlogger_to_front.get(False, None)
-				except:
-					pass
+			if self.frame_buffer is not None:
+				# Only the newest frame is ever read from the shared memory frame buffer.
+				frame, frame_timestamp = self.frame_buffer.ReadLatest()
+				if frame is not None:
+					last_frame_on_queue = Image.fromarray(frame)
+			else:
+				while self.mq_vlogger_to_front.qsize() > 0:
+					try:
+						last_frame_on_queue = self.mq_vlogger_to_front.get(False, None)
+					except:
+						pass
 			if last_frame_on_queue != [0,]:
 				# Get dimensions of existing image.
 				existing_image_width = self.imageTK.width()
@@ -246,6 +189,140 @@ class FrontEnd():
 				if ((existing_image_height != image_height) or (existing_image_width != image_width)):
 					self.video_window.geometry(str(image_width) + 'x' + str(image_height))
 				self.video_panel.configure(image = self.imageTK)
+		Tracing.GetTracer().Record('update_poll', poll_start, tid = self.channel_id)
+	
+	def HandleTelemetry(self, payload):
+		# Collect the telemetry messages so they can be processed together as one batch at the end of the poll.
+		self.telemetry_messages.append(payload)
+	
+	def HandleNewDatumTime(self, payload):
+		self.datum_time = float(payload.datum_time)
+		self.times = []
+		self.temperatures = []
+		self.setpoint_times = []
+		self.setpoint_temperatures = []
+		if self.plotting_enabled == True:
+			self.InitialisePlot()
+			self.UpdatePlot()
+			self.sub_tick = 0
+	
+	def HandleSetModeLabel(self, payload):
+		if payload.text == 'Idle':
+			self.setpoint_times = []
+			self.setpoint_temperatures = []
+		elif payload.text.startswith('End of profile'):
+			self.EnableFrontEndRampControls()
+			if ((self.logging_flag == True) and (self.checkButton_pr_log_end_on_profile_end_value.get() == True)):
+				# Reset the logging controls to their default state.
+				#~self.checkButton_log_video_split.configure(state = NORMAL)
+				#~self.button_log_off.configure(state = DISABLED)
+				#~self.button_log_on.configure(state = DISABLED)
+				#~self.button_log_select.configure(state = NORMAL)
+				self.EnableFrontEndLoggingControls()
+				self.logging_flag = False
+		self.label_mode.configure(text = payload.text)
+	
+	def HandleSetTempLimits(self, payload):
+		self.temperature_limits['max'] = float(payload.max)
+		self.temperature_limits['min'] = float(payload.min)
+		self.label_current_max_limit_reading.configure(text = str(self.temperature_limits['max']))
+		self.label_current_min_limit_reading.configure(text = str(self.temperature_limits['min']))
+		self.entry_simple_ramp_end_temp.delete(0, "end")
+		self.entry_simple_ramp_end_temp.insert(0, str(self.temperature_limits['min']))
+		self.entry_simple_ramp_start_temp.delete(0, "end")
+		if self.temperature_limits['max'] < 0.0:
+			self.entry_simple_ramp_start_temp.insert(0, str(self.temperature_limits['max']))
+		else:
+			self.entry_simple_ramp_start_temp.insert(0, "0.0")
+	
+	def HandleSetTempControlCoeffs(self, payload):
+		self.entry_P.delete(0, "end")
+		# ~self.entry_I.delete(0, "end")
+		self.entry_D.delete(0, "end")
+		self.entry_power_multiplier.delete(0, "end")
+		self.entry_P.insert(0, payload.P)
+		# ~self.entry_I.insert(0, payload.I)
+		self.entry_D.insert(0, payload.D)
+		self.entry_power_multiplier.insert(0, payload.power_multiplier)
+	
+	def HandleSetLoggingLabel(self, payload):
+		self.label_logging_reading.configure(text = payload.text)
+	
+	def HandleAllShutdownConfirm(self, payload):
+		self.ShutDown()
+	
+	def HandleCommsFault(self, payload):
+		if self.comms_fault_warning_open == False:
+			self.OpenCommsFaultAlert()
+	
+	def HandleCommsSuccess(self, payload):
+		if self.comms_fault_warning_open == True:
+			self.CloseCommsFaultAlert()
+			print('Transient comms fault lasting ' + str(round(time.time() - (self.comms_fault_timestamp), 1)) + ' seconds occurred.')
+	
+	def HandleFlowFault(self, payload):
+		if self.flow_fault_warning_open == False:
+			self.OpenFlowFaultAlert()
+	
+	def HandleFlowSuccess(self, payload):
+		if self.flow_fault_warning_open == True:
+			self.CloseFlowFaultAlert()
+			print('Transient coolant flow fault lasting ' + str(round((time.time() - self.flow_fault_timestamp), 1)) + ' seconds occurred.')
+	
+	def HandleVideoFault(self, payload):
+		if self.video_fault_warning_open == False:
+			print('Video source disconnected!')
+			self.OpenVideoFaultAlert()
+	
+	def HandleVideoSuccess(self, payload):
+		if self.video_fault_warning_open == True:
+			print('Video source successfully connected.')
+			print('Transient video device fault lasting ' + str(round(time.time() - (self.video_fault_timestamp), 1)) + ' seconds occurred.')
+			self.CloseVideoFaultAlert()
+	
+	def HandleSetTimeStep(self, payload):
+		# The time-step is shared by all channels, so it may have been changed from another channel's front end.
+		self.time_step = float(payload.time_step)
+		self.entry_timestep.delete(0, "end")
+		self.entry_timestep.insert(0, self.time_step)
+	
+	def ProcessTelemetry(self, records):
+		# Ignore any records from before the current datum time (ie, from just before the plot was cleared).
+		records = records[records['timestamp'] >= self.datum_time]
+		if len(records) == 0:
+			return
+		self.sub_tick += len(records)
+		self.times.extend((records['timestamp'] - self.datum_time).tolist())
+		self.temperatures.extend(np.round(records['temperature'], 3).tolist())
+		# The setpoint is NaN in records from time-steps where there wasn't one.
+		setpoint_records = records[~np.isnan(records['setpoint'])]
+		self.setpoint_times.extend((setpoint_records['timestamp'] - self.datum_time).tolist())
+		self.setpoint_temperatures.extend(setpoint_records['setpoint'].tolist())
+		# Only the most recent readings are displayed.
+		self.SetTemperatureReading(round(float(records['temperature'][-1]), 3))
+		self.SetPRTTemperatureReading(round(float(records['prt_temperature'][-1]), 3))
+		self.SetFlowrateReading(round(float(records['flow_rate'][-1]), 3))
+	
+	def SetTemperatureReading(self, current_temp):
+		self.label_current_temp_reading.configure(text = current_temp)
+		if (current_temp > 0.0):
+			self.label_current_temp_reading.configure(foreground = "red")
+		else:
+			self.label_current_temp_reading.configure(foreground = "blue")
+	
+	def SetPRTTemperatureReading(self, current_PRT_temp):
+		self.label_current_PRT_temp_reading.configure(text = current_PRT_temp)
+		if (current_PRT_temp > 0.0):
+			self.label_current_PRT_temp_reading.configure(foreground = "red")
+		else:
+			self.label_current_PRT_temp_reading.configure(foreground = "blue")
+	
+	def SetFlowrateReading(self, current_flowrate):
+		self.label_current_flowrate_reading.configure(text = str(current_flowrate))
+		if current_flowrate < 5.0:
+			self.label_current_flowrate_reading.configure(foreground = "red")
+		else:
+			self.label_current_flowrate_reading.configure(foreground = "black")
 	
 	def OpenCommsFaultAlert(self):
 		for front_end in self.parent.front_ends:
@@ -535,7 +612,7 @@ class FrontEnd():
 			except:
 				failed = 1
 			if failed == 0:
-				self.mq_front_to_back.put(('Throttle', self.throttle_percentage))
+				self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.THROTTLE, self.throttle_percentage))
 				self.running_flag = True
 				self.EnableFrontEndRampControls()
 			else:
@@ -551,7 +628,7 @@ class FrontEnd():
 					new_setpoint = self.temperature_limits['max']
 				self.setpoint = new_setpoint
 				self.running_flag = True
-				self.mq_front_to_back.put(('SetPoint', self.setpoint))
+				self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SETPOINT, self.setpoint))
 				self.EnableFrontEndRampControls()
 			except:
 				self.GenerateGenericWarningWindow("Warning", "Setpoint must be numerical between " + str(self.temperature_limits['min']) + " and " + str(self.temperature_limits['max']) + " °C.")
@@ -562,7 +639,7 @@ class FrontEnd():
 				new_time_step = float(self.entry_timestep.get())
 				if new_time_step > 0.0:
 					self.time_step = new_time_step
-					self.mq_front_to_back.put(('SetTimeStep', self.time_step))
+					self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SET_TIME_STEP, self.time_step))
 					failed = 0
 				else:
 					failed = 1
@@ -585,7 +662,7 @@ class FrontEnd():
 			try:
 				new_logging_rate = int(self.entry_log_rate.get())
 				if new_logging_rate > 0:
-					self.mq_front_to_back.put(('LoggingRate', new_logging_rate))
+					self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.LOGGING_RATE, new_logging_rate))
 			except:
 				self.GenerateGenericWarningWindow("Warning", "Logging rate must be a positive integer.")
 	
@@ -606,7 +683,7 @@ class FrontEnd():
 				new_I_value = 0.0
 				new_D_value = float(self.entry_D.get())
 				new_power_multiplier_value = float(self.entry_power_multiplier.get())
-				self.mq_front_to_back.put(('PIDConfig', new_P_value, new_I_value, new_D_value, new_power_multiplier_value))
+				self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.PID_CONFIG, new_P_value, new_I_value, new_D_value, new_power_multiplier_value))
 			except:
 				self.GenerateGenericWarningWindow("Warning", "Coefficients must be numerical.")
 	
@@ -620,7 +697,7 @@ class FrontEnd():
 				self.GenerateGenericWarningWindow("Warning", "Cannot start logging as no log location selected.")
 			else:		
 				self.running_flag = True
-				self.mq_front_to_back.put(('Ramp', new_ramp_repeats, new_ramp_log_end_on_profile_end, new_ramp_path, None))
+				self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.RAMP, new_ramp_repeats, new_ramp_log_end_on_profile_end, new_ramp_path, None))
 				self.DisableFrontEndRampControls()
 				if new_ramp_log_start_on_profile_start == True:
 					self.StartLogging()
@@ -691,7 +768,7 @@ class FrontEnd():
 				# ...otherwise start the ramp.
 				new_ramp_table = [['ramp', new_ramp_start_temp, new_ramp_end_temp, new_ramp_rate]]
 				self.running_flag = True
-				self.mq_front_to_back.put(('Ramp', 1, new_ramp_log_end_on_profile_end, None, new_ramp_table))
+				self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.RAMP, 1, new_ramp_log_end_on_profile_end, None, new_ramp_table))
 				self.DisableFrontEndRampControls()
 				if new_ramp_log_start_on_profile_start == True:
 					self.StartLogging()
@@ -764,7 +841,7 @@ class FrontEnd():
 			# Get the log file path from the log location entry field.
 			self.log_file_path = self.entry_log_file.get()
 			# Instruct the back end process to begin logging.
-			self.mq_front_to_back.put(('StartLogging', self.log_file_path, False, False))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.START_LOGGING, self.log_file_path, False, False))
 			# Deactivate the video log spolit checkbox, activate the stop logging button, deactivate the start logging button
 			# and deactivate the set log location button.
 			self.DisableFrontEndLoggingControls()
@@ -789,7 +866,7 @@ class FrontEnd():
 	def StopLogging(self):
 		if self.ClicksAreActive() == True:
 			# Send message to back end process to stop logging.
-			self.mq_front_to_back.put(('StopLogging',))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.STOP_LOGGING))
 			# Clear log path entry field.
 			self.entry_log_file.configure(state = NORMAL)
 			self.entry_log_file.delete(0, 'end')
@@ -816,14 +893,14 @@ class FrontEnd():
 	
 	def ClearPlot(self):
 		if self.ClicksAreActive() == True:
-			self.mq_front_to_back.put(('NewDatumTime',))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.NEW_DATUM_TIME))
 	
 	def Off(self):
 		if self.ClicksAreActive() == True:
 			self.running_flag = False
 			self.setpoint_times = []
 			self.setpoint_temperatures = []
-			self.mq_front_to_back.put(('Off',))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.OFF))
 			self.EnableFrontEndRampControls()
 	
 	def GenerateTKWindow(self):
@@ -1311,7 +1388,7 @@ class FrontEnd():
 	def ChangeVideoResolution(self, *args):
 		if self.ClicksAreActive() == True:
 			new_video_resolution = self.video_resolution.get()
-			self.mq_front_to_back.put(('ChangeVideoRes', new_video_resolution))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.CHANGE_VIDEO_RES, new_video_resolution))
 			self.previous_video_resolution = new_video_resolution
 		else:
 			# Stop tk variable trace on self.video resolution (so we don't start an infinite recursive loop when we change the value in here...)
@@ -1328,7 +1405,7 @@ class FrontEnd():
 	def ChangeLogVideoSplitFlag(self, *args):
 		if self.ClicksAreActive() == True:
 			new_log_video_split_flag = self.log_video_split_flag.get()
-			self.mq_front_to_back.put(('ChangeLogVideoSplitFlag', new_log_video_split_flag))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.CHANGE_LOG_VIDEO_SPLIT_FLAG, new_log_video_split_flag))
 			self.previous_log_video_split_flag = new_log_video_split_flag
 		else:
 			# Stop tk variable trace on self.video resolution (so we don't start an infinite recursive loop when we change the value in here...)
@@ -1397,14 +1474,14 @@ class FrontEnd():
 				self.modal_dialog_open = False
 			
 			# Send shutdown command to back end.
-			self.mq_front_to_back.put(('ShutDown',))
+			self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.SHUT_DOWN))
 			# Flush queue from back end and block until we hit shutdown confirmation, which will be the last item.
-			most_recent_message = ' '
-			while most_recent_message != 'ShutDownConfirm':
+			most_recent_message = (0, None)
+			while most_recent_message[0] != Messages.FrontEndOp.SHUT_DOWN_CONFIRM:
 				try:
 					most_recent_message = self.mq_back_to_front.get(False, None)
 				except:
-					most_recent_message = ' '
+					most_recent_message = (0, None)
 			if self.video_enabled == True:
 				self.video_window.destroy()
 			# Shut down the timing monitor (if running).
@@ -1416,7 +1493,7 @@ class FrontEnd():
 	
 	def AllShutDown(self):
 		self.CloseCommsFaultAlert()
-		self.mq_front_to_back.put(('AllShutDown',))
+		self.mq_front_to_back.put(Messages.Message(Messages.BackEndOp.ALL_SHUT_DOWN))
 	
 	def ShutDownTimingMonitor(self):
 		self.timing_monitor_kill.clear()
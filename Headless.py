@@ -0,0 +1,370 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# Runs the back end without the Tk front ends (or matplotlib), for scripted experiments on machines without a display.
+# HeadlessColdStage stands in for the front end windows: it connects to a device by ID, starts the back end process and
+# talks to it through the same queues, shared memory telemetry rings and Messages that the GUI uses. Eg:
+#
+#	import Headless
+#	with Headless.HeadlessColdStage(device_unique_id = 0) as cold_stage:
+#		cold_stage.SubscribeTelemetry(lambda channel_id, records: print(channel_id, records['temperature'][-1]))
+#		cold_stage.SetSetpoint(0, -10.0)
+#		cold_stage.WaitForTemperature(0, -10.0, tolerance = 0.2, timeout = 300.0)
+#		cold_stage.StartLogging(0, './logs/assay_1')
+#		cold_stage.RunRamp(0, [['ramp', -10.0, -30.0, -1.0 / 60.0], ['hold', 60.0]])
+#		cold_stage.WaitForProfileEnd(0)
+#		cold_stage.StopLogging(0)
+#
+# Device ID 0 is the simulated cold stage (see FakeDuino.py). With video_device_id = 'synthetic' channel 0's video comes
+# from a synthetic camera that follows the simulated stage temperature (see SyntheticCamera.py), so the video path can be
+# run without a camera too. Telemetry and event callbacks are called from the
+# poll thread, so should return quickly.
+
+import queue
+import argparse
+import threading
+import numpy as np
+from multiprocessing import Process, Queue, Event
+
+import Defaults
+import ArduinoComms
+import BackEnd
+import Messages
+import TelemetryRing
+import FrameBuffer
+import Tracing
+import Profiling
+import WebService
+
+class HeadlessColdStage():
+	def __init__ (self, device_unique_id = 0, num_channels = None, parameter_overrides = None, video_device_id = None, poll_interval = 0.1):
+		self.device_parameter_defaults = Defaults.DeviceParameterDefaults()
+		if parameter_overrides is not None:
+			self.device_parameter_defaults.update(parameter_overrides)
+		self.comms_unique_id = device_unique_id
+		self.poll_interval = poll_interval
+		self.time_step = self.device_parameter_defaults['time_step']
+		Tracing.InitialiseTracer('Headless', self.device_parameter_defaults)
+	
+		# Ask the device how many channels it has (as the start-up dialog does), then let the back end reconnect to it.
+		comms = ArduinoComms.ArduinoComms(self)
+		if comms.ConnectByID(self.comms_unique_id) == False:
+			raise RuntimeError('Could not connect to device ' + str(self.comms_unique_id) + '.')
+		device_channels = comms.number_of_channels
+		comms.serial_connection.close()
+		if num_channels is None:
+			num_channels = device_channels
+		self.num_channels = max(1, min(num_channels, device_channels, 4))
+		Defaults.ApplyDeviceID(self.device_parameter_defaults, self.comms_unique_id, self.num_channels)
+		self.simulation_flag = (comms.port == 'none')
+		# As in the GUI, only channel 0 can have video.
+		self.video_enabled = [((i == 0) and (video_device_id is not None)) for i in range(self.num_channels)]
+	
+		self.mq_front_to_back = [Queue() for i in range(self.num_channels)]
+		self.mq_back_to_front = [Queue() for i in range(self.num_channels)]
+		self.mq_back_to_vlogger = [Queue() if self.video_enabled[i] == True else None for i in range(self.num_channels)]
+		self.mq_vlogger_to_front = [Queue() if self.video_enabled[i] == True else None for i in range(self.num_channels)]
+		self.event_vlogger_fault = [Event() if self.video_enabled[i] == True else None for i in range(self.num_channels)]
+		self.event_back_to_front = [{'calibration_zeroed_flag': Event(), 'gradient_detect_flag': Event(), 'ramp_running_flag': Event()} for i in range(self.num_channels)]
+		self.mq_timestamp = ['' for i in range(self.num_channels)]
+		if self.device_parameter_defaults['telemetry_transport'] == 'shared_memory':
+			self.telemetry_rings = [TelemetryRing.TelemetryRing(capacity = self.device_parameter_defaults['telemetry_ring_capacity'], create = True) for i in range(self.num_channels)]
+			self.telemetry_ring_names = [self.telemetry_rings[i].name for i in range(self.num_channels)]
+		else:
+			self.telemetry_rings = [None for i in range(self.num_channels)]
+			self.telemetry_ring_names = [None for i in range(self.num_channels)]
+		self.frame_buffers = FrameBuffer.CreateFrameBuffers(self.device_parameter_defaults, self.video_enabled)
+		self.latest_frames = [(None, None) for i in range(self.num_channels)]
+	
+		# What the front end windows would be showing for each channel.
+		self.channel_state = [{'datum_time': None, 'latest': None, 'mode_label': '', 'logging': False, 'temperature_limits': None, 'pid_coefficients': None,
+		                       'comms_fault': False, 'flow_fault': False, 'video_fault': False} for i in range(self.num_channels)]
+		self.datum_received = [threading.Event() for i in range(self.num_channels)]
+		self.profile_completed = [threading.Event() for i in range(self.num_channels)]
+		self.shut_down_confirmed = [threading.Event() for i in range(self.num_channels)]
+		self.all_shutdown_flag = False
+		self.closed = False
+		self.telemetry_subscribers = []
+		self.event_subscribers = []
+		self.telemetry_condition = threading.Condition()
+	
+		# Messages from the back end are handled as in FrontEnd, with the channel passed along to each handler.
+		self.message_dispatcher = Messages.Dispatcher('Headless')
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.TELEMETRY, self.HandleTelemetry)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.NEW_DATUM_TIME, self.HandleNewDatumTime)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_MODE_LABEL, self.HandleSetModeLabel)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_TEMP_LIMITS, self.HandleSetTempLimits)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_TEMP_CONTROL_COEFFS, self.HandleSetTempControlCoeffs)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_LOGGING_LABEL, self.HandleSetLoggingLabel)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.ALL_SHUTDOWN_CONFIRM, self.HandleAllShutdownConfirm)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SHUT_DOWN_CONFIRM, self.HandleShutDownConfirm)
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.COMMS_FAULT, lambda payload, channel_id: self.SetFault(channel_id, 'comms_fault', True))
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.COMMS_SUCCESS, lambda payload, channel_id: self.SetFault(channel_id, 'comms_fault', False))
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.FLOW_FAULT, lambda payload, channel_id: self.SetFault(channel_id, 'flow_fault', True))
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.FLOW_SUCCESS, lambda payload, channel_id: self.SetFault(channel_id, 'flow_fault', False))
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.VIDEO_FAULT, lambda payload, channel_id: self.SetFault(channel_id, 'video_fault', True))
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.VIDEO_SUCCESS, lambda payload, channel_id: self.SetFault(channel_id, 'video_fault', False))
+		self.message_dispatcher.RegisterHandler(Messages.FrontEndOp.SET_TIME_STEP, self.HandleSetTimeStep)
+	
+		self.process_vlogger = []
+		if True in self.video_enabled:
+			# Only imported when needed, so that a headless install doesn't need OpenCV.
+			import VideoHandler
+			self.process_vlogger = [Process(target = Profiling.ProfiledTarget(VideoHandler.VideoHandler, 'video_handler', self.device_parameter_defaults), args = (i, self.simulation_flag, self.device_parameter_defaults, self.mq_back_to_vlogger[i], self.mq_vlogger_to_front[i], self.mq_timestamp[i], self.event_vlogger_fault[i], False, video_device_id, self.frame_buffers[i].name if self.frame_buffers[i] is not None else None, self.telemetry_ring_names[i])) for i in range(self.num_channels) if self.video_enabled[i] == True]
+			for current_vlogger in self.process_vlogger:
+				current_vlogger.start()
+		self.process_back_end = Process(target = Profiling.ProfiledTarget(BackEnd.BackEnd, 'back_end', self.device_parameter_defaults), args = (self.device_parameter_defaults, self.num_channels, self.mq_front_to_back, self.mq_back_to_front, self.mq_back_to_vlogger, self.mq_timestamp, self.event_vlogger_fault, self.event_back_to_front, self.video_enabled, self.comms_unique_id, self.time_step, False, self.device_parameter_defaults['drive_mode'], self.telemetry_ring_names))
+		self.process_back_end.start()
+	
+		WebService.StartService(self.device_parameter_defaults, self.mq_front_to_back)
+		self.stop_polling = threading.Event()
+		self.poll_thread = threading.Thread(target = self.PollLoop, daemon = True)
+		self.poll_thread.start()
+	
+		# The back end sends each channel its datum time once it has connected, or shuts everything down if it can't.
+		for i in range(self.num_channels):
+			while self.datum_received[i].wait(0.1) == False:
+				if self.all_shutdown_flag == True:
+					self.Close()
+					raise RuntimeError('Back end could not connect to device ' + str(self.comms_unique_id) + '.')
+		print('Headless cold stage running, ' + str(self.num_channels) + ' channel(s).')
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.Close()
+		return False
+	
+	# Poll thread, the equivalent of FrontEnd.UpdatePoll() for all channels.
+	def PollLoop(self):
+		while self.stop_polling.wait(self.poll_interval) == False:
+			self.Poll()
+	
+	def Poll(self):
+		for channel_id in range(self.num_channels):
+			self.telemetry_messages = []
+			while True:
+				try:
+					most_recent_message = self.mq_back_to_front[channel_id].get(False)
+				except queue.Empty:
+					break
+				self.message_dispatcher.Dispatch(most_recent_message, channel_id)
+				if most_recent_message[0] != Messages.FrontEndOp.TELEMETRY:
+					WebService.Publish(channel_id, 'event', most_recent_message)
+					for callback in self.event_subscribers:
+						callback(channel_id, most_recent_message[0], most_recent_message[1])
+			if self.telemetry_rings[channel_id] is not None:
+				records = self.telemetry_rings[channel_id].ReadNew()
+			else:
+				records = np.array(self.telemetry_messages, dtype = TelemetryRing.TELEMETRY_RECORD)
+			if len(records) > 0:
+				with self.telemetry_condition:
+					self.channel_state[channel_id]['latest'] = records[-1]
+					self.telemetry_condition.notify_all()
+				WebService.Publish(channel_id, 'telemetry', records)
+				for callback in self.telemetry_subscribers:
+					callback(channel_id, records)
+			if ((self.video_enabled[channel_id] == True) and (self.frame_buffers[channel_id] is None)):
+				# Nobody is looking at the preview frames, but they mustn't pile up.
+				while True:
+					try:
+						self.mq_vlogger_to_front[channel_id].get(False)
+					except queue.Empty:
+						break
+	
+	def HandleTelemetry(self, payload, channel_id):
+		self.telemetry_messages.append(tuple(payload))
+	
+	def HandleNewDatumTime(self, payload, channel_id):
+		self.channel_state[channel_id]['datum_time'] = float(payload.datum_time)
+		self.datum_received[channel_id].set()
+	
+	def HandleSetModeLabel(self, payload, channel_id):
+		self.channel_state[channel_id]['mode_label'] = payload.text
+		if payload.text.startswith('End of profile'):
+			self.profile_completed[channel_id].set()
+	
+	def HandleSetTempLimits(self, payload, channel_id):
+		self.channel_state[channel_id]['temperature_limits'] = {'max': payload.max, 'min': payload.min}
+	
+	def HandleSetTempControlCoeffs(self, payload, channel_id):
+		self.channel_state[channel_id]['pid_coefficients'] = {'P': payload.P, 'I': payload.I, 'D': payload.D, 'power_multiplier': payload.power_multiplier}
+	
+	def HandleSetLoggingLabel(self, payload, channel_id):
+		self.channel_state[channel_id]['logging'] = (payload.text == 'ON')
+	
+	def HandleAllShutdownConfirm(self, payload, channel_id):
+		# As the front end windows do, shut the channel down once the back end has given up on the device.
+		self.all_shutdown_flag = True
+		self.mq_front_to_back[channel_id].put(Messages.Message(Messages.BackEndOp.SHUT_DOWN))
+	
+	def HandleShutDownConfirm(self, payload, channel_id):
+		self.shut_down_confirmed[channel_id].set()
+	
+	def HandleSetTimeStep(self, payload, channel_id):
+		self.time_step = float(payload.time_step)
+	
+	def SetFault(self, channel_id, fault, state):
+		if ((state == True) and (self.channel_state[channel_id][fault] == False)):
+			print('Channel ' + str(channel_id) + ' ' + fault.replace('_', ' ') + '!')
+		self.channel_state[channel_id][fault] = state
+	
+	# Subscriptions.
+	def SubscribeTelemetry(self, callback):
+		# callback(channel_id, records) is called with each new batch of readings as a TelemetryRing.TELEMETRY_RECORD array.
+		self.telemetry_subscribers.append(callback)
+	
+	def SubscribeEvents(self, callback):
+		# callback(channel_id, opcode, payload) is called with every other message from the back end (see Messages.FrontEndOp).
+		self.event_subscribers.append(callback)
+	
+	def Latest(self, channel_id):
+		# The most recent telemetry record for the channel, or None if there hasn't been one yet.
+		return self.channel_state[channel_id]['latest']
+	
+	def LatestFrame(self, channel_id):
+		# (frame, timestamp) for the most recent preview or logged frame from the channel's camera, as a height x width x 3
+		# RGB array, or (None, None) if there hasn't been one yet (or frames are sent on the queue rather than through a
+		# shared memory frame buffer).
+		if self.frame_buffers[channel_id] is not None:
+			frame, timestamp = self.frame_buffers[channel_id].ReadLatest()
+			if frame is not None:
+				self.latest_frames[channel_id] = (frame, timestamp)
+		return self.latest_frames[channel_id]
+	
+	# Commands, as sent by the front end controls.
+	def Send(self, channel_id, opcode, *fields):
+		self.mq_front_to_back[channel_id].put(Messages.Message(opcode, *fields))
+	
+	def SetSetpoint(self, channel_id, setpoint):
+		self.Send(channel_id, Messages.BackEndOp.SETPOINT, float(setpoint))
+	
+	def SetThrottle(self, channel_id, throttle):
+		self.Send(channel_id, Messages.BackEndOp.THROTTLE, float(throttle))
+	
+	def Off(self, channel_id):
+		self.Send(channel_id, Messages.BackEndOp.OFF)
+	
+	def SetPIDCoefficients(self, channel_id, P, I, D, power_multiplier = 1.0):
+		self.Send(channel_id, Messages.BackEndOp.PID_CONFIG, float(P), float(I), float(D), float(power_multiplier))
+	
+	def RunRamp(self, channel_id, profile_table = None, profile_path = None, repeats = 1, log_end_on_profile_end = False):
+		# Rows of the profile table are as in a ramp profile file, ie ['ramp', start, end, rate], ['hold', seconds] or
+		# ['setpoint', temperature].
+		self.profile_completed[channel_id].clear()
+		self.Send(channel_id, Messages.BackEndOp.RAMP, int(repeats), bool(log_end_on_profile_end), profile_path, profile_table)
+	
+	def SetLoggingRate(self, channel_id, logging_rate):
+		self.Send(channel_id, Messages.BackEndOp.LOGGING_RATE, logging_rate)
+	
+	def StartLogging(self, channel_id, log_directory, force_video_off = False):
+		# The channel logs to <log_directory>/channel_<n>/, which must not already exist.
+		self.Send(channel_id, Messages.BackEndOp.START_LOGGING, log_directory, bool(force_video_off), False)
+	
+	def StopLogging(self, channel_id):
+		self.Send(channel_id, Messages.BackEndOp.STOP_LOGGING)
+	
+	def SetFreezeDetection(self, channel_id, freeze_detection_flag):
+		# Look for droplets freezing in the video of logs started from now on (see FreezeDetection.py).
+		self.Send(channel_id, Messages.BackEndOp.FREEZE_DETECTION, bool(freeze_detection_flag))
+	
+	def NewDatumTime(self, channel_id):
+		self.Send(channel_id, Messages.BackEndOp.NEW_DATUM_TIME)
+	
+	def SetTimeStep(self, time_step):
+		# All channels share the tick, so any channel can change it.
+		self.Send(0, Messages.BackEndOp.SET_TIME_STEP, float(time_step))
+	
+	def AllShutDown(self):
+		# Give up on a device that has a comms fault (the back end keeps retrying until told to stop).
+		self.Send(0, Messages.BackEndOp.ALL_SHUT_DOWN)
+	
+	# Waiting.
+	def WaitForTemperature(self, channel_id, temperature, tolerance = 0.5, timeout = None):
+		# Block until the channel's temperature is within tolerance of temperature. Returns False on timeout.
+		def InRange():
+			latest = self.channel_state[channel_id]['latest']
+			return ((latest is not None) and (abs(float(latest['temperature']) - temperature) <= tolerance))
+		with self.telemetry_condition:
+			return self.telemetry_condition.wait_for(InRange, timeout)
+	
+	def WaitForProfileEnd(self, channel_id, timeout = None):
+		# Block until the ramp profile started by RunRamp() has finished. Returns False on timeout.
+		return self.profile_completed[channel_id].wait(timeout)
+	
+	def Close(self, timeout = 30.0):
+		# Shut the channels and the back end down, as closing the front end windows does.
+		if self.closed == True:
+			return
+		self.closed = True
+		if self.process_back_end.is_alive() == True:
+			for i in range(self.num_channels):
+				if self.shut_down_confirmed[i].is_set() == False:
+					self.Send(i, Messages.BackEndOp.SHUT_DOWN)
+			for i in range(self.num_channels):
+				self.shut_down_confirmed[i].wait(timeout)
+		self.stop_polling.set()
+		self.poll_thread.join()
+		WebService.StopService()
+		for current_vlogger in self.process_vlogger:
+			current_vlogger.join()
+		self.process_back_end.join()
+		for shared_buffer in self.telemetry_rings + self.frame_buffers:
+			if shared_buffer is not None:
+				shared_buffer.Close()
+				shared_buffer.Unlink()
+		self.telemetry_rings = [None for i in range(self.num_channels)]
+		self.frame_buffers = [None for i in range(self.num_channels)]
+		Tracing.ExportTracer(self.device_parameter_defaults)
+		print('Headless cold stage closed.')
+
+def Main(argv = None):
+	# Run one ramp profile file on one channel, logging throughout, eg:
+	#
+	#	python3 Headless.py --device 0 --channel 0 --profile ./ramp_profile.csv --log ./logs/run_1
+	parser = argparse.ArgumentParser(description = 'Run a Cold Stage 4 ramp profile without the GUI.')
+	parser.add_argument('--device', type = int, default = 0, help = 'Device unique ID, 0 = simulation.')
+	parser.add_argument('--channel', type = int, default = 0)
+	parser.add_argument('--profile', required = True, help = 'Ramp profile file.')
+	parser.add_argument('--repeats', type = int, default = 1)
+	parser.add_argument('--log', help = 'Log directory (must not exist), none = no logging.')
+	parser.add_argument('--camera', help = 'Video device for channel 0, a camera number or synthetic, none = no video.')
+	args = parser.parse_args(argv)
+	video_device_id = args.camera
+	if ((video_device_id is not None) and (video_device_id.isdigit() == True)):
+		video_device_id = int(video_device_id)
+	with HeadlessColdStage(args.device, video_device_id = video_device_id) as cold_stage:
+		if args.log is not None:
+			cold_stage.StartLogging(args.channel, args.log)
+		cold_stage.RunRamp(args.channel, profile_path = args.profile, repeats = args.repeats)
+		cold_stage.WaitForProfileEnd(args.channel)
+		if args.log is not None:
+			cold_stage.StopLogging(args.channel)
+
+if __name__ == '__main__':
+	Main()
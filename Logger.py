@@ -25,29 +25,208 @@
 
 """
  
+import os
+import time
+import collections
+import threading
+
+import Tracing
+import Metrics
+
+class LoggerQueue():
+    def __init__ (self, max_rows, drain_interval = 0.25):
+        # A bounded in-process queue between a cooler channel (the single producer) and its logger thread (the single
+        # consumer). Rows are appended to and popped from a deque, both of which are atomic under the GIL, so the producer 
+        # never takes a lock and never waits. The logger thread wakes up every drain_interval seconds and writes out 
+        # everything that has arrived in one go.
+        self.rows = collections.deque()
+        self.max_rows = max_rows
+        self.drain_interval = drain_interval
+        self.wake_event = threading.Event()
+        self.shutdown_flag = False
+        self.queued_rows = 0
+        self.dropped_rows = 0
+    
+    def Put(self, row):
+        # If the logger has fallen so far behind that the queue is full, the row is dropped and counted rather than
+        # buffered without limit. Returns False if the row was dropped.
+        if len(self.rows) >= self.max_rows:
+            self.dropped_rows += 1
+            return False
+        self.rows.append(row)
+        self.queued_rows += 1
+        return True
+    
+    def PutControl(self, message):
+        # Control messages (ie, the header row and ramp state changes) are rare and are never dropped.
+        self.rows.append(message)
+    
+    def GetBatch(self):
+        # Block until the drain interval has elapsed (or we are shut down) and then return everything on the queue.
+        # The shutdown flag is only returned once the queue has been completely drained.
+        self.wake_event.wait(self.drain_interval)
+        shutdown_flag = self.shutdown_flag
+        batch = []
+        while len(self.rows) > 0:
+            batch.append(self.rows.popleft())
+        return shutdown_flag, batch
+    
+    def Shutdown(self):
+        self.shutdown_flag = True
+        self.wake_event.set()
+
 class Logger():
-    def __init__ (self, mq_back_to_logger, file_path):
-        self.mq_back_to_logger = mq_back_to_logger
+    def __init__ (self, logger_queue, file_path, segment_max_bytes = 0, segment_max_seconds = 0.0, trace_tid = 0, channel_id = 0):
+        self.logger_queue = logger_queue
+        self.tracer = Tracing.GetTracer()
+        self.trace_tid = trace_tid
+        self.metrics = Metrics.GetMetrics()
+        self.channel_id = channel_id
         self.file_path = file_path
+        # If either segment limit is non-zero the log is split into numbered segment files, each of which starts with the
+        # header row so it can be analysed on its own. A manifest listing the segments is kept alongside them. If both
+        # limits are zero everything is written to file_path as a single file, as before.
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.rotation_enabled = ((self.segment_max_bytes > 0) or (self.segment_max_seconds > 0.0))
+        self.file_path_root, self.file_path_extension = os.path.splitext(self.file_path)
+        self.manifest_path = self.file_path_root + '_manifest.csv'
+        self.header_row = None
+        self.ramp_state = ''
+        self.segments = []
+        self.rows_written = 0
+        self.reported_dropped_rows = 0
         
         shut_down = False
         
         print("Logger ready.")
         
         while shut_down == False:
-            most_recent_row = self.mq_back_to_logger.get(True, timeout=None)
-            if most_recent_row == 'Shutdown':
-                shut_down = True
-            else:
-                log_file = open(self.file_path, 'a')
-                self.AppendRow(log_file, most_recent_row)
-                self.CloseFile(log_file)
+            shut_down, rows = self.logger_queue.GetBatch()
+            if len(rows) > 0:
+                span_start = self.tracer.Now()
+                rows_written = self.rows_written
+                self.WriteRows(rows)
+                self.tracer.Record('log_write', span_start, tid = self.trace_tid, args = {'rows': len(rows)})
+                self.metrics.Inc('coldstage_log_rows_written_total', self.rows_written - rows_written, channel = self.channel_id)
+                self.metrics.Inc('coldstage_log_write_seconds_total', (self.tracer.Now() - span_start) / 1e9, channel = self.channel_id)
+            self.CheckDroppedRows()
         
-        print("Logger shut down.")
+        if ((self.rotation_enabled == True) and (len(self.segments) > 0)):
+            self.CloseSegment()
+        print("Logger shut down, " + str(self.rows_written) + " rows written, " + str(self.logger_queue.dropped_rows) + " rows dropped.")
         # Function ends.
     
+    def WriteRows(self, rows):
+        # Write a whole batch of rows with a single open() and close() of the current log file.
+        log_file = None
+        for row in rows:
+            if type(row) is tuple:
+                # Control messages from the cooler channel arrive as tuples, data rows as strings.
+                if row[0] == 'RampState':
+                    self.ramp_state = row[1]
+                    if len(self.segments) > 0:
+                        self.AddSegmentRampState(self.segments[-1], self.ramp_state)
+            elif self.rotation_enabled == False:
+                if log_file is None:
+                    log_file = open(self.file_path, 'a')
+                self.AppendRow(log_file, row)
+                self.rows_written += 1
+            elif self.header_row is None:
+                # The first row is always the column header, which is repeated at the top of every segment.
+                self.header_row = row
+                self.OpenSegment()
+            else:
+                if self.SegmentFull(self.segments[-1]) == True:
+                    if log_file is not None:
+                        self.CloseFile(log_file)
+                        log_file = None
+                    self.CloseSegment()
+                    self.OpenSegment()
+                if log_file is None:
+                    log_file = open(self.segments[-1]['file_path'], 'a')
+                self.WriteSegmentRow(log_file, self.segments[-1], row)
+                self.rows_written += 1
+        if log_file is not None:
+            self.CloseFile(log_file)
+    
+    def CheckDroppedRows(self):
+        # Report any rows the cooler channel had to drop because the queue was full.
+        dropped_rows = self.logger_queue.dropped_rows
+        if dropped_rows > self.reported_dropped_rows:
+            print('Logger queue full, ' + str(dropped_rows - self.reported_dropped_rows) + ' rows dropped (' + str(dropped_rows) + ' in total)!')
+            self.metrics.Inc('coldstage_log_rows_dropped_total', dropped_rows - self.reported_dropped_rows, channel = self.channel_id)
+            if len(self.segments) > 0:
+                self.segments[-1]['dropped_rows'] += (dropped_rows - self.reported_dropped_rows)
+            self.reported_dropped_rows = dropped_rows
+    
     def AppendRow(self, log_file, row):
         log_file.write(str(row) + '\n')
     
+    def RowBytes(self, log_file, row):
+        # Bytes AppendRow() writes for row, as encoded by log_file and with its '\n' written as os.linesep (ie, '\r\n' on
+        # Windows).
+        return len(str(row).encode(log_file.encoding)) + len(os.linesep)
+    
     def CloseFile(self, log_file):
         log_file.close()
+    
+    def OpenSegment(self):
+        segment_number = len(self.segments)
+        segment = {'number': segment_number, 'file_path': self.file_path_root + '_' + '{:04d}'.format(segment_number) + self.file_path_extension, 
+                   'start_timestamp': time.time(), 'end_timestamp': None, 'first_time': 'NA', 'last_time': 'NA', 'rows': 0, 'bytes': 0, 'dropped_rows': 0, 'ramp_states': []}
+        self.AddSegmentRampState(segment, self.ramp_state)
+        self.segments.append(segment)
+        log_file = open(segment['file_path'], 'a')
+        self.AppendRow(log_file, self.header_row)
+        segment['bytes'] += self.RowBytes(log_file, self.header_row)
+        self.CloseFile(log_file)
+        self.WriteManifest()
+        print('Log segment ' + segment['file_path'] + ' opened.')
+    
+    def CloseSegment(self):
+        self.segments[-1]['end_timestamp'] = time.time()
+        self.WriteManifest()
+    
+    def SegmentFull(self, segment):
+        # Only roll over once the segment holds at least one data row, so that no segment is ever empty.
+        if segment['rows'] == 0:
+            return False
+        if ((self.segment_max_bytes > 0) and (segment['bytes'] >= self.segment_max_bytes)):
+            return True
+        if ((self.segment_max_seconds > 0.0) and ((time.time() - segment['start_timestamp']) >= self.segment_max_seconds)):
+            return True
+        return False
+    
+    def WriteSegmentRow(self, log_file, segment, row):
+        self.AppendRow(log_file, row)
+        # The first column of every data row is the time in seconds since logging started.
+        row_time = str(row).split(',')[0].strip()
+        if segment['rows'] == 0:
+            segment['first_time'] = row_time
+        segment['last_time'] = row_time
+        segment['rows'] += 1
+        segment['bytes'] += self.RowBytes(log_file, row)
+    
+    def AddSegmentRampState(self, segment, ramp_state):
+        if ((ramp_state != '') and (ramp_state not in segment['ramp_states'])):
+            segment['ramp_states'].append(ramp_state)
+    
+    def WriteManifest(self):
+        # The manifest is re-written in full every time a segment is opened or closed. Segments marked 'closed' will not
+        # change again, so they can be processed while the run continues.
+        temporary_manifest_path = self.manifest_path + '.tmp'
+        with open(temporary_manifest_path, 'w') as manifest_file:
+            manifest_file.write('Segment, File, Status, Start Time, End Time, First Time (secs), Last Time (secs), Rows, Dropped Rows, Ramp States\n')
+            for segment in self.segments:
+                if segment['end_timestamp'] is None:
+                    status = 'open'
+                    end_time = 'NA'
+                else:
+                    status = 'closed'
+                    end_time = time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(segment['end_timestamp']))
+                start_time = time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(segment['start_timestamp']))
+                manifest_file.write(str(segment['number']) + ', ' + os.path.basename(segment['file_path']) + ', ' + status + ', ' + start_time + ', ' + end_time + ', ' + 
+                                    segment['first_time'] + ', ' + segment['last_time'] + ', ' + str(segment['rows']) + ', ' + str(segment['dropped_rows']) + ', ' + 
+                                    ';'.join(segment['ramp_states']) + '\n')
+        os.replace(temporary_manifest_path, self.manifest_path)
@@ -0,0 +1,177 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+
+# The messages passed between the front end, back end and video handler processes.
+#
+# Every message is a 2-tuple of (opcode, payload). The opcode is an int taken from one of the IntEnums below, one enum
+# per destination. The payload is a namedtuple specific to the opcode, or None for opcodes that carry no data. 
+# Receivers look the opcode up in a Dispatcher (a dict of opcode -> handler), so adding a new message type only needs
+# a new opcode, optionally a payload type, and a call to RegisterHandler() on the receiving side.
+
+import collections
+from enum import IntEnum
+
+class BackEndOp(IntEnum):
+	# Front end (and its widgets) -> back end cooler channel.
+	THROTTLE = 1
+	SETPOINT = 2
+	RAMP = 3
+	PID_CONFIG = 4
+	LOGGING_RATE = 5
+	START_LOGGING = 6
+	STOP_LOGGING = 7
+	SET_TIME_STEP = 8
+	NEW_DATUM_TIME = 9
+	CALIBRATION_OFF = 10
+	CALIBRATION_ON = 11
+	SET_CALIBRATION_LIMIT = 12
+	OFF = 13
+	CHANGE_VIDEO_RES = 14
+	CHANGE_LOG_VIDEO_SPLIT_FLAG = 15
+	SHUT_DOWN = 16
+	ALL_SHUT_DOWN = 17
+	FREEZE_DETECTION = 18
+
+class FrontEndOp(IntEnum):
+	# Back end -> front end.
+	TELEMETRY = 101
+	NEW_DATUM_TIME = 102
+	SET_MODE_LABEL = 103
+	SET_TEMP_LIMITS = 104
+	SET_TEMP_CONTROL_COEFFS = 105
+	SET_LOGGING_LABEL = 106
+	ALL_SHUTDOWN_CONFIRM = 107
+	SHUT_DOWN_CONFIRM = 108
+	COMMS_FAULT = 109
+	COMMS_SUCCESS = 110
+	FLOW_FAULT = 111
+	FLOW_SUCCESS = 112
+	VIDEO_FAULT = 113
+	VIDEO_SUCCESS = 114
+	SET_TIME_STEP = 115
+
+class VideoOp(IntEnum):
+	# Back end -> video handler.
+	LOG_ON = 201
+	LOG_OFF = 202
+	SHUT_DOWN = 203
+	PATH = 204
+	RESOLUTION = 205
+	CAPTURE = 206
+	FREEZE_DETECTION = 207
+
+# Payloads, front end -> back end.
+Throttle = collections.namedtuple('Throttle', ['throttle'])
+SetPoint = collections.namedtuple('SetPoint', ['setpoint'])
+Ramp = collections.namedtuple('Ramp', ['repeats', 'log_end_on_profile_end', 'profile_path', 'profile_table'])
+PIDConfig = collections.namedtuple('PIDConfig', ['P', 'I', 'D', 'power_multiplier'])
+LoggingRate = collections.namedtuple('LoggingRate', ['logging_rate'])
+StartLogging = collections.namedtuple('StartLogging', ['file_path', 'force_video_off', 'force_log_data_file_path'])
+SetTimeStep = collections.namedtuple('SetTimeStep', ['time_step'])
+SetCalibrationLimit = collections.namedtuple('SetCalibrationLimit', ['calibration_limit'])
+ChangeVideoRes = collections.namedtuple('ChangeVideoRes', ['resolution'])
+ChangeLogVideoSplitFlag = collections.namedtuple('ChangeLogVideoSplitFlag', ['log_video_split_flag'])
+FreezeDetection = collections.namedtuple('FreezeDetection', ['freeze_detection_flag'])
+
+# Payloads, back end -> front end. The Telemetry fields are in the same order as TelemetryRing.TELEMETRY_RECORD, so a 
+# list of them converts straight to a structured array.
+Telemetry = collections.namedtuple('Telemetry', ['timestamp', 'temperature', 'prt_temperature', 'flow_rate', 'setpoint', 'throttle'])
+NewDatumTime = collections.namedtuple('NewDatumTime', ['datum_time'])
+ModeLabel = collections.namedtuple('ModeLabel', ['text'])
+TempLimits = collections.namedtuple('TempLimits', ['max', 'min'])
+ControlCoeffs = collections.namedtuple('ControlCoeffs', ['P', 'I', 'D', 'power_multiplier'])
+LoggingLabel = collections.namedtuple('LoggingLabel', ['text'])
+TimeStep = collections.namedtuple('TimeStep', ['time_step'])
+
+# Payloads, back end -> video handler.
+VideoPath = collections.namedtuple('VideoPath', ['path'])
+VideoResolution = collections.namedtuple('VideoResolution', ['x', 'y'])
+CaptureFrame = collections.namedtuple('CaptureFrame', ['index', 'temp', 'setpoint', 'timestamp'])
+FreezeDetectionPath = collections.namedtuple('FreezeDetectionPath', ['path'])
+
+PAYLOAD_TYPES = {BackEndOp.THROTTLE: Throttle, 
+                 BackEndOp.SETPOINT: SetPoint, 
+                 BackEndOp.RAMP: Ramp, 
+                 BackEndOp.PID_CONFIG: PIDConfig, 
+                 BackEndOp.LOGGING_RATE: LoggingRate, 
+                 BackEndOp.START_LOGGING: StartLogging, 
+                 BackEndOp.SET_TIME_STEP: SetTimeStep, 
+                 BackEndOp.SET_CALIBRATION_LIMIT: SetCalibrationLimit, 
+                 BackEndOp.CHANGE_VIDEO_RES: ChangeVideoRes, 
+                 BackEndOp.CHANGE_LOG_VIDEO_SPLIT_FLAG: ChangeLogVideoSplitFlag, 
+                 BackEndOp.FREEZE_DETECTION: FreezeDetection, 
+                 FrontEndOp.TELEMETRY: Telemetry, 
+                 FrontEndOp.NEW_DATUM_TIME: NewDatumTime, 
+                 FrontEndOp.SET_MODE_LABEL: ModeLabel, 
+                 FrontEndOp.SET_TEMP_LIMITS: TempLimits, 
+                 FrontEndOp.SET_TEMP_CONTROL_COEFFS: ControlCoeffs, 
+                 FrontEndOp.SET_LOGGING_LABEL: LoggingLabel, 
+                 FrontEndOp.SET_TIME_STEP: TimeStep, 
+                 VideoOp.PATH: VideoPath, 
+                 VideoOp.RESOLUTION: VideoResolution, 
+                 VideoOp.CAPTURE: CaptureFrame, 
+                 VideoOp.FREEZE_DETECTION: FreezeDetectionPath}
+
+def Message(opcode, *fields):
+	# Build a message ready to put on a queue, eg Message(BackEndOp.SETPOINT, -20.0). The opcode is sent as a plain int
+	# as it is cheaper to pickle than the enum member, and compares and hashes the same.
+	if opcode in PAYLOAD_TYPES:
+		return (int(opcode), PAYLOAD_TYPES[opcode](*fields))
+	if len(fields) > 0:
+		raise ValueError('Message ' + OpcodeName(opcode) + ' takes no payload.')
+	return (int(opcode), None)
+
+def RegisterPayloadType(opcode, payload_type):
+	# Payload types for any message types added outside this module.
+	PAYLOAD_TYPES[opcode] = payload_type
+
+def OpcodeName(opcode):
+	for op_enum in (BackEndOp, FrontEndOp, VideoOp):
+		try:
+			return op_enum(opcode).name
+		except ValueError:
+			pass
+	return str(opcode)
+
+class Dispatcher():
+	def __init__ (self, name):
+		# Maps opcodes to handlers for one receiver. Handlers are called as handler(payload, *args) and whatever they
+		# return is returned from Dispatch().
+		self.name = name
+		self.handlers = {}
+	
+	def RegisterHandler(self, opcode, handler):
+		self.handlers[int(opcode)] = handler
+	
+	def Dispatch(self, message, *args):
+		opcode, payload = message
+		handler = self.handlers.get(opcode)
+		if handler is None:
+			print(self.name + ' has no handler for message ' + OpcodeName(opcode) + ', ignored.')
+			return None
+		return handler(payload, *args)
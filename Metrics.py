@@ -0,0 +1,185 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# Counters and gauges in the Prometheus text exposition format, so that degraded comms, slow disks etc can be alerted
+# on before a long assay is ruined.
+#
+# Like the Tracer (see Tracing.py), each process has one registry, set up with InitialiseMetrics() and fetched anywhere
+# else in that process with GetMetrics(). Every metrics_write_seconds each process (back end and video handlers) writes
+# its metrics to <metrics_output_directory>/<process name>.prom, replacing the file atomically, which suits the
+# node_exporter textfile collector. If the web service is running (see WebService.py) it also serves all of the files
+# merged together at /metrics.
+#
+# All metric names are listed, with their type and help text, in METRIC_DEFINITIONS below.
+
+import os
+import glob
+import time
+import threading
+
+METRIC_DEFINITIONS = {
+	# BackEnd
+	'coldstage_ticks_total': ('counter', 'Back end ticks run.'),
+	'coldstage_tick_overruns_total': ('counter', 'Ticks that ran past the start of the next tick.'),
+	'coldstage_ticks_skipped_total': ('counter', 'Ticks skipped after an overrun.'),
+	'coldstage_tick_duration_seconds': ('gauge', 'Duration of the last tick.'),
+	'coldstage_tick_interval_seconds': ('gauge', 'Current time-step.'),
+	'coldstage_queue_depth': ('gauge', 'Messages waiting on an inter-process queue.'),
+	# ArduinoComms
+	'coldstage_comms_calls_total': ('counter', 'Serial calls made to the cold stage hardware.'),
+	'coldstage_comms_faults_total': ('counter', 'Failed serial calls, by fault code (t = timeout, c = CRC failure, f = USB connection failure).'),
+	'coldstage_comms_crc_failures_total': ('counter', 'Serial replies that failed their CRC check.'),
+	'coldstage_comms_retries_total': ('counter', 'Serial calls retried after a timeout or CRC failure.'),
+	'coldstage_comms_reconnect_attempts_total': ('counter', 'Attempts to reconnect after a USB connection failure.'),
+	# CoolerChannel
+	'coldstage_temperature_celsius': ('gauge', 'Calibrated thermocouple temperature.'),
+	'coldstage_prt_temperature_celsius': ('gauge', 'Calibrated PRT temperature.'),
+	'coldstage_flow_rate_litres_per_minute': ('gauge', 'Coolant flow rate.'),
+	'coldstage_setpoint_celsius': ('gauge', 'Current setpoint (NaN if none).'),
+	'coldstage_throttle_percent': ('gauge', 'Current throttle.'),
+	'coldstage_flow_faults_total': ('counter', 'Coolant flow faults.'),
+	'coldstage_logging': ('gauge', '1 if the channel is logging.'),
+	# Logger
+	'coldstage_log_rows_written_total': ('counter', 'Log rows written to disk.'),
+	'coldstage_log_rows_dropped_total': ('counter', 'Log rows dropped because the logger queue was full.'),
+	'coldstage_log_write_seconds_total': ('counter', 'Time spent writing log rows to disk.'),
+	# VideoHandler
+	'coldstage_frames_captured_total': ('counter', 'Frames read from the camera.'),
+	'coldstage_frames_queued_total': ('counter', 'Logged frames queued for the frame writers.'),
+	'coldstage_frames_written_total': ('counter', 'Logged frames written to disk.'),
+	'coldstage_frames_dropped_total': ('counter', 'Logged frames requested but not stored, by reason.'),
+	'coldstage_frames_unchanged_total': ('counter', 'Logged frames not stored as they were unchanged since the last stored frame.'),
+	'coldstage_frame_writer_queue_depth': ('gauge', 'Logged frames waiting for a frame writer.'),
+	'coldstage_video_faults_total': ('counter', 'Camera faults.'),
+	'coldstage_droplets_frozen': ('gauge', 'Droplets found to have frozen in the current drop assay.'),
+	'coldstage_frozen_fraction': ('gauge', 'Fraction of the droplets in the current drop assay that have frozen.'),
+	'coldstage_frame_offset_seconds': ('gauge', 'Time from the temperature reading to when its logged frame was read (negative if read before).'),
+}
+
+class MetricsRegistry():
+	def __init__ (self, process_name, enabled = True, output_directory = './metrics/', write_seconds = 5.0):
+		self.process_name = process_name
+		self.enabled = enabled
+		self.output_directory = output_directory
+		self.write_seconds = write_seconds
+		self.last_write = time.monotonic()
+		# (name, ((label, value), ...)) -> value. The logger and frame writer threads update these too.
+		self.values = {}
+		self.lock = threading.Lock()
+	
+	def Inc(self, name, amount = 1, **labels):
+		if self.enabled == False:
+			return
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.values[key] = self.values.get(key, 0) + amount
+	
+	def Set(self, name, value, **labels):
+		if self.enabled == False:
+			return
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.values[key] = value
+	
+	def Exposition(self):
+		with self.lock:
+			values = sorted(self.values.items())
+		lines = []
+		last_name = None
+		for (name, labels), value in values:
+			if name != last_name:
+				metric_type, help_text = METRIC_DEFINITIONS.get(name, ('untyped', ''))
+				lines.append('# HELP ' + name + ' ' + help_text)
+				lines.append('# TYPE ' + name + ' ' + metric_type)
+				last_name = name
+			if len(labels) > 0:
+				name = name + '{' + ','.join([label + '="' + str(label_value) + '"' for label, label_value in labels]) + '}'
+			lines.append(name + ' ' + FormatValue(value))
+		return '\n'.join(lines) + '\n'
+	
+	def Write(self):
+		if ((self.enabled == False) or (len(self.values) == 0)):
+			return
+		if not os.path.exists(self.output_directory):
+			os.makedirs(self.output_directory)
+		file_path = os.path.join(self.output_directory, self.process_name.replace(' ', '_') + '.prom')
+		with open(file_path + '.tmp', 'w') as metrics_file:
+			metrics_file.write(self.Exposition())
+		os.replace(file_path + '.tmp', file_path)
+		self.last_write = time.monotonic()
+	
+	def WriteDue(self):
+		# Cheap enough to call every tick.
+		return ((self.enabled == True) and ((time.monotonic() - self.last_write) >= self.write_seconds))
+	
+	def WriteIfDue(self):
+		if self.WriteDue() == True:
+			self.Write()
+
+def FormatValue(value):
+	value = float(value)
+	if value != value:
+		return 'NaN'
+	if value.is_integer():
+		return str(int(value))
+	return repr(value)
+
+def CollectFiles(directory):
+	# Merge the metrics files written by each process into one exposition, with each metric's samples from all of the
+	# files together under a single HELP and TYPE.
+	families = {}
+	for file_path in sorted(glob.glob(os.path.join(directory, '*.prom'))):
+		with open(file_path, 'r') as metrics_file:
+			for line in metrics_file:
+				line = line.rstrip('\n')
+				if line == '':
+					continue
+				if line.startswith('#'):
+					name = line.split(' ')[2]
+					families.setdefault(name, {'header': [], 'samples': []})
+					if len(families[name]['header']) < 2:
+						families[name]['header'].append(line)
+				else:
+					name = line.split('{')[0].split(' ')[0]
+					families.setdefault(name, {'header': [], 'samples': []})['samples'].append(line)
+	lines = []
+	for name in sorted(families.keys()):
+		lines.extend(families[name]['header'][:2])
+		lines.extend(families[name]['samples'])
+	return '\n'.join(lines) + '\n'
+
+# The registry for this process. Disabled until InitialiseMetrics() is called, so GetMetrics() is always safe to use.
+_metrics = MetricsRegistry('unmeasured', enabled = False)
+
+def InitialiseMetrics(process_name, device_parameter_defaults):
+	global _metrics
+	_metrics = MetricsRegistry(process_name, bool(device_parameter_defaults['metrics_enabled']), device_parameter_defaults['metrics_output_directory'],
+	                           device_parameter_defaults['metrics_write_seconds'])
+	return _metrics
+
+def GetMetrics():
+	return _metrics
@@ -0,0 +1,80 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+from PIL import Image, ImageFont, ImageDraw
+
+class OverlayRenderer():
+	def __init__ (self, font_path = './DejaVuSansMono.ttf', font_size = 12, colour = (255, 0, 0)):
+		# Stamps lines of text (the date, frame index, temperature etc) straight onto a frame as a NumPy array, in whatever
+		# channel order the frame is in (colour is given in the same order, so the default is blue for OpenCV's BGR).
+		#
+		# Each character is rasterised with FreeType once, the first time it is used, and kept as an anti-aliased coverage
+		# mask one line high and one character advance wide. Drawing a line then just joins the cached masks side by side
+		# and blends the colour into the frame in a single operation, instead of converting the whole frame to a PIL image
+		# and rendering the text again for every frame.
+		self.font = ImageFont.truetype(font_path, font_size)
+		ascent, descent = self.font.getmetrics()
+		self.line_height = ascent + descent
+		self.colour = np.array(colour, dtype = np.float32)
+		self.glyphs = {}
+	
+	def Glyph(self, character):
+		glyph = self.glyphs.get(character)
+		if glyph is None:
+			# getlength() is Pillow 8.0 on, getsize() (gone from Pillow 10) before that.
+			if hasattr(self.font, 'getlength'):
+				advance = self.font.getlength(character)
+			else:
+				advance = self.font.getsize(character)[0]
+			advance = max(1, int(round(advance)))
+			glyph_image = Image.new('L', (advance, self.line_height), 0)
+			ImageDraw.Draw(glyph_image).text((0, 0), character, font = self.font, fill = 255)
+			glyph = np.asarray(glyph_image, dtype = np.float32) / 255.0
+			self.glyphs[character] = glyph
+		return glyph
+	
+	def LineMask(self, text):
+		return np.hstack([self.Glyph(character) for character in text])
+	
+	def Draw(self, frame, lines, line_spacing = None, x = 0, y = 0):
+		# Draw each line of text in lines onto frame (height x width x channels, uint8) in place, line_spacing pixels
+		# apart, starting with the top left of the first line at (x, y). Text running off the frame is clipped.
+		if line_spacing is None:
+			line_spacing = self.line_height
+		frame_height, frame_width = frame.shape[:2]
+		for line_number, text in enumerate(lines):
+			top = y + (line_number * line_spacing)
+			if ((len(text) == 0) or (top >= frame_height) or (x >= frame_width)):
+				continue
+			mask = self.LineMask(text)
+			height = min(mask.shape[0], frame_height - top)
+			width = min(mask.shape[1], frame_width - x)
+			alpha = mask[:height, :width, np.newaxis]
+			region = frame[top:top + height, x:x + width]
+			region[...] = (region + (alpha * (self.colour - region)) + 0.5).astype(np.uint8)
+		return frame
@@ -0,0 +1,174 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# Optional profiling of the Cold Stage processes, chosen at launch, eg:
+#
+#	python3 ColdStage.py --profile back_end video_handler --profiler sampling
+#
+# Each process target is wrapped in a ProfiledTarget (see ColdStage.py). If the process is one of those chosen in
+# device_parameter_defaults['profile_processes'], it runs under the profiler and writes its results to
+# <profile_output_directory>/<process name>_<pid>.* when it finishes:
+#
+#	'cprofile'	Exact call counts and times, but for the process' main thread only. Writes a .prof file (for pstats
+#				or snakeviz) and a .txt summary of the top functions by cumulative time.
+#	'sampling'	Samples the stacks of every thread in the process every profile_sample_interval_seconds, so it sees the
+#				logger and frame writer threads and costs much less. Writes a .folded file (one 'stack count' line per
+#				distinct stack, for flamegraph.pl or speedscope) and a .txt summary of the most sampled functions.
+#
+# Whether or not it is profiled, every process (on Linux and macOS) will print the current stack of all of its threads
+# to the console when sent SIGUSR1, eg 'kill -USR1 <pid>', without stopping.
+
+import os
+import sys
+import time
+import signal
+import cProfile
+import pstats
+import threading
+import faulthandler
+import collections
+
+PROCESS_NAMES = ['front_end', 'back_end', 'video_handler', 'timing_monitor']
+PROFILERS = ['cprofile', 'sampling']
+
+class CProfileProfiler():
+	def __init__ (self):
+		self.profile = cProfile.Profile()
+	
+	def Start(self):
+		self.profile.enable()
+	
+	def Stop(self):
+		self.profile.disable()
+	
+	def Write(self, file_path_root):
+		self.profile.dump_stats(file_path_root + '.prof')
+		with open(file_path_root + '.txt', 'w') as summary_file:
+			statistics = pstats.Stats(self.profile, stream = summary_file)
+			statistics.sort_stats('cumulative').print_stats(40)
+		return file_path_root + '.prof'
+
+class SamplingProfiler():
+	def __init__ (self, sample_interval = 0.005):
+		self.sample_interval = sample_interval
+		self.stack_counts = collections.Counter()
+		self.samples = 0
+		self.stop_event = threading.Event()
+		self.sampling_thread = None
+	
+	def Start(self):
+		self.start_time = time.monotonic()
+		self.sampling_thread = threading.Thread(target = self.SampleLoop, daemon = True)
+		self.sampling_thread.start()
+	
+	def Stop(self):
+		self.stop_event.set()
+		self.sampling_thread.join()
+		self.duration = time.monotonic() - self.start_time
+	
+	def SampleLoop(self):
+		own_thread_id = threading.get_ident()
+		while not self.stop_event.wait(self.sample_interval):
+			thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+			for thread_id, frame in sys._current_frames().items():
+				if thread_id == own_thread_id:
+					continue
+				stack = []
+				while frame is not None:
+					stack.append(frame.f_code.co_name + ' (' + os.path.basename(frame.f_code.co_filename) + ':' + str(frame.f_code.co_firstlineno) + ')')
+					frame = frame.f_back
+				stack.append(thread_names.get(thread_id, str(thread_id)))
+				self.stack_counts[';'.join(reversed(stack))] += 1
+			self.samples += 1
+	
+	def Write(self, file_path_root):
+		with open(file_path_root + '.folded', 'w') as folded_file:
+			for stack, count in self.stack_counts.most_common():
+				folded_file.write(stack + ' ' + str(count) + '\n')
+		# A function's own samples are those where it is at the top of the stack, its total samples those where it
+		# is anywhere on the stack (counted once per stack, so recursion doesn't count twice).
+		own_counts = collections.Counter()
+		total_counts = collections.Counter()
+		for stack, count in self.stack_counts.items():
+			functions = stack.split(';')[1:]
+			if len(functions) > 0:
+				own_counts[functions[-1]] += count
+			for function in set(functions):
+				total_counts[function] += count
+		with open(file_path_root + '.txt', 'w') as summary_file:
+			summary_file.write(str(self.samples) + ' samples of all threads every ' + str(self.sample_interval) + ' s over ' + str(round(self.duration, 1)) + ' s.\n\n')
+			summary_file.write('Own samples  Total samples  Function\n')
+			for function, count in own_counts.most_common(40):
+				summary_file.write(str(count).rjust(11) + '  ' + str(total_counts[function]).rjust(13) + '  ' + function + '\n')
+		return file_path_root + '.folded'
+
+def InstallStackDump(process_name):
+	# faulthandler writes from its own signal handler, so this works even if the process is stuck in a long call.
+	if ((hasattr(faulthandler, 'register') == False) or (hasattr(signal, 'SIGUSR1') == False)):
+		return
+	faulthandler.register(signal.SIGUSR1, file = sys.stderr, all_threads = True)
+	print(process_name + ' (pid ' + str(os.getpid()) + '): send SIGUSR1 for a stack dump.')
+
+def Start(process_name, device_parameter_defaults):
+	# Set up the stack dump and, if this process was chosen, start and return its profiler (otherwise None).
+	if device_parameter_defaults['stack_dump_on_signal'] == True:
+		InstallStackDump(process_name)
+	if process_name not in device_parameter_defaults['profile_processes']:
+		return None
+	if device_parameter_defaults['profiler'] == 'sampling':
+		profiler = SamplingProfiler(device_parameter_defaults['profile_sample_interval_seconds'])
+	else:
+		profiler = CProfileProfiler()
+	profiler.process_name = process_name
+	profiler.output_directory = device_parameter_defaults['profile_output_directory']
+	profiler.Start()
+	print('Profiling ' + process_name + ' (' + device_parameter_defaults['profiler'] + ').')
+	return profiler
+
+def Stop(profiler):
+	if profiler is None:
+		return
+	profiler.Stop()
+	if not os.path.exists(profiler.output_directory):
+		os.makedirs(profiler.output_directory)
+	file_path = profiler.Write(os.path.join(profiler.output_directory, profiler.process_name + '_' + str(os.getpid())))
+	print('Profile written to ' + file_path + '.')
+
+class ProfiledTarget():
+	# Wraps a Process target, eg 'Process(target = Profiling.ProfiledTarget(BackEnd.BackEnd, 'back_end', defaults), ...)'.
+	# Picklable as long as the target is, so it also works where processes are spawned rather than forked.
+	def __init__ (self, target, process_name, device_parameter_defaults):
+		self.target = target
+		self.process_name = process_name
+		self.device_parameter_defaults = device_parameter_defaults
+	
+	def __call__(self, *args):
+		profiler = Start(self.process_name, self.device_parameter_defaults)
+		try:
+			return self.target(*args)
+		finally:
+			Stop(profiler)
@@ -188,7 +188,7 @@ class Hold():
 		return finished_flag
 	
 	def SetTimeStep(self, new_time_step):
-		remaining_time_in_ticks = self.hold_duration_ticks = self.hold_counter
+		remaining_time_in_ticks = self.hold_duration_ticks - self.hold_counter
 		remaining_time_in_seconds = remaining_time_in_ticks * self.time_step
 		self.hold_duration_ticks = remaining_time_in_seconds / new_time_step
 		self.time_step = new_time_step
@@ -215,4 +215,4 @@ class Ramp():
 		if new_time_step <= 0.0:
 			new_time_step = 0.1
 		self.time_step = new_time_step
-		self.increment = (self.ramp_rate * self.time_step)
+		self.increment = (self.rate * self.time_step)
@@ -36,6 +36,7 @@ from PIL import Image, ImageTk
 import cv2
 
 import ArduinoComms
+import SyntheticCamera
 
 class StartUpConfig():
 	def __init__(self, device_parameter_defaults):
@@ -84,9 +85,8 @@ class StartUpConfig():
 		self.video_disabled_flag = tk.BooleanVar(self.window)
 		self.checkButton_video_disabled = tk.Checkbutton(self.video_config_frame, text = "Disable video", variable = self.video_disabled_flag, onvalue = True, offvalue = False)
 		self.checkButton_video_disabled.pack(side = "top", expand = "true", fill = tk.BOTH)
-		self.video_device_list = self.GetVideoDeviceList()
-		if self.video_device_list == []:
-			self.video_device_list = ['No cameras found']
+		# The synthetic camera (see SyntheticCamera.py) is always available, for use with the simulated hardware.
+		self.video_device_list = self.GetVideoDeviceList() + [SyntheticCamera.SYNTHETIC_CAMERA_ID]
 		
 		self.camera_id = tk.StringVar(self.window)
 		self.video_devices = tk.OptionMenu(*(self.video_config_frame, self.camera_id) + tuple(self.video_device_list)) # OptionMenu is linked to self.device_name StringVar.
@@ -94,12 +94,8 @@ class StartUpConfig():
 		self.camera_id.set(self.video_device_list[0])
 		self.camera_id.trace("w", self.VideoCallBack)
 		
-		if self.camera_id == 'No cameras found':
-			self.video_disabled_flag.set(True)
-			self.checkButton_video_disabled.configure(state = DISABLED)
-			self.video_devices.configure(state = DISABLED)
-		else:
-			self.video_disabled_flag.set(False)
+		# Default to no video if there are no cameras.
+		self.video_disabled_flag.set(self.camera_id.get() == SyntheticCamera.SYNTHETIC_CAMERA_ID)
 		
 		self.button_start = tk.Button(self.buttons_frame, text="Start", command=self.Start)
 		self.button_start.pack(side = "top", expand = "true", fill = tk.BOTH)
@@ -110,10 +106,7 @@ class StartUpConfig():
 		
 		self.action = tk.StringVar(self.window)
 		
-		if self.video_disabled_flag.get() == False:
-			self.capture_object = cv2.VideoCapture(int(self.camera_id.get()))
-			self.capture_object.set(3, 320)
-			self.capture_object.set(4, 240)
+		self.OpenCamera(self.camera_id.get())
 		self.after_id_video = self.window.after(0, self.UpdateVideoPreview)
 		
 		self.after_id_serial = self.window.after(0, self.ScanForDevices)
@@ -173,7 +166,13 @@ class StartUpConfig():
 	def VideoCallBack(self, *args):
 		camera_id = self.camera_id.get()
 		self.capture_object.release()
-		self.capture_object = cv2.VideoCapture(int(camera_id))
+		self.OpenCamera(camera_id)
+	
+	def OpenCamera(self, camera_id):
+		if camera_id == SyntheticCamera.SYNTHETIC_CAMERA_ID:
+			self.capture_object = SyntheticCamera.SyntheticCamera(self.device_parameter_defaults)
+		else:
+			self.capture_object = cv2.VideoCapture(int(camera_id))
 		self.capture_object.set(3, 320)
 		self.capture_object.set(4, 240)
 	
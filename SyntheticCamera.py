@@ -0,0 +1,157 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# A stand-in for a webcam, so that the whole video path (capture, overlay, frame writing, freeze detection) can be run,
+# tested and benchmarked on a machine without a camera, eg alongside the simulated hardware.
+#
+# It renders a grid of droplets on a cold stage, each with its own nucleation temperature drawn from a normal 
+# distribution. A droplet freezes (turns from clear and bright to opaque and darker) once the stage temperature is at 
+# or below its nucleation temperature, and melts again once the stage is back above 0 °C. The stage temperature is 
+# the latest reading in the channel's telemetry ring (see TelemetryRing.py), ie the simulated CoolerModel temperature 
+# when running against the simulated hardware, or synthetic_camera_room_temperature if there is no ring.
+#
+# SyntheticCamera has the parts of the cv2.VideoCapture interface that the video handler and start-up dialog use, and
+# delivers frames at synthetic_camera_fps as a real camera would. It is selected with the video device 
+# SYNTHETIC_CAMERA_ID in place of a camera number.
+
+import time
+import cv2
+import numpy as np
+
+from TelemetryRing import TelemetryRing
+
+SYNTHETIC_CAMERA_ID = 'synthetic'
+
+class SyntheticCamera():
+	def __init__ (self, device_parameter_defaults, telemetry_ring_name = None):
+		self.droplets = int(device_parameter_defaults['synthetic_camera_droplets'])
+		self.fps = float(device_parameter_defaults['synthetic_camera_fps'])
+		self.noise = int(device_parameter_defaults['synthetic_camera_noise'])
+		self.temperature = float(device_parameter_defaults['synthetic_camera_room_temperature'])
+		# The same droplets (and nucleation temperatures) every run, for a given seed.
+		self.random = np.random.default_rng(device_parameter_defaults['synthetic_camera_seed'])
+		self.nucleation_temperatures = self.random.normal(device_parameter_defaults['synthetic_camera_nucleation_mean'], device_parameter_defaults['synthetic_camera_nucleation_spread'],
+		                                                  self.droplets)
+		self.droplet_positions = self.random.uniform(-0.15, 0.15, (self.droplets, 2))
+		if telemetry_ring_name is not None:
+			self.telemetry_ring = TelemetryRing(name = telemetry_ring_name)
+		else:
+			self.telemetry_ring = None
+		self.width = 640
+		self.height = 480
+		self.scene_size = None
+		self.frozen = np.zeros(self.droplets, dtype = bool)
+		self.next_frame_time = time.monotonic()
+		self.frame_count = 0
+		self.opened = True
+	
+	def BuildScene(self):
+		# Everything that doesn't change from frame to frame is drawn once per frame size: the background, each droplet
+		# liquid and frozen, and a few frames of camera noise to cycle through. Each frame is then just the liquid or
+		# frozen pixels of each droplet plus noise.
+		columns = int(np.ceil(np.sqrt(self.droplets * self.width / self.height)))
+		rows = int(np.ceil(self.droplets / columns))
+		pitch = min(self.width / (columns + 1), self.height / (rows + 1))
+		radius = max(2, int(pitch * 0.3))
+		y, x = np.mgrid[0:self.height, 0:self.width]
+		vignette = 1.0 - (0.3 * (((x - (self.width / 2)) / self.width) ** 2 + ((y - (self.height / 2)) / self.height) ** 2))
+		background = (60 * vignette).astype(np.uint8)
+		self.liquid_frame = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+		frozen_frame = self.liquid_frame.copy()
+		labels = np.zeros((self.height, self.width), dtype = np.int32)
+		for droplet in range(self.droplets):
+			row, column = divmod(droplet, columns)
+			centre = (int(((column + 1) + self.droplet_positions[droplet][0]) * pitch), int(((row + 1) + self.droplet_positions[droplet][1]) * pitch))
+			cv2.circle(self.liquid_frame, centre, radius, (215, 210, 205), -1, cv2.LINE_AA)
+			cv2.circle(self.liquid_frame, (centre[0] - (radius // 3), centre[1] - (radius // 3)), max(1, radius // 4), (250, 250, 250), -1, cv2.LINE_AA)
+			cv2.circle(frozen_frame, centre, radius, (135, 135, 140), -1, cv2.LINE_AA)
+			cv2.circle(labels, centre, radius + 1, droplet + 1, -1)
+		# Ice is grainy.
+		frozen_frame = cv2.add(frozen_frame, self.random.integers(0, 25, frozen_frame.shape, dtype = np.uint8))
+		self.droplet_pixels = [np.flatnonzero(labels == droplet + 1) for droplet in range(self.droplets)]
+		self.frozen_frame_pixels = frozen_frame.reshape(-1, 3)
+		self.liquid_frame_pixels = self.liquid_frame.reshape(-1, 3)
+		self.scene = self.liquid_frame.copy()
+		self.frozen[:] = False
+		self.noise_frames = [(self.random.integers(0, self.noise + 1, self.scene.shape, dtype = np.uint8), self.random.integers(0, self.noise + 1, self.scene.shape, dtype = np.uint8))
+		                     for i in range(8)]
+		self.scene_size = (self.width, self.height)
+	
+	def UpdateTemperature(self):
+		if self.telemetry_ring is not None:
+			records = self.telemetry_ring.ReadNew()
+			if len(records) > 0:
+				self.temperature = float(records['temperature'][-1])
+	
+	def read(self):
+		if self.opened == False:
+			return False, None
+		# Wait for the next frame, as a camera would.
+		self.next_frame_time = max(self.next_frame_time + (1.0 / self.fps), time.monotonic())
+		time.sleep(max(0.0, self.next_frame_time - time.monotonic()))
+		if self.scene_size != (self.width, self.height):
+			self.BuildScene()
+		self.UpdateTemperature()
+		frozen = np.where(self.temperature > 0.0, False, self.frozen | (self.temperature <= self.nucleation_temperatures))
+		scene_pixels = self.scene.reshape(-1, 3)
+		for droplet in np.flatnonzero(frozen != self.frozen):
+			source_pixels = self.frozen_frame_pixels if frozen[droplet] == True else self.liquid_frame_pixels
+			scene_pixels[self.droplet_pixels[droplet]] = source_pixels[self.droplet_pixels[droplet]]
+		self.frozen = frozen
+		noise_up, noise_down = self.noise_frames[self.frame_count % len(self.noise_frames)]
+		self.frame_count += 1
+		return True, cv2.subtract(cv2.add(self.scene, noise_up), noise_down)
+	
+	def set(self, property_id, value):
+		if property_id == cv2.CAP_PROP_FRAME_WIDTH:
+			self.width = int(value)
+		elif property_id == cv2.CAP_PROP_FRAME_HEIGHT:
+			self.height = int(value)
+		elif property_id == cv2.CAP_PROP_FPS:
+			self.fps = float(value)
+		else:
+			# Autofocus, buffer size etc make no difference.
+			return False
+		return True
+	
+	def get(self, property_id):
+		if property_id == cv2.CAP_PROP_FRAME_WIDTH:
+			return float(self.width)
+		elif property_id == cv2.CAP_PROP_FRAME_HEIGHT:
+			return float(self.height)
+		elif property_id == cv2.CAP_PROP_FPS:
+			return self.fps
+		return 0.0
+	
+	def isOpened(self):
+		return self.opened
+	
+	def release(self):
+		self.opened = False
+		if self.telemetry_ring is not None:
+			self.telemetry_ring.Close()
+			self.telemetry_ring = None
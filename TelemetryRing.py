@@ -0,0 +1,115 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# One fixed-size record per channel per time-step. Values that don't apply (ie, the setpoint or throttle when idle) are NaN.
+TELEMETRY_RECORD = np.dtype([('timestamp', np.float64), ('temperature', np.float64), ('prt_temperature', np.float64), ('flow_rate', np.float64), 
+							('setpoint', np.float64), ('throttle', np.float64)])
+
+class TelemetryRing():
+	def __init__ (self, name = None, capacity = 4096, create = False):
+		# A lock-free single-producer ring buffer of telemetry records in shared memory. The block starts with a header of
+		# two uint64s (the total number of records ever written, and the capacity) followed by the records themselves.
+		# 
+		# The producer (the back end cooler channel) writes a record into the next slot and only then increments the write 
+		# count, so a reader never sees a partially written record unless it has fallen a whole ring behind, which is 
+		# detected and counted. Readers never write to the block, so each reader keeps its own read position and any 
+		# number of them can follow the same ring.
+		self.header_size = 16
+		if create == True:
+			self.shared_memory = shared_memory.SharedMemory(name = name, create = True, size = self.header_size + (capacity * TELEMETRY_RECORD.itemsize))
+		else:
+			self.shared_memory = AttachSharedMemory(name)
+		self.name = self.shared_memory.name
+		self.header = np.ndarray((2,), dtype = np.uint64, buffer = self.shared_memory.buf, offset = 0)
+		if create == True:
+			self.header[0] = 0
+			self.header[1] = capacity
+		self.capacity = int(self.header[1])
+		self.records = np.ndarray((self.capacity,), dtype = TELEMETRY_RECORD, buffer = self.shared_memory.buf, offset = self.header_size)
+		# Readers start from the current write position, ie they only see records written after they attach.
+		self.read_count = int(self.header[0])
+		self.dropped_records = 0
+	
+	def Write(self, timestamp, temperature, prt_temperature, flow_rate, setpoint, throttle):
+		write_count = int(self.header[0])
+		self.records[write_count % self.capacity] = (timestamp, temperature, prt_temperature, flow_rate, setpoint, throttle)
+		# Publish the record.
+		self.header[0] = write_count + 1
+	
+	def ReadNew(self):
+		# Return all records written since the last call as a single structured NumPy array (oldest first).
+		write_count = int(self.header[0])
+		new_records = write_count - self.read_count
+		if new_records <= 0:
+			return np.empty((0,), dtype = TELEMETRY_RECORD)
+		if new_records > self.capacity:
+			# We have been lapped by the producer, skip ahead to the oldest record still in the ring.
+			self.dropped_records += new_records - self.capacity
+			self.read_count = write_count - self.capacity
+			new_records = self.capacity
+		start = self.read_count % self.capacity
+		end = start + new_records
+		if end <= self.capacity:
+			records = self.records[start:end].copy()
+		else:
+			records = np.concatenate((self.records[start:], self.records[:end - self.capacity]))
+		# If the producer wrapped around onto the slots we were copying while we copied them, drop those records. Write()
+		# fills a slot before publishing it, so the slot after the last published record may be half written too.
+		overwritten_records = int(self.header[0]) - self.capacity - self.read_count + 1
+		if overwritten_records > 0:
+			self.dropped_records += overwritten_records
+			records = records[overwritten_records:]
+		self.read_count = write_count
+		return records
+	
+	def Close(self):
+		# Release our views of the block before closing it, or the buffer can't be released.
+		self.header = None
+		self.records = None
+		self.shared_memory.close()
+	
+	def Unlink(self):
+		# Only the process that created the ring should call this, once all other processes are finished with it.
+		self.shared_memory.unlink()
+
+def AttachSharedMemory(name):
+	# Attach to an existing shared memory block by name. Before Python 3.13, attaching to a block also registers it with
+	# the resource tracker, which will unlink it (and complain about a 'leak') when the attaching process exits, even 
+	# though the creating process still owns it. So we stop the registration happening, leaving only the creator to unlink.
+	try:
+		return shared_memory.SharedMemory(name = name, track = False)
+	except TypeError:
+		register = resource_tracker.register
+		resource_tracker.register = lambda name, rtype: None
+		try:
+			attached_shared_memory = shared_memory.SharedMemory(name = name)
+		finally:
+			resource_tracker.register = register
+		return attached_shared_memory
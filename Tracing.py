@@ -0,0 +1,154 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+
+# Lightweight tracing of named spans (eg, a back end tick, a channel select, a frame write) across all of the processes.
+#
+# Each process has one Tracer, set up with InitialiseTracer() at the start of the process and fetched anywhere else in 
+# that process with GetTracer(). Spans are recorded as (name, start_ns, duration_ns, tid, args) tuples into a bounded 
+# in-memory buffer, which only costs a clock read and a deque append per span, so tracing can be left on. The tid is
+# used to put each channel (or thread) on its own row in the trace viewer.
+#
+# Times come from time.perf_counter_ns(), which is a system-wide monotonic clock on Linux, Windows and macOS, so spans
+# from different processes line up on the same timeline.
+#
+# Each process writes its buffer out as Chrome trace-event JSON when it finishes (see Export()), which can be opened 
+# in chrome://tracing or https://ui.perfetto.dev. To combine the files from one run into a single trace:
+#
+#	python3 Tracing.py ./traces/ ./traces/merged_trace.json
+
+import os
+import sys
+import json
+import glob
+import collections
+import time
+
+class Tracer():
+	def __init__ (self, process_name, enabled = True, capacity = 50000):
+		self.process_name = process_name
+		self.pid = os.getpid()
+		self.enabled = enabled
+		# The oldest spans are discarded once the buffer is full, so the buffer always holds the most recent activity.
+		self.spans = collections.deque(maxlen = capacity)
+		self.thread_names = {}
+		# Completed spans can also be forwarded, per tid, to a queue (ie, to a channel's timing monitor).
+		self.forward_queues = {}
+	
+	def Now(self):
+		return time.perf_counter_ns()
+	
+	def Record(self, name, start_ns, end_ns = None, tid = 0, args = None):
+		# Record a span that started at start_ns (from Now()) and ends now, or at end_ns if given.
+		if self.enabled == False:
+			return
+		if end_ns is None:
+			end_ns = time.perf_counter_ns()
+		span = (name, start_ns, end_ns - start_ns, tid, args)
+		self.spans.append(span)
+		if tid in self.forward_queues:
+			self.forward_queues[tid].put(span)
+	
+	def Span(self, name, tid = 0, args = None):
+		# For use as a context manager, eg 'with tracer.Span('frame_write', channel_id):'.
+		return TraceSpan(self, name, tid, args)
+	
+	def SetThreadName(self, tid, name):
+		self.thread_names[tid] = name
+	
+	def SetForwardQueue(self, tid, forward_queue):
+		self.forward_queues[tid] = forward_queue
+	
+	def Events(self):
+		events = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': self.process_name}}]
+		for tid, name in self.thread_names.items():
+			events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+		for name, start_ns, duration_ns, tid, args in list(self.spans):
+			event = {'name': name, 'cat': self.process_name, 'ph': 'X', 'ts': start_ns / 1000.0, 'dur': duration_ns / 1000.0, 'pid': self.pid, 'tid': tid}
+			if args is not None:
+				event['args'] = args
+			events.append(event)
+		return events
+	
+	def Export(self, directory):
+		# Write the buffer to <directory>/<process name>_<pid>.json and return the path written.
+		if ((self.enabled == False) or (len(self.spans) == 0)):
+			return None
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		file_path = os.path.join(directory, self.process_name.replace(' ', '_') + '_' + str(self.pid) + '.json')
+		with open(file_path, 'w') as trace_file:
+			json.dump({'traceEvents': self.Events(), 'displayTimeUnit': 'ms'}, trace_file)
+		print('Trace written to ' + file_path + ' (' + str(len(self.spans)) + ' spans).')
+		return file_path
+
+class TraceSpan():
+	def __init__ (self, tracer, name, tid, args):
+		self.tracer = tracer
+		self.name = name
+		self.tid = tid
+		self.args = args
+	
+	def __enter__(self):
+		self.start_ns = time.perf_counter_ns()
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.tracer.Record(self.name, self.start_ns, tid = self.tid, args = self.args)
+		return False
+
+# The tracer for this process. Disabled until InitialiseTracer() is called, so GetTracer() is always safe to use.
+_tracer = Tracer('untraced', enabled = False, capacity = 1)
+
+def InitialiseTracer(process_name, device_parameter_defaults):
+	global _tracer
+	_tracer = Tracer(process_name, bool(device_parameter_defaults['trace_enabled']), device_parameter_defaults['trace_buffer_spans'])
+	return _tracer
+
+def GetTracer():
+	return _tracer
+
+def ExportTracer(device_parameter_defaults):
+	return _tracer.Export(device_parameter_defaults['trace_output_directory'])
+
+def MergeTraces(directory, output_path):
+	# Combine the per-process trace files in a directory into one file.
+	events = []
+	for file_path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+		if os.path.abspath(file_path) == os.path.abspath(output_path):
+			continue
+		with open(file_path, 'r') as trace_file:
+			events.extend(json.load(trace_file)['traceEvents'])
+	with open(output_path, 'w') as trace_file:
+		json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+	print(str(len(events)) + ' trace events written to ' + output_path)
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print('Usage: python3 Tracing.py <trace directory> <merged trace file>')
+	else:
+		MergeTraces(sys.argv[1], sys.argv[2])
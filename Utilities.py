@@ -29,6 +29,8 @@ import math
 import numpy as np
 import csv
 import time
+import os
+import queue
 from multiprocessing import Event
 
 def QuantizeReading(reading, fraction_resolution_denominator):
@@ -56,17 +58,113 @@ def PolynomialCorrection(measured_value, coefficients):
 			corrected_value += value
 	return corrected_value
 
-class DriftFreeTimer():
-	def __init__ (self, signal_thread_event, kill_thread_event, interval_msecs):
-		# Drift compensating timer.
-		next_call = time.time()
-		while kill_thread_event.wait(0.01):
-			next_call = next_call + interval_msecs
-			sleep_duration = next_call - time.time()
-			if sleep_duration < 0.0:
-				sleep_duration = 0.0
-			time.sleep(sleep_duration)
-			signal_thread_event.set()
+class TickScheduler():
+	def __init__ (self, interval_seconds, num_channels, overrun_policy = 'skip', spin_seconds = 0.0):
+		# Drift-free tick scheduler, run inline in the back end event loop.
+		#
+		# Each tick has an absolute deadline on the monotonic clock, and the next deadline is always worked out from the 
+		# last one rather than from when we happened to wake up, so small delays never accumulate into drift. We sleep 
+		# until spin_seconds before the deadline and then spin for the remainder, which trades a little CPU for a much
+		# tighter wake-up on platforms with coarse sleep resolution.
+		#
+		# If servicing the channels runs past the next deadline the tick has overrun, and overrun_policy decides what 
+		# happens next:
+		#	'skip'		- drop the ticks we missed and carry on from the next deadline still in the future (stays in phase).
+		#	'catch_up'	- run the missed ticks back-to-back until we are back on schedule (no ticks lost).
+		#	'stretch'	- start the next tick one interval from now (the schedule shifts by the overrun).
+		if overrun_policy not in ['skip', 'catch_up', 'stretch']:
+			raise ValueError('Unknown tick overrun policy: ' + str(overrun_policy))
+		self.interval_seconds = float(interval_seconds)
+		self.num_channels = num_channels
+		self.overrun_policy = overrun_policy
+		self.spin_seconds = spin_seconds
+		self.next_deadline = None
+		self.tick_deadline = None
+		self.ResetStatistics()
+	
+	def ResetStatistics(self):
+		self.statistics_start = time.monotonic()
+		self.ticks = 0
+		self.overruns = 0
+		self.skipped_ticks = 0
+		self.lateness = RunningStatistics()
+		self.tick_duration = RunningStatistics()
+		self.channel_lateness = [RunningStatistics() for i in range(self.num_channels)]
+		self.channel_service_duration = [RunningStatistics() for i in range(self.num_channels)]
+	
+	def SetInterval(self, interval_seconds):
+		# Takes effect from the next tick.
+		self.interval_seconds = float(interval_seconds)
+		if self.tick_deadline is not None:
+			self.next_deadline = self.tick_deadline + self.interval_seconds
+	
+	def WaitForTick(self):
+		# Block until the start of the next tick and return how late we woke up (in seconds).
+		if self.next_deadline is None:
+			self.next_deadline = time.monotonic()
+		remaining = self.next_deadline - time.monotonic()
+		if remaining > self.spin_seconds:
+			time.sleep(remaining - self.spin_seconds)
+		while time.monotonic() < self.next_deadline:
+			pass
+		self.tick_deadline = self.next_deadline
+		lateness = time.monotonic() - self.tick_deadline
+		self.lateness.Add(lateness)
+		self.ticks += 1
+		return lateness
+	
+	def ChannelServiced(self, channel_index, service_start, service_end):
+		# Record when (relative to the tick deadline) a channel started being serviced, and how long it took.
+		self.channel_lateness[channel_index].Add(service_start - self.tick_deadline)
+		self.channel_service_duration[channel_index].Add(service_end - service_start)
+	
+	def EndTick(self):
+		# Work out the next deadline, applying the overrun policy if this tick ran past it.
+		now = time.monotonic()
+		self.tick_duration.Add(now - self.tick_deadline)
+		self.next_deadline = self.tick_deadline + self.interval_seconds
+		if now > self.next_deadline:
+			self.overruns += 1
+			if self.overrun_policy == 'skip':
+				missed_ticks = int((now - self.next_deadline) // self.interval_seconds) + 1
+				self.skipped_ticks += missed_ticks
+				self.next_deadline += missed_ticks * self.interval_seconds
+			elif self.overrun_policy == 'stretch':
+				self.next_deadline = now + self.interval_seconds
+	
+	def Report(self):
+		# One line for the scheduler as a whole and one per channel, times in milliseconds.
+		elapsed = time.monotonic() - self.statistics_start
+		lines = ['Tick scheduler: interval ' + str(round(self.interval_seconds * 1000.0, 1)) + ' ms, ' + str(self.ticks) + ' ticks in ' + str(round(elapsed, 1)) + 
+		         ' s, ' + str(self.overruns) + ' overruns (' + self.overrun_policy + ', ' + str(self.skipped_ticks) + ' ticks skipped), wake-up lateness ' + 
+		         self.lateness.Summary(1000.0) + ', tick duration ' + self.tick_duration.Summary(1000.0) + '.']
+		for i in range(self.num_channels):
+			lines.append('    Channel ' + str(i) + ': ' + str(self.channel_service_duration[i].count) + ' services, start lateness ' + self.channel_lateness[i].Summary(1000.0) + ', service duration ' + self.channel_service_duration[i].Summary(1000.0) + '.')
+		return '\n'.join(lines)
+
+class RunningStatistics():
+	def __init__ (self):
+		# Count, mean, standard deviation and maximum without keeping the samples (Welford's method).
+		self.count = 0
+		self.mean = 0.0
+		self.sum_squares = 0.0
+		self.maximum = 0.0
+	
+	def Add(self, value):
+		self.count += 1
+		delta = value - self.mean
+		self.mean += delta / self.count
+		self.sum_squares += delta * (value - self.mean)
+		if ((self.count == 1) or (value > self.maximum)):
+			self.maximum = value
+	
+	def StandardDeviation(self):
+		if self.count < 2:
+			return 0.0
+		return math.sqrt(self.sum_squares / (self.count - 1))
+	
+	def Summary(self, scale = 1.0):
+		return 'mean ' + '{:0.3f}'.format(self.mean * scale) + ' sd ' + '{:0.3f}'.format(self.StandardDeviation() * scale) + ' max ' + '{:0.3f}'.format(self.maximum * scale)
 
 
 class PIDController():
@@ -82,6 +180,10 @@ class PIDController():
 		self.D = pid_coeffs['D']
 		self.power_multiplier = pid_coeffs['power_multiplier']
 	
+	def SetTimeStep(self, time_step):
+		# The integral term is already accumulated in error-seconds, so only future updates are affected.
+		self.time_step = float(time_step)
+	
 	def Initialise(self, current_temp, setpoint):
 		self.current_temp = current_temp
 		self.setpoint = setpoint
@@ -281,35 +383,111 @@ class KalmanFilter():
 		self.x0 = self.x2
 		self.p0 = self.p2
 
+class LatencyHistogram():
+	def __init__ (self, bins_per_decade = 20, min_seconds = 1e-6, max_seconds = 100.0):
+		# Streaming latency histogram with logarithmically spaced bins, so percentiles can be estimated to within one bin
+		# width (about 12% at 20 bins per decade) without keeping the samples. Values outside the range are clamped into
+		# the first or last bin, the exact maximum is kept separately.
+		self.bins_per_decade = bins_per_decade
+		self.min_seconds = min_seconds
+		self.num_bins = int(math.ceil(math.log10(max_seconds / min_seconds) * self.bins_per_decade)) + 1
+		self.counts = [0 for i in range(self.num_bins)]
+		self.statistics = RunningStatistics()
+	
+	def Add(self, value_seconds):
+		if value_seconds <= self.min_seconds:
+			bin_index = 0
+		else:
+			bin_index = min(int(math.log10(value_seconds / self.min_seconds) * self.bins_per_decade), self.num_bins - 1)
+		self.counts[bin_index] += 1
+		self.statistics.Add(value_seconds)
+	
+	def Percentile(self, percentile):
+		# Returns the upper edge of the bin holding the requested percentile, capped at the observed maximum.
+		if self.statistics.count == 0:
+			return 0.0
+		target = math.ceil(self.statistics.count * percentile / 100.0)
+		running_count = 0
+		for bin_index in range(self.num_bins):
+			running_count += self.counts[bin_index]
+			if running_count >= target:
+				return min(self.min_seconds * (10.0 ** ((bin_index + 1) / self.bins_per_decade)), self.statistics.maximum)
+		return self.statistics.maximum
+
 class TimingMonitor():
-	def __init__(self, channel_id, mq_timestamp, event_kill):
+	def __init__(self, channel_id, mq_timestamp, event_kill, device_parameter_defaults = None):
 		self.mq_timestamp = mq_timestamp
 		self.event_kill = event_kill
 		self.channel_id = channel_id
-		self.current_timestamps = []
+		if device_parameter_defaults is None:
+			device_parameter_defaults = {}
+		self.report_seconds = float(device_parameter_defaults.get('timing_monitor_report_seconds', 10.0))
+		output_directory = device_parameter_defaults.get('trace_output_directory', './traces/')
+		self.csv_path = os.path.join(output_directory, 'timing_channel_' + str(self.channel_id) + '.csv')
+		self.histograms = {}
 		
+		# Receives the trace spans (name, start_ns, duration_ns, tid, args) forwarded by this channel's back end and video
+		# handler (see Tracing.py) and aggregates the durations into one histogram per span name. Every report_seconds a
+		# summary of the interval is printed and appended to the CSV file, and the histograms are started afresh.
+		# Blocking on the queue with a timeout means we are idle between spans rather than spinning.
 		print("Timing monitor ready.")
-		while True:
-			if not self.event_kill.is_set():
-				break
+		last_report_timestamp = time.monotonic()
+		while self.event_kill.is_set():
 			try:
-				most_recent_timestamp = self.mq_timestamp.get(False, timeout = None)
-				if most_recent_timestamp[0] == 0:
-					self.normalised_timestamps = [[j[0], round(j[1] - self.current_timestamps[0][1], 4)] for i, j in enumerate(self.current_timestamps)]
-					print('Channel ' + str(self.channel_id) + ': ', self.normalised_timestamps)
-					self.current_timestamps = []
-				else:
-					self.current_timestamps.append(most_recent_timestamp)
-			except:
+				span = self.mq_timestamp.get(timeout = 0.5)
+				self.AddSpan(span)
+			except queue.Empty:
 				pass
+			if (time.monotonic() - last_report_timestamp) >= self.report_seconds:
+				self.Report()
+				last_report_timestamp = time.monotonic()
 		# Flush timestamp message queue in readiness for shutdown. If we end this process with items still on the input
 		# queue, attempts to join this process will block indefinitely.
-		while self.mq_timestamp.qsize() > 0:
+		while True:
 			try:
-				most_recent_timestamp = self.mq_timestamp.get(False, None)
-			except:
-				pass
+				self.AddSpan(self.mq_timestamp.get(timeout = 0.1))
+			except queue.Empty:
+				break
+		self.Report()
 		print("Timing monitor shut down.")
+	
+	def AddSpan(self, span):
+		name = span[0]
+		if name not in self.histograms:
+			self.histograms[name] = LatencyHistogram()
+		self.histograms[name].Add(span[2] / 1e9)
+	
+	def Report(self):
+		if len(self.histograms) == 0:
+			return
+		report_time = time.strftime("%Y/%m/%d %H:%M:%S")
+		rows = []
+		for name in sorted(self.histograms.keys()):
+			histogram = self.histograms[name]
+			rows.append([name, str(histogram.statistics.count)] + ['{:0.3f}'.format(value * 1e3) for value in [histogram.statistics.mean, histogram.Percentile(50), histogram.Percentile(95), histogram.Percentile(99), histogram.statistics.maximum]])
+		name_width = max([len(row[0]) for row in rows] + [4])
+		print('Channel ' + str(self.channel_id) + ' span latency (ms) at ' + report_time + ':')
+		print('  ' + 'Span'.ljust(name_width) + ''.join([heading.rjust(10) for heading in ['Count', 'Mean', 'p50', 'p95', 'p99', 'Max']]))
+		for row in rows:
+			print('  ' + row[0].ljust(name_width) + ''.join([value.rjust(10) for value in row[1:]]))
+		try:
+			os.makedirs(os.path.dirname(self.csv_path) or '.', exist_ok = True)
+			write_header = not os.path.isfile(self.csv_path)
+			with open(self.csv_path, 'a') as csv_file:
+				if write_header == True:
+					csv_file.write('Time, Span, Count, Mean (ms), p50 (ms), p95 (ms), p99 (ms), Max (ms)\n')
+				for row in rows:
+					csv_file.write(report_time + ', ' + ', '.join(row) + '\n')
+		except OSError as error:
+			print('Timing monitor could not write ' + self.csv_path + ': ' + str(error))
+		self.histograms = {}
+
+def QueueDepth(message_queue):
+	# Queue.qsize() is not implemented on macOS.
+	try:
+		return message_queue.qsize()
+	except NotImplementedError:
+		return None
 
 def TruncateFloat(number, digits) -> float:
 	stepper = 10.0 ** digits
@@ -0,0 +1,160 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# Logged frames written to video container files with cv2.VideoWriter, rather than one image file per frame, so that a
+# session is a handful of files that are quick to list and copy.
+#
+# Each video path (see CoolerChannel.SwitchVideoLogPath()) gets its own numbered containers, video_000.avi etc, and a
+# sidecar index, INDEX_FILE_NAME, with a row per logged frame giving its frame number, the container and position in the
+# container it was written to, when it was read from the camera and the temperature and setpoint it was logged against.
+# A new container is started whenever the frame size changes (as every frame in a container must be the same size), or
+# logging is restarted. VideoContainerReader uses the index to extract any logged frame by its frame number.
+#
+# With the 'MJPG' codec frames are JPEG compressed at the frame writer quality, like the per-frame files. A lossless
+# codec such as 'FFV1' (eg in a '.mkv' container) keeps the frames exactly as captured, at the cost of larger files.
+
+import os
+import sys
+import csv
+import cv2
+
+INDEX_FILE_NAME = 'video_index.csv'
+
+class VideoContainerWriter():
+	def __init__ (self, fourcc = 'MJPG', extension = '.avi', fps = 10.0):
+		# fps only sets the playback rate in a video player, frames are written at whatever rate they are logged.
+		self.fourcc = fourcc
+		self.extension = extension
+		self.fps = float(fps)
+		self.video_writer = None
+		self.index_file = None
+		self.directory = None
+		self.frame_size = None
+		self.container_name = None
+		self.container_frames = 0
+	
+	def Write(self, directory, frame, frame_params, timestamp, quality = None):
+		# Append a BGR frame, logged with frame_params (a Messages.CaptureFrame) and read from the camera at timestamp, to
+		# the open container in directory, starting a new container if needed. Returns False if it couldn't be written.
+		frame_size = (frame.shape[1], frame.shape[0])
+		if ((self.video_writer is None) or (directory != self.directory) or (frame_size != self.frame_size)):
+			if self.Open(directory, frame_size) == False:
+				return False
+		if ((quality is not None) and (self.fourcc == 'MJPG')):
+			self.video_writer.set(cv2.VIDEOWRITER_PROP_QUALITY, quality)
+		self.video_writer.write(frame)
+		self.index_file.write(frame_params.index + ', ' + self.container_name + ', ' + str(self.container_frames) + ', ' + str(round(timestamp, 4)) + ', ' + 
+		                      frame_params.temp + ', ' + frame_params.setpoint + '\n')
+		self.container_frames += 1
+		return True
+	
+	def Open(self, directory, frame_size):
+		self.Close()
+		# Never overwrite an existing container, eg if logging to this path is stopped and restarted.
+		container_number = 0
+		while os.path.exists(os.path.join(directory, 'video_' + str(container_number).zfill(3) + self.extension)):
+			container_number += 1
+		self.container_name = 'video_' + str(container_number).zfill(3) + self.extension
+		# OpenCV's own MJPEG encoder lets us set the JPEG quality of each frame, FFmpeg's doesn't.
+		if self.fourcc == 'MJPG':
+			api_preference = cv2.CAP_OPENCV_MJPEG
+		else:
+			api_preference = cv2.CAP_ANY
+		video_writer = cv2.VideoWriter(os.path.join(directory, self.container_name), api_preference, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, frame_size)
+		if video_writer.isOpened() == False:
+			print('Could not open video container ' + os.path.join(directory, self.container_name) + ' (codec ' + self.fourcc + ')!')
+			return False
+		self.video_writer = video_writer
+		self.directory = directory
+		self.frame_size = frame_size
+		self.container_frames = 0
+		index_path = os.path.join(directory, INDEX_FILE_NAME)
+		write_header = not os.path.exists(index_path)
+		self.index_file = open(index_path, 'a', buffering = 1, encoding = 'utf-8')
+		if write_header == True:
+			self.index_file.write('Frame Number, Container File, Container Frame, Frame Timestamp (secs), Temperature (°C), Setpoint (°C)\n')
+		return True
+	
+	def Close(self):
+		# The container isn't playable until it has been closed.
+		if self.video_writer is not None:
+			self.video_writer.release()
+			self.video_writer = None
+		if self.index_file is not None:
+			self.index_file.close()
+			self.index_file = None
+		self.directory = None
+
+class VideoContainerReader():
+	def __init__ (self, directory):
+		# Frames logged to directory, by frame number, from its video index.
+		self.directory = directory
+		# Frame number -> (container file, container frame, frame timestamp, temperature, setpoint).
+		self.index = {}
+		with open(os.path.join(directory, INDEX_FILE_NAME), 'r', encoding = 'utf-8') as index_file:
+			reader = csv.reader(index_file, skipinitialspace = True)
+			next(reader)
+			for row in reader:
+				if len(row) == 6:
+					self.index[int(row[0])] = (row[1], int(row[2]), float(row[3]), row[4], row[5])
+		self.capture_object = None
+		self.container_name = None
+		self.next_container_frame = None
+	
+	def FrameNumbers(self):
+		return sorted(self.index.keys())
+	
+	def Frame(self, frame_number):
+		# Return logged frame frame_number as a BGR array. Reading frames in order avoids seeking.
+		container_name, container_frame = self.index[frame_number][:2]
+		if container_name != self.container_name:
+			self.Close()
+			self.capture_object = cv2.VideoCapture(os.path.join(self.directory, container_name))
+			self.container_name = container_name
+			self.next_container_frame = 0
+		if container_frame != self.next_container_frame:
+			self.capture_object.set(cv2.CAP_PROP_POS_FRAMES, container_frame)
+		success, frame = self.capture_object.read()
+		if success == False:
+			self.next_container_frame = None
+			raise IOError('Could not read frame ' + str(frame_number) + ' from ' + os.path.join(self.directory, container_name))
+		self.next_container_frame = container_frame + 1
+		return frame
+	
+	def Close(self):
+		if self.capture_object is not None:
+			self.capture_object.release()
+			self.capture_object = None
+		self.container_name = None
+
+if __name__ == '__main__':
+	if len(sys.argv) != 4:
+		print('Usage: python3 VideoContainer.py <video directory> <frame number> <output image file>')
+	else:
+		reader = VideoContainerReader(sys.argv[1])
+		cv2.imwrite(sys.argv[3], reader.Frame(int(sys.argv[2])))
+		reader.Close()
@@ -29,40 +29,174 @@ import numpy as np
 import time
 import cv2
 import os
+import queue
 import threading as Thread
-from PIL import Image, ImageFont, ImageDraw
+import collections
+from PIL import Image
+
+import Messages
+import Overlay
+import FrameBuffer
+import VideoContainer
+import FreezeDetection
+import SyntheticCamera
+import Tracing
+import Metrics
+
+# Written to each video path alongside the frames, one row per logged frame, giving the offset between when the frame
+# was read from the camera and when the temperature reading it is logged against was taken, and the number of the frame
+# actually stored for it (itself, unless it was skipped as unchanged, see FrameChangeTrigger).
+FRAME_LOG_FILE_NAME = 'frame_log.csv'
 
 class VideoHandler():
-	def __init__ (self, channel_id, simulation_flag, device_parameter_defaults, mq_back_to_vlogger, mq_vlogger_to_front, mq_timestamp, event_vlogger_fault, timing_flag, video_device_number):
+	def __init__ (self, channel_id, simulation_flag, device_parameter_defaults, mq_back_to_vlogger, mq_vlogger_to_front, mq_timestamp, event_vlogger_fault, timing_flag, video_device_number, frame_buffer_name = None, telemetry_ring_name = None):
 		
 		self.channel_id = channel_id
 		self.mq_back_to_vlogger = mq_back_to_vlogger
 		self.mq_vlogger_to_front = mq_vlogger_to_front
 		self.mq_timestamp = mq_timestamp
 		self.event_vlogger_fault = event_vlogger_fault
+		# Frames for the front end go through a shared memory frame buffer if there is one, otherwise on the queue.
+		if frame_buffer_name is not None:
+			self.frame_buffer = FrameBuffer.FrameBuffer(frame_buffer_name)
+		else:
+			self.frame_buffer = None
 		
 		self.video_device_number = video_device_number
+		# The synthetic camera (see SyntheticCamera.py) takes the stage temperature from the channel's telemetry ring.
+		self.telemetry_ring_name = telemetry_ring_name
+		self.device_parameter_defaults = device_parameter_defaults
 		self.timing_flag = timing_flag
 		self.simulation_flag = simulation_flag
-		self.shut_down = False
+		self.shut_down_event = Thread.Event()
 		self.video_fault_flag = False
 		self.logging = False
 		self.output_path = ''
 		
 		self.image_x_dimension, self.image_y_dimension = [int(i) for i in device_parameter_defaults['webcam_default_dimensions'][self.channel_id].split('x')]
 		self.image_file_format = device_parameter_defaults['webcam_image_file_format']
+		self.capture_rate = float(device_parameter_defaults['video_capture_rate'])
+		# The capture thread appends each (frame, time.time() timestamp, tracer timestamp) to this ring of recent frames,
+		# under the frame condition, so that a capture command can be served with the frame read closest to the time of
+		# the temperature reading it will be logged against. The capture lock is held whenever the camera is being used,
+		# as VideoCapture isn't thread safe.
+		self.frame_ring = collections.deque(maxlen = max(1, int(device_parameter_defaults['video_frame_ring_length'])))
+		self.frame_condition = Thread.Condition()
+		# The longest a capture command waits for a frame newer than its reading (one capture interval).
+		if self.capture_rate > 0.0:
+			self.frame_wait_seconds = 1.0 / self.capture_rate
+		else:
+			self.frame_wait_seconds = 0.1
+		# Frame number, reading and frame timestamps for each logged frame go to FRAME_LOG_FILE_NAME in the video path.
+		self.frame_log_file = None
+		# Optionally, only frames that differ from the last one stored (or are due as keyframes) are stored.
+		if device_parameter_defaults['frame_change_trigger_enabled'] == True:
+			self.frame_change_trigger = FrameChangeTrigger(device_parameter_defaults['frame_change_threshold'], device_parameter_defaults['frame_change_downsample'],
+			                                               device_parameter_defaults['frame_keyframe_interval'])
+		else:
+			self.frame_change_trigger = None
+		self.stored_frame_index = None
+		# Freeze detection runs on the frames of a log if the back end asks for it before the log starts.
+		self.freeze_detector = FreezeDetection.FreezeDetector(device_parameter_defaults['freeze_detection_threshold'], device_parameter_defaults['freeze_detection_min_droplet_area'],
+		                                                      device_parameter_defaults['freeze_detection_max_droplet_area'], device_parameter_defaults['freeze_detection_reference_frames'])
+		self.freeze_detection_stage = None
+		
+		self.capture_lock = Thread.Lock()
+		# Both threads publish frames to the front end.
+		self.publish_lock = Thread.Lock()
 		
-		self.text_font = ImageFont.truetype("./DejaVuSansMono.ttf", 12)
+		# Text is drawn in blue straight onto the frames as they come from OpenCV, ie in BGR order.
+		self.overlay = Overlay.OverlayRenderer("./DejaVuSansMono.ttf", 12, colour = (255, 0, 0))
+		
+		# Spans for this channel go on one row of the trace (tid = channel id), and frame writes on another. If timing
+		# info is on they are also forwarded to the channel's timing monitor.
+		self.tracer = Tracing.InitialiseTracer('Video handler ' + str(self.channel_id), device_parameter_defaults)
+		self.tracer.SetThreadName(self.channel_id, 'Channel ' + str(self.channel_id))
+		self.tracer.SetThreadName(100 + self.channel_id, 'Channel ' + str(self.channel_id) + ' frame writer')
+		self.tracer.SetThreadName(200 + self.channel_id, 'Channel ' + str(self.channel_id) + ' capture')
+		if self.timing_flag == True:
+			self.tracer.SetForwardQueue(self.channel_id, self.mq_timestamp)
+			self.tracer.SetForwardQueue(100 + self.channel_id, self.mq_timestamp)
+		self.metrics = Metrics.InitialiseMetrics('video_handler_' + str(self.channel_id), device_parameter_defaults)
+		
+		# Logged frames are saved by a fixed pool of writer threads, fed through a bounded queue, either as one image file
+		# per frame or to video container files (see VideoContainer.py).
+		self.video_output_mode = device_parameter_defaults['video_output_mode']
+		if self.video_output_mode == 'container':
+			video_container = VideoContainer.VideoContainerWriter(device_parameter_defaults['video_container_fourcc'], device_parameter_defaults['video_container_extension'],
+			                                                      device_parameter_defaults['video_container_fps'])
+		elif self.video_output_mode == 'frames':
+			video_container = None
+		else:
+			raise ValueError('Unknown video output mode: ' + str(self.video_output_mode))
+		self.frame_writer_pool = FrameWriterPool(device_parameter_defaults['frame_writer_threads'], device_parameter_defaults['frame_writer_queue_length'], 
+		                                         device_parameter_defaults['frame_writer_fill_policy'], device_parameter_defaults['frame_writer_quality'], 
+		                                         device_parameter_defaults['frame_writer_degraded_quality'],
+		                                         100 + self.channel_id, self.channel_id, video_container)
+		
+		# Handlers for the commands from the back end.
+		self.command_dispatcher = Messages.Dispatcher('Channel ' + str(self.channel_id) + ' video logger')
+		self.command_dispatcher.RegisterHandler(Messages.VideoOp.LOG_ON, self.HandleLogOn)
+		self.command_dispatcher.RegisterHandler(Messages.VideoOp.LOG_OFF, self.HandleLogOff)
+		self.command_dispatcher.RegisterHandler(Messages.VideoOp.SHUT_DOWN, self.HandleShutDown)
+		self.command_dispatcher.RegisterHandler(Messages.VideoOp.PATH, self.HandlePath)
+		self.command_dispatcher.RegisterHandler(Messages.VideoOp.RESOLUTION, self.HandleResolution)
+		self.command_dispatcher.RegisterHandler(Messages.VideoOp.CAPTURE, self.HandleCapture)
+		self.command_dispatcher.RegisterHandler(Messages.VideoOp.FREEZE_DETECTION, self.HandleFreezeDetection)
 		
 		self.video_fault_flag = not self.VideoConnect(self.video_device_number, self.image_x_dimension, self.image_y_dimension)
 		if self.video_fault_flag == True:
 			self.event_vlogger_fault.set()
+			self.metrics.Inc('coldstage_video_faults_total', channel = self.channel_id)
 		
 		print("Video Logger ready.")
 		
+		# The camera is read by its own capture thread, which keeps just the latest frame (and when it was read) in a
+		# slot, while this thread blocks on the command queue from the back end. So a capture command is served from the
+		# latest frame as soon as it arrives, rather than after the next read() returns.
+		self.capture_thread = Thread.Thread(target = self.CaptureLoop, name = 'Capture', daemon = True)
+		self.capture_thread.start()
+		
+		while self.shut_down_event.is_set() == False:
+			try:
+				last_command = self.mq_back_to_vlogger.get(timeout = 0.5)
+			except queue.Empty:
+				last_command = None
+			if last_command is not None:
+				self.command_dispatcher.Dispatch(last_command)
+			self.metrics.WriteIfDue()
+		
+		self.capture_thread.join()
+		# Make sure every logged frame is on disk before we go.
+		self.frame_writer_pool.Shutdown()
+		print(self.frame_writer_pool.Report())
+		self.CloseFrameLogFile()
+		if self.freeze_detection_stage is not None:
+			self.freeze_detection_stage.Close()
+		# Try and release the video capture device cleanly.
+		try:
+			self.capture_object.release()
+		except:
+			pass
+		# Flush vlogger_to_front queue to ensure that this process can finish and be joined.
+		if self.frame_buffer is not None:
+			self.frame_buffer.Close()
+		else:
+			while True:
+				try:
+					self.mq_vlogger_to_front.get(False, None)
+				except:
+					break
+		Tracing.ExportTracer(device_parameter_defaults)
+		self.metrics.Write()
+		# Set vlogger mpevent to indicate videologger has been shut down.
+		self.event_vlogger_fault.clear()
+	
+	def CaptureLoop(self):
 		frontend_timestamp = time.time()
+		next_capture = time.monotonic()
 		
-		while not self.shut_down:
+		while self.shut_down_event.is_set() == False:
 			# OpenCVs VideoCapture object uses a 5 frame fifo buffer internally, which it keeps topped-up with frames
 			# captured from the capture hardware as quickly as it can. If we call the objects read() method, the oldest frame
 			# in the buffer is decoded and returned, and a new frame is captured from the hardware to the buffer. 
@@ -73,9 +207,13 @@ class VideoHandler():
 			# captured to the internal buffer. This involves a lot of overhead,however, so instead we call grab() as often as possible,
 			# which causes a new frame to be captured from hardware and stored in the buffer. When we actually want to return the
 			# decoded oldest remaining frame in the buffer we call retrieve().
+			#
+			# If the capture rate is limited (see VideoConnect()) the buffer is cut down to one frame, so that reading less 
+			# often than the camera delivers doesn't leave us behind.
 			
 			if self.video_fault_flag == True:
-				reconnect_successful = self.VideoConnect(self.video_device_number, self.image_x_dimension, self.image_y_dimension)
+				with self.capture_lock:
+					reconnect_successful = self.VideoConnect(self.video_device_number, self.image_x_dimension, self.image_y_dimension)
 				if reconnect_successful == True:
 					self.video_fault_flag = False
 					self.event_vlogger_fault.clear()
@@ -89,125 +227,195 @@ class VideoHandler():
 					# of extra lag, so I suspect that it does clear the buffer on Linux but not on Windows. I tried instead using .read()
 					# which definitely clears the buffer when it gets a frame, and this seems to have solved the lag problem without any
 					# noticable overhead.
-					success, self.captured_frame = self.capture_object.read()
+					span_start = self.tracer.Now()
+					with self.capture_lock:
+						success, captured_frame = self.capture_object.read()
+					self.tracer.Record('video_capture', span_start, tid = 200 + self.channel_id)
 				except:
 					success = False
 			else:
 				success = False
-			self.capture_timestamp = time.time()
 			
-			if ((success == False) and (self.video_fault_flag == False)):
+			if success == True:
+				# read() returns a new array every time, so whoever took the previous frame from the slot keeps it intact.
+				capture_timestamp = time.time()
+				with self.frame_condition:
+					self.frame_ring.append((captured_frame, capture_timestamp, self.tracer.Now()))
+					self.frame_condition.notify_all()
+				self.metrics.Inc('coldstage_frames_captured_total', channel = self.channel_id)
+			elif self.video_fault_flag == False:
 				self.video_fault_flag = True
 				self.event_vlogger_fault.set()
+				self.metrics.Inc('coldstage_video_faults_total', channel = self.channel_id)
 			
 			if ((self.logging == False) and (self.video_fault_flag == False)):
 				# If we aren't logging then we are in 'live view' mode which we run at ~4 Hz.
 				if time.time() - frontend_timestamp > 0.25:
 					frontend_timestamp = time.time()
-					rgb_capture = cv2.cvtColor(self.captured_frame, cv2.COLOR_BGR2RGB)
-					rgb_image = Image.fromarray(rgb_capture)
+					# Drawn on a copy, as the captured frame may still be logged.
+					preview_frame = captured_frame.copy()
 					text = [time.strftime("%Y/%m/%d %H:%M:%S %Z", time.localtime())]
 					if self.simulation_flag == True:
 						text.append('SIMULATION RUNNING!')
-					text_spacing = 12
-					draw_text = ImageDraw.Draw(rgb_image)
-					offset = 0
-					for i, row in enumerate(text):
-						draw_text.text((0, offset), text[i], font = self.text_font, fill = "#0000FF")
-						offset += text_spacing
-					self.mq_vlogger_to_front.put(rgb_image)
+					self.overlay.Draw(preview_frame, text, line_spacing = 12)
+					self.PublishFrame(preview_frame, capture_timestamp)
 			
-			# We need to check the message queue from the back end for commands:
-			try:
-				last_command = self.mq_back_to_vlogger.get(False, None)
-			except:
-				last_command = (0,)
-			if last_command[0] != 0 :
-				if last_command[0] == 'Logon':
-					# Turn webcam auto focus off.
-					self.AutoFocusOff()
-					print('Video logging for channel ' + str(self.channel_id) + ' started')
-					self.logging = True
-				elif last_command[0] == 'Logoff':
-					self.logging = False
-					# Turn webcam auto focus back on.
-					self.AutoFocusOn()
-					print('Video logging for channel ' + str(self.channel_id) + ' stopped')
-				elif last_command[0] == 'ShutDown':
-					self.shut_down = True
-				elif last_command[0] == 'Path':
-					self.output_path = last_command[1]
-					self.CreatePath(self.output_path)
-					print('Video capture output path changed to ' + last_command[1])
-				elif last_command[0] == 'Resolution':
-					self.image_x_dimension = last_command[1]
-					self.image_y_dimension = last_command[2]
-					self.capture_object.set(3, self.image_x_dimension)
-					self.capture_object.set(4, self.image_y_dimension)
-					print('Video capture resolution changed to ' + str(last_command[1]) + 'x' + str(last_command[2]))
-				elif last_command[0] == 'Go':
-					if ((self.logging == True) and (self.video_fault_flag == False)):
-						self.Capture(capture = self.captured_frame, timestamp = self.capture_timestamp, frame_params = last_command[1])
-		
-		# Try and release the video capture device cleanly.
-		try:
-			self.capture_object.release()
-		except:
-			pass
-		# Flush vlogger_to_front queue to ensure that this process can finish and be joined.
-		while True:
-			try:
-				self.mq_vlogger_to_front.get(False, None)
-			except:
-				break
-		# Set vlogger mpevent to indicate videologger has been shut down.
-		self.event_vlogger_fault.clear()
-		
-	def Capture(self, capture, timestamp, frame_params):
-		#print('Image timestamp: ' + str(timestamp) + '   Step timestamp: ' + str(frame_params['timestamp']))
-		# If we are storing a frame, put the aquisition time (temp_timestamp) on the timestamp
-		# queue, then put the 'canning' time on the timestamp queue as the end of aquisition.
-		if self.timing_flag:
-			self.mq_timestamp.put([4, timestamp])
-			self.mq_timestamp.put([5, time.time()])
-		
-		if self.timing_flag:
-			self.mq_timestamp.put([6, time.time()])
-			# Lastly, put the timestamp terminator for this timestep.
-			self.mq_timestamp.put([0,])
-		
-		rgb_capture = cv2.cvtColor(capture, cv2.COLOR_BGR2RGB)
-		rgb_image = Image.fromarray(rgb_capture)
+			if self.capture_rate > 0.0:
+				# Wait for the next capture, without trying to catch up on any we were too late for.
+				next_capture = max(next_capture + (1.0 / self.capture_rate), time.monotonic())
+				self.shut_down_event.wait(next_capture - time.monotonic())
+	
+	def HandleLogOn(self, payload):
+		# Turn webcam auto focus off.
+		self.AutoFocusOff()
+		print('Video logging for channel ' + str(self.channel_id) + ' started')
+		self.logging = True
+	
+	def HandleLogOff(self, payload):
+		self.logging = False
+		# Wait for the frames still queued or being written, so none are lost (or written after the log has ended).
+		self.frame_writer_pool.Flush()
+		print(self.frame_writer_pool.Report())
+		self.CloseFrameLogFile()
+		if self.freeze_detection_stage is not None:
+			self.freeze_detection_stage.Close()
+			self.freeze_detection_stage = None
+		# Turn webcam auto focus back on.
+		self.AutoFocusOn()
+		print('Video logging for channel ' + str(self.channel_id) + ' stopped')
+	
+	def HandleShutDown(self, payload):
+		self.shut_down_event.set()
+	
+	def HandlePath(self, payload):
+		self.CloseFrameLogFile()
+		self.output_path = payload.path
+		self.CreatePath(self.output_path)
+		print('Video capture output path changed to ' + payload.path)
+	
+	def HandleFreezeDetection(self, payload):
+		# For the next log only, see HandleLogOff(). A stage already set up is closed first, keeping its results.
+		if self.freeze_detection_stage is not None:
+			self.freeze_detection_stage.Close()
+		self.freeze_detection_stage = FreezeDetection.FreezeDetectionStage(self.freeze_detector, payload.path)
+		print('Freeze detection on, results in ' + payload.path)
+	
+	def HandleResolution(self, payload):
+		self.image_x_dimension = payload.x
+		self.image_y_dimension = payload.y
+		with self.capture_lock:
+			self.capture_object.set(3, self.image_x_dimension)
+			self.capture_object.set(4, self.image_y_dimension)
+		print('Video capture resolution changed to ' + str(payload.x) + 'x' + str(payload.y))
+	
+	def HandleCapture(self, payload):
+		if ((self.logging == True) and (self.video_fault_flag == False)):
+			closest_frame = self.ClosestFrame(payload.timestamp)
+		else:
+			closest_frame = None
+		if closest_frame is not None:
+			self.Capture(capture = closest_frame[0], timestamp = closest_frame[1], timestamp_ns = closest_frame[2], frame_params = payload)
+		elif self.logging == True:
+			self.metrics.Inc('coldstage_frames_dropped_total', channel = self.channel_id, reason = 'video_fault')
+	
+	def ClosestFrame(self, reading_timestamp):
+		# Return the frame in the ring read closest in time to reading_timestamp, or None if there are none yet. Commands
+		# usually arrive within a tick of the reading, so if no frame has been read since then the next one is likely to
+		# be closer, and we wait up to one capture interval for it.
+		with self.frame_condition:
+			if ((len(self.frame_ring) > 0) and (self.frame_ring[-1][1] < reading_timestamp)):
+				self.frame_condition.wait_for(lambda: self.frame_ring[-1][1] >= reading_timestamp, timeout = self.frame_wait_seconds)
+			if len(self.frame_ring) == 0:
+				return None
+			return min(self.frame_ring, key = lambda frame: abs(frame[1] - reading_timestamp))
+	
+	def Capture(self, capture, timestamp, timestamp_ns, frame_params):
+		# Positive offsets are frames read after the reading they are logged against.
+		frame_offset = timestamp - frame_params.timestamp
+		if ((self.frame_change_trigger is None) or (self.frame_change_trigger.Check(capture) == True)):
+			self.stored_frame_index = frame_params.index
+			store_frame = True
+		else:
+			store_frame = False
+			self.metrics.Inc('coldstage_frames_unchanged_total', channel = self.channel_id)
+		self.WriteFrameLog(frame_params, timestamp, frame_offset)
+		if self.freeze_detection_stage is not None:
+			span_start = self.tracer.Now()
+			self.freeze_detection_stage.Process(capture, frame_params.index, float(frame_params.temp))
+			self.metrics.Set('coldstage_droplets_frozen', np.count_nonzero(self.freeze_detector.frozen), channel = self.channel_id)
+			self.metrics.Set('coldstage_frozen_fraction', self.freeze_detector.FrozenFraction(), channel = self.channel_id)
+			self.tracer.Record('freeze_detection', span_start, tid = self.channel_id)
+		self.metrics.Set('coldstage_frame_offset_seconds', frame_offset, channel = self.channel_id)
+		# The frame_age span runs from when the frame being stored was read from the camera to when we were asked to store
+		# it, ie how stale the stored frame is.
+		self.tracer.Record('frame_age', timestamp_ns, tid = self.channel_id, args = {'index': frame_params.index, 'offset': round(frame_offset, 4)})
+		span_start = self.tracer.Now()
 		
-		text = [time.strftime("%Y/%m/%d %H:%M:%S %Z", time.localtime()), '#         : ' + frame_params['index'], 'T (°C) : ' + frame_params['temp'], 'SP (°C): ' + frame_params['setpoint']]
+		# The frame stays in OpenCV's BGR order, which is what cv2.imwrite() expects, so it is only converted to RGB for
+		# the front end.
+		log_frame = capture.copy()
+		text = [time.strftime("%Y/%m/%d %H:%M:%S %Z", time.localtime()), '#         : ' + frame_params.index, 'T (°C) : ' + frame_params.temp, 'SP (°C): ' + frame_params.setpoint]
 		if self.simulation_flag == True:
 			text.append('SIMULATION RUNNING!')
-		text_spacing = 10
-		draw_text = ImageDraw.Draw(rgb_image)
-		offset = 0
-		for i, row in enumerate(text):
-			draw_text.text((0, offset), text[i], font = self.text_font, fill = "#0000FF")
-			offset += text_spacing
-		# We store the frame using a small function spun-out into another thread.
-		# This way, if something else starts thrashing the disk, because we aren't waiting on the disk
-		# access to continue running the event loop here (at least some of the time!), we won't be late
-		# for the next timing event trigger from the back end.
-		frame_canner = Thread.Thread(target = FrameCanner, args = (self.output_path + frame_params['index'] + self.image_file_format, rgb_image))
-		frame_canner.start()
-		self.mq_vlogger_to_front.put(rgb_image)
+		self.overlay.Draw(log_frame, text, line_spacing = 10)
+		# The frame is stored by the frame writer pool, so if something else starts thrashing the disk we aren't waiting 
+		# on the disk access to continue running the event loop here, and won't be late for the next timing event trigger
+		# from the back end (unless the pool fills up and its fill policy is 'block').
+		if store_frame == False:
+			# Unchanged, so the log refers to the last frame stored instead.
+			pass
+		elif self.video_output_mode == 'container':
+			self.frame_writer_pool.Put((self.output_path, frame_params, timestamp), log_frame)
+		else:
+			self.frame_writer_pool.Put(self.output_path + frame_params.index + self.image_file_format, log_frame)
+		self.PublishFrame(log_frame, timestamp)
+		self.tracer.Record('frame_annotate', span_start, tid = self.channel_id)
+	
+	def WriteFrameLog(self, frame_params, timestamp, frame_offset):
+		# The file is opened on the first frame logged to each video path, as the path can change mid-log (ie, with
+		# log_video_split_flag).
+		if self.frame_log_file is None:
+			file_path = self.output_path + FRAME_LOG_FILE_NAME
+			write_header = not os.path.exists(file_path)
+			self.frame_log_file = open(file_path, 'a', buffering = 1, encoding = 'utf-8')
+			if write_header == True:
+				self.frame_log_file.write('Frame Number, Reading Timestamp (secs), Frame Timestamp (secs), Frame Offset (secs), Stored Frame Number\n')
+		self.frame_log_file.write(frame_params.index + ', ' + str(round(frame_params.timestamp, 4)) + ', ' + str(round(timestamp, 4)) + ', ' + str(round(frame_offset, 4)) + ', ' + 
+		                          self.stored_frame_index + '\n')
+	
+	def CloseFrameLogFile(self):
+		if self.frame_log_file is not None:
+			self.frame_log_file.close()
+			self.frame_log_file = None
+		# Each video path starts with a stored frame, so none of its frames refer to another path's.
+		self.stored_frame_index = None
+		if self.frame_change_trigger is not None:
+			self.frame_change_trigger.Reset()
+	
+	def PublishFrame(self, frame, timestamp):
+		# The front end wants RGB. The conversion writes straight into the shared memory frame buffer, so it doubles as
+		# the copy.
+		with self.publish_lock:
+			if self.frame_buffer is not None:
+				cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst = self.frame_buffer.BeginWrite(frame.shape[1], frame.shape[0]))
+				self.frame_buffer.EndWrite(timestamp)
+			else:
+				self.mq_vlogger_to_front.put(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
 	
 	def AutoFocusOff(self):
 		print('Autofocus OFF.')
-		self.capture_object.set(cv2.CAP_PROP_AUTOFOCUS, 0)
+		with self.capture_lock:
+			self.capture_object.set(cv2.CAP_PROP_AUTOFOCUS, 0)
 	
 	def AutoFocusOn(self):
 		print('Autofocus ON.')
-		self.capture_object.set(cv2.CAP_PROP_AUTOFOCUS, 1)
+		with self.capture_lock:
+			self.capture_object.set(cv2.CAP_PROP_AUTOFOCUS, 1)
 	
 	def CreatePath(self, path):
 		if not os.path.exists(path):
 			os.makedirs(path)    
-
+	
 	def VideoConnect(self, video_device_number, x_dimension, y_dimension):
 		# Create the opencv webcam video capture object. 1 is the external webcam, 0 would
 		# be the built-in webcam on this laptop, for instance.
@@ -219,7 +427,9 @@ class VideoHandler():
 		
 		print('Attempting to connect to video source...')
 		
-		if os.name == 'posix':
+		if video_device_number == SyntheticCamera.SYNTHETIC_CAMERA_ID:
+			self.capture_object = SyntheticCamera.SyntheticCamera(self.device_parameter_defaults, self.telemetry_ring_name)
+		elif os.name == 'posix':
 			self.capture_object = cv2.VideoCapture(video_device_number, cv2.CAP_V4L2)
 		elif os.name == 'nt':
 			self.capture_object = cv2.VideoCapture(video_device_number, cv2.CAP_DSHOW)
@@ -228,6 +438,9 @@ class VideoHandler():
 			print('Connected to video source.')
 			self.capture_object.set(3, x_dimension)
 			self.capture_object.set(4, y_dimension)
+			if self.capture_rate > 0.0:
+				# Not every back end supports this, in which case the frame read can be a few frames old.
+				self.capture_object.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 				
 			try:	
 				# Try and capture a few frames from the video device to make sure the image buffer is freshly filled-up.
@@ -253,9 +466,188 @@ class VideoHandler():
 			return False
 			
 		
-class FrameCanner():
-	def __init__(self, filename, image):
-		self.image = image
-		self.filename = filename
-		self.image.save(filename)
-		
+class FrameChangeTrigger():
+	def __init__ (self, threshold = 8.0, downsample = 8, keyframe_interval = 60):
+		# Decides whether a logged frame has changed enough since the last stored frame to be worth storing, so that long
+		# holds where nothing happens don't fill the disk with identical frames.
+		#
+		# Frames are compared as greyscale, shrunk by downsample in each direction (by averaging, which also averages 
+		# out most of the camera noise). The change is the largest difference between any of the shrunken pixels and 
+		# those of the last stored frame, so that a single droplet freezing counts as much as a change over the whole 
+		# frame. A frame is stored if its change exceeds threshold (in grey levels, 0 - 255), or if keyframe_interval 
+		# frames have gone by since the last one was stored (0 = no keyframes).
+		self.threshold = float(threshold)
+		self.downsample = max(1, int(downsample))
+		self.keyframe_interval = int(keyframe_interval)
+		self.Reset()
+	
+	def Reset(self):
+		# The next frame is always stored.
+		self.stored_thumbnail = None
+		self.frames_since_stored = 0
+	
+	def Thumbnail(self, frame):
+		height, width = frame.shape[:2]
+		grey_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+		return cv2.resize(grey_frame, (max(1, width // self.downsample), max(1, height // self.downsample)), interpolation = cv2.INTER_AREA).astype(np.int16)
+	
+	def Check(self, frame):
+		# Returns True if frame (a BGR array) should be stored, in which case it becomes the frame later ones are compared
+		# with.
+		thumbnail = self.Thumbnail(frame)
+		self.frames_since_stored += 1
+		if ((self.stored_thumbnail is None) or (thumbnail.shape != self.stored_thumbnail.shape)):
+			store = True
+		elif ((self.keyframe_interval > 0) and (self.frames_since_stored >= self.keyframe_interval)):
+			store = True
+		else:
+			store = (np.abs(thumbnail - self.stored_thumbnail).max() > self.threshold)
+		if store == True:
+			self.stored_thumbnail = thumbnail
+			self.frames_since_stored = 0
+		return store
+
+class FrameWriterPool():
+	def __init__ (self, num_writers, max_queued, fill_policy = 'block', quality = 75, degraded_quality = 50, trace_tid = 0, channel_id = 0, video_container = None):
+		# A fixed number of writer threads saving frames from a bounded queue. With one writer (the default) frames reach 
+		# the disk in the order they were captured. With more, a slow write can be overtaken by the next frame's.
+		#
+		# If the disk can't keep up and max_queued frames are waiting, fill_policy decides what happens to the next one:
+		#	'block'			- wait for a writer to take a frame off the queue (no frames lost, but the video handler loop
+		#					  stalls, so frames are captured late).
+		#	'drop_oldest'	- drop the oldest waiting frame to make room (the video handler never waits).
+		#	'degrade'		- once the queue is half full, save frames at degraded_quality (JPEG quality, or no PNG
+		#					  compression) so that they are quicker to encode and write, and drop the oldest if it fills
+		#					  all the same.
+		#
+		# Frames are BGR arrays, as they come from OpenCV, and are written with cv2.imwrite() (JPEGs at quality), each to
+		# the filename it was put with. If there is a video_container (a VideoContainer.VideoContainerWriter) they are
+		# appended to that instead, put with (directory, frame params, timestamp), and there is only ever one writer so
+		# that frames go into the container in order.
+		if fill_policy not in ['block', 'drop_oldest', 'degrade']:
+			raise ValueError('Unknown frame writer fill policy: ' + str(fill_policy))
+		self.max_queued = max(1, int(max_queued))
+		self.fill_policy = fill_policy
+		self.quality = int(quality)
+		self.degraded_quality = int(degraded_quality)
+		self.trace_tid = trace_tid
+		self.channel_id = channel_id
+		self.video_container = video_container
+		if self.video_container is not None:
+			num_writers = 1
+		self.tracer = Tracing.GetTracer()
+		self.metrics = Metrics.GetMetrics()
+		self.frames = collections.deque()
+		self.condition = Thread.Condition()
+		self.in_flight = 0
+		self.shutdown_flag = False
+		self.queued_frames = 0
+		self.written_frames = 0
+		self.degraded_frames = 0
+		self.dropped_frames = 0
+		self.writers = [Thread.Thread(target = self.WriterLoop, name = 'Frame writer ' + str(i), daemon = True) for i in range(max(1, int(num_writers)))]
+		for writer in self.writers:
+			writer.start()
+	
+	def Put(self, destination, frame):
+		with self.condition:
+			if self.shutdown_flag == True:
+				self.Dropped('shut_down')
+				return
+			if len(self.frames) >= self.max_queued:
+				if self.fill_policy == 'block':
+					while len(self.frames) >= self.max_queued:
+						self.condition.wait()
+				else:
+					self.frames.popleft()
+					self.Dropped('writer_queue_full')
+			degraded = ((self.fill_policy == 'degrade') and (len(self.frames) >= (self.max_queued / 2)))
+			self.frames.append((destination, frame, degraded))
+			self.queued_frames += 1
+			self.metrics.Inc('coldstage_frames_queued_total', channel = self.channel_id)
+			self.metrics.Set('coldstage_frame_writer_queue_depth', len(self.frames), channel = self.channel_id)
+			self.condition.notify_all()
+	
+	def Dropped(self, reason):
+		# Called with the condition held.
+		self.dropped_frames += 1
+		self.metrics.Inc('coldstage_frames_dropped_total', channel = self.channel_id, reason = reason)
+	
+	def WriterLoop(self):
+		while True:
+			with self.condition:
+				while ((len(self.frames) == 0) and (self.shutdown_flag == False)):
+					self.condition.wait()
+				if len(self.frames) == 0:
+					# Shut down, and nothing left to write.
+					return
+				destination, frame, degraded = self.frames.popleft()
+				self.in_flight += 1
+				self.metrics.Set('coldstage_frame_writer_queue_depth', len(self.frames), channel = self.channel_id)
+				self.condition.notify_all()
+			success = self.Write(destination, frame, degraded)
+			with self.condition:
+				self.in_flight -= 1
+				if success == True:
+					self.written_frames += 1
+					self.degraded_frames += int(degraded)
+					self.metrics.Inc('coldstage_frames_written_total', channel = self.channel_id)
+				else:
+					self.Dropped('write_error')
+				self.condition.notify_all()
+	
+	def Write(self, destination, frame, degraded):
+		span_start = self.tracer.Now()
+		if self.video_container is not None:
+			directory, frame_params, timestamp = destination
+			try:
+				success = self.video_container.Write(directory, frame, frame_params, timestamp, self.degraded_quality if degraded == True else self.quality)
+			except cv2.error as error:
+				success = False
+				print(str(error))
+			if success == False:
+				print('Could not write frame ' + frame_params.index + ' to a video container in ' + directory + '!')
+				return False
+			self.tracer.Record('frame_write', span_start, tid = self.trace_tid, args = {'degraded': degraded})
+			return True
+		filename = destination
+		extension = os.path.splitext(filename)[1].lower()
+		if extension in ['.jpg', '.jpeg']:
+			parameters = [cv2.IMWRITE_JPEG_QUALITY, self.degraded_quality if degraded == True else self.quality]
+		elif ((extension == '.png') and (degraded == True)):
+			parameters = [cv2.IMWRITE_PNG_COMPRESSION, 0]
+		else:
+			parameters = []
+		try:
+			success = cv2.imwrite(filename, frame, parameters)
+		except cv2.error as error:
+			success = False
+			print(str(error))
+		if success == False:
+			print('Could not write frame ' + filename + '!')
+			return False
+		self.tracer.Record('frame_write', span_start, tid = self.trace_tid, args = {'degraded': degraded})
+		return True
+	
+	def Flush(self):
+		# Block until every frame queued so far has been written (or failed), and close the video container so that it
+		# is complete on disk.
+		with self.condition:
+			while ((len(self.frames) > 0) or (self.in_flight > 0)):
+				self.condition.wait()
+			if self.video_container is not None:
+				self.video_container.Close()
+	
+	def Shutdown(self):
+		# The writers finish off everything still queued before they stop.
+		with self.condition:
+			self.shutdown_flag = True
+			self.condition.notify_all()
+		for writer in self.writers:
+			writer.join()
+		if self.video_container is not None:
+			self.video_container.Close()
+	
+	def Report(self):
+		return ('Frame writer: ' + str(self.queued_frames) + ' frames queued, ' + str(self.written_frames) + ' written (' + str(self.degraded_frames) + 
+		        ' at degraded quality), ' + str(self.dropped_frames) + ' dropped.')
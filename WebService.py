@@ -0,0 +1,487 @@
+"""
+########################################################################
+#                                                                      #
+#                  Copyright 2021 Sebastien Sikora                     #
+#                    sikora.scientific@gmail.com                       #
+#                                                                      #
+########################################################################
+
+	This file is part of Cold Stage 4.
+	PRE RELEASE 3.5
+
+	Cold Stage 4 is free software: you can redistribute it and/or 
+	modify it under the terms of the GNU General Public License as 
+	published by the Free Software Foundation, either version 3 of the 
+	License, or (at your option) any later version.
+
+	Cold Stage 4 is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with Cold Stage 4.  
+	If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+# Optional local HTTP and WebSocket service for watching (and controlling) the cold stage from another machine, eg
+# a control room dashboard. Standard library only.
+#
+# The service runs on its own threads in the process that already reads the telemetry, ie the Tk front end process
+# or a Headless.HeadlessColdStage, never in the back end, so however many viewers are connected the control loop does
+# no extra work. That process calls Publish() with each batch of telemetry and each event it receives from the back
+# end. Each message is encoded once and appended to every client's own bounded queue, and a client that can't keep up
+# loses its oldest messages rather than holding anyone else up.
+#
+#	GET /status		The latest reading and state of every channel, as JSON.
+#	GET /metrics	The Prometheus text format metrics of every process (see Metrics.py), if metrics are enabled.
+#	GET /ws			WebSocket. Sends {"type": "telemetry", "channel": n, "fields": [...], "records": [[...], ...]} and
+#					{"type": "event", "channel": n, "event": "<FrontEndOp name>", "payload": {...}} messages, and accepts
+#					commands as {"channel": n, "command": "<BackEndOp name>", "args": [...] or {...}}, eg
+#					{"channel": 0, "command": "SETPOINT", "args": [-20.0]}, which are checked as the front end checks them
+#					(throttle within +/-100 %, setpoints clamped to the temperature limits etc) and then go to the back
+#					end exactly as if sent by the channel's front end. Each command is answered with 
+#					{"type": "reply", "ok": true/false, ...}.
+#
+# Bound to localhost unless web_service_host says otherwise. If web_service_token is set, every request must carry
+# it, eg /ws?token=<token>. The service won't start on any other address without a token.
+
+import json
+import math
+import base64
+import ipaddress
+import select
+import struct
+import hmac
+import hashlib
+import threading
+import collections
+import urllib.parse
+import http.server
+
+import Messages
+import Metrics
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# Largest frame accepted from a client, plenty for any command. Bigger frames close the connection.
+MAX_CLIENT_FRAME_BYTES = 16384
+# Commands that would leave the front end windows behind, so are only accepted from the front ends themselves.
+BLOCKED_COMMANDS = [Messages.BackEndOp.SHUT_DOWN, Messages.BackEndOp.ALL_SHUT_DOWN]
+
+class WebService():
+	def __init__ (self, host, port, command_queues, token = '', client_queue_length = 1000, temperature_limits = None):
+		# Anyone who can reach the port can drive the stage, so other machines must have the token.
+		if ((token == '') and (IsLoopback(host) == False)):
+			raise ValueError('the web service needs a token (web_service_token) to listen on ' + host)
+		self.command_queues = command_queues
+		self.token = token
+		self.client_queue_length = client_queue_length
+		self.clients = []
+		self.clients_lock = threading.Lock()
+		self.channel_status = [{'latest': None, 'events': {}} for i in range(len(command_queues))]
+		# Setpoints are clamped to, and ramps checked against, each channel's temperature limits as in the front end. These
+		# start as the defaults and follow the SET_TEMP_LIMITS events from the back end (see Publish()).
+		self.temperature_limits = [dict(limits) for limits in temperature_limits] if temperature_limits is not None else [None for i in range(len(command_queues))]
+		# Other paths (ie, /metrics) can be added with RegisterEndpoint().
+		self.endpoints = {'/status': self.Status}
+		self.messages_published = 0
+		self.messages_dropped = 0
+		self.server = http.server.ThreadingHTTPServer((host, port), self.RequestHandlerClass())
+		self.server.daemon_threads = True
+		self.server_thread = threading.Thread(target = self.server.serve_forever, kwargs = {'poll_interval': 0.5}, daemon = True)
+		self.server_thread.start()
+		print('Web service listening on http://' + host + ':' + str(self.server.server_address[1]) + '/')
+	
+	def RequestHandlerClass(self):
+		service = self
+		class RequestHandler(WebRequestHandler):
+			web_service = service
+		return RequestHandler
+	
+	def RegisterEndpoint(self, path, function):
+		# function() returns (content type, body string) for a GET of path.
+		self.endpoints[path] = function
+	
+	def Status(self):
+		# Copies, as the poll thread may be updating the status as we go.
+		channel_status = [{'latest': channel['latest'], 'events': dict(channel['events'])} for channel in self.channel_status]
+		return 'application/json', json.dumps({'channels': channel_status, 'clients': len(self.clients), 'messages_published': self.messages_published,
+		                                       'messages_dropped': self.messages_dropped}, default = JSONDefault)
+	
+	def Publish(self, channel_id, message_type, data):
+		# Called by the front end (or headless) poll with each new batch of telemetry records or each back end event.
+		if message_type == 'telemetry':
+			records = [[None if math.isnan(value) else value for value in record] for record in data.tolist()]
+			self.channel_status[channel_id]['latest'] = dict(zip(data.dtype.names, records[-1]))
+			message = {'type': 'telemetry', 'channel': channel_id, 'fields': list(data.dtype.names), 'records': records}
+		else:
+			opcode, payload = data
+			name = Messages.OpcodeName(opcode)
+			payload_dict = payload._asdict() if payload is not None else None
+			self.channel_status[channel_id]['events'][name] = payload_dict
+			if opcode == Messages.FrontEndOp.SET_TEMP_LIMITS:
+				self.temperature_limits[channel_id] = {'max': float(payload.max), 'min': float(payload.min)}
+			message = {'type': 'event', 'channel': channel_id, 'event': name, 'payload': payload_dict}
+		if len(self.clients) == 0:
+			return
+		encoded_frame = EncodeFrame(json.dumps(message, default = JSONDefault).encode('utf-8'))
+		with self.clients_lock:
+			for client in self.clients:
+				client.Put(encoded_frame)
+		self.messages_published += 1
+	
+	def Command(self, request):
+		# Turn a command from a client into a front end -> back end message.
+		try:
+			channel_id = int(request['channel'])
+			opcode = Messages.BackEndOp[str(request['command'])]
+			if ((channel_id < 0) or (channel_id >= len(self.command_queues))):
+				raise ValueError('no channel ' + str(channel_id))
+			if opcode in BLOCKED_COMMANDS:
+				raise ValueError(opcode.name + ' can only be sent from the front end')
+			args = request.get('args', [])
+			if type(args) is dict:
+				args = [args[field] for field in Messages.PAYLOAD_TYPES[opcode]._fields]
+			elif type(args) is not list:
+				raise TypeError('args must be a list or an object')
+			# The same checks as the front end makes before sending each command (see COMMAND_ARGUMENTS below).
+			message = Messages.Message(opcode, *COMMAND_ARGUMENTS[opcode](self.temperature_limits[channel_id], *args))
+		except (KeyError, ValueError, TypeError, AttributeError) as error:
+			return {'type': 'reply', 'ok': False, 'error': repr(error), 'request': request}
+		self.command_queues[channel_id].put(message)
+		return {'type': 'reply', 'ok': True, 'request': request}
+	
+	def AddClient(self, client):
+		with self.clients_lock:
+			self.clients.append(client)
+		print('Web service client ' + client.address + ' connected (' + str(len(self.clients)) + ' connected).')
+	
+	def RemoveClient(self, client):
+		with self.clients_lock:
+			if client in self.clients:
+				self.clients.remove(client)
+		self.messages_dropped += client.dropped_messages
+		print('Web service client ' + client.address + ' disconnected.')
+	
+	def Shutdown(self):
+		with self.clients_lock:
+			for client in self.clients:
+				client.Close()
+		self.server.shutdown()
+		self.server.server_close()
+		print('Web service stopped.')
+
+class WebSocketClient():
+	def __init__ (self, address, max_messages):
+		self.address = address
+		# Only the publishing thread appends and only the client's own thread pops, so the deque drops the oldest
+		# message itself when full, rather than the publisher popping it.
+		self.frames = collections.deque(maxlen = max_messages)
+		self.dropped_messages = 0
+		self.closed = False
+	
+	def Put(self, encoded_frame):
+		if len(self.frames) == self.frames.maxlen:
+			self.dropped_messages += 1
+		self.frames.append(encoded_frame)
+	
+	def Close(self):
+		self.closed = True
+
+class WebRequestHandler(http.server.BaseHTTPRequestHandler):
+	web_service = None
+	# WebSocket upgrades must be HTTP/1.1. Every other reply sends a Content-Length, so keep-alive is safe.
+	protocol_version = 'HTTP/1.1'
+	
+	def log_message(self, format, *args):
+		# Keep the console for the cold stage.
+		pass
+	
+	def do_GET(self):
+		url = urllib.parse.urlparse(self.path)
+		query = urllib.parse.parse_qs(url.query)
+		if ((self.web_service.token != '') and (hmac.compare_digest(query.get('token', [''])[0].encode('utf-8'), self.web_service.token.encode('utf-8')) == False)):
+			self.send_error(403)
+			return
+		if ((url.path == '/ws') and (self.headers.get('Upgrade', '').lower() == 'websocket')):
+			self.WebSocket()
+		elif url.path in self.web_service.endpoints:
+			content_type, body = self.web_service.endpoints[url.path]()
+			body = body.encode('utf-8')
+			self.send_response(200)
+			self.send_header('Content-Type', content_type)
+			self.send_header('Content-Length', str(len(body)))
+			self.send_header('Access-Control-Allow-Origin', '*')
+			self.end_headers()
+			self.wfile.write(body)
+		else:
+			self.send_error(404)
+	
+	def WebSocket(self):
+		accept = AcceptKey(self.headers.get('Sec-WebSocket-Key', ''))
+		self.send_response(101, 'Switching Protocols')
+		self.send_header('Upgrade', 'websocket')
+		self.send_header('Connection', 'Upgrade')
+		self.send_header('Sec-WebSocket-Accept', accept)
+		self.end_headers()
+		self.wfile.flush()
+		self.close_connection = True
+	
+		client = WebSocketClient(self.client_address[0] + ':' + str(self.client_address[1]), self.web_service.client_queue_length)
+		self.web_service.AddClient(client)
+		connection = self.request
+		receive_buffer = b''
+		# Sent in the close frame, eg the status code of a protocol error or the client's own close frame echoed back.
+		close_payload = b''
+		try:
+			# One thread per client, which both sends whatever has been published and reads any commands, waking at
+			# least every 50 ms.
+			while client.closed == False:
+				while len(client.frames) > 0:
+					connection.sendall(client.frames.popleft())
+				readable, writable, failed = select.select([connection], [], [], 0.05)
+				if len(readable) > 0:
+					data = connection.recv(65536)
+					if len(data) == 0:
+						break
+					receive_buffer += data
+					while True:
+						try:
+							frame, receive_buffer = DecodeFrame(receive_buffer)
+						except WebSocketProtocolError as error:
+							close_payload = struct.pack('!H', error.status_code)
+							client.closed = True
+							break
+						if frame is None:
+							break
+						opcode, payload = frame
+						if opcode == 0x1:
+							try:
+								reply = self.web_service.Command(json.loads(payload.decode('utf-8')))
+							except ValueError as error:
+								reply = {'type': 'reply', 'ok': False, 'error': repr(error)}
+							connection.sendall(EncodeFrame(json.dumps(reply, default = JSONDefault).encode('utf-8')))
+						elif opcode == 0x9:
+							connection.sendall(EncodeFrame(payload, 0xA))
+						elif opcode == 0x8:
+							close_payload = payload[:2]
+							client.closed = True
+							break
+			if client.closed == True:
+				try:
+					connection.sendall(EncodeFrame(close_payload, 0x8))
+				except OSError:
+					pass
+		except OSError:
+			pass
+		finally:
+			self.web_service.RemoveClient(client)
+
+def IsLoopback(host):
+	if host == 'localhost':
+		return True
+	try:
+		return ipaddress.ip_address(host).is_loopback
+	except ValueError:
+		return False
+
+def Number(value):
+	# Plain JSON numbers only, so neither strings like "nan" nor true/false get through.
+	if ((type(value) is not int) and (type(value) is not float)):
+		raise TypeError('expected a number, not ' + repr(value))
+	value = float(value)
+	if math.isfinite(value) == False:
+		raise ValueError('expected a finite number, not ' + repr(value))
+	return value
+
+def PositiveNumber(value):
+	value = Number(value)
+	if value <= 0.0:
+		raise ValueError('expected a positive number, not ' + repr(value))
+	return value
+
+def PositiveInteger(value):
+	if ((type(value) is not int) or (value <= 0)):
+		raise ValueError('expected a positive integer, not ' + repr(value))
+	return value
+
+def Flag(value):
+	if ((type(value) is not bool) and (value not in (0, 1))):
+		raise ValueError('expected true or false, not ' + repr(value))
+	return bool(value)
+
+def Text(value):
+	if type(value) is not str:
+		raise TypeError('expected a string, not ' + repr(value))
+	return value
+
+def Temperature(value, temperature_limits):
+	value = Number(value)
+	if temperature_limits is None:
+		raise ValueError('temperature limits not known yet')
+	if ((value < temperature_limits['min']) or (value > temperature_limits['max'])):
+		raise ValueError(str(value) + ' °C is outside the temperature limits ' + str(temperature_limits['min']) + ' to ' + str(temperature_limits['max']) + ' °C')
+	return value
+
+def ThrottleArguments(temperature_limits, throttle):
+	throttle = Number(throttle)
+	if ((throttle < -100.0) or (throttle > 100.0)):
+		raise ValueError('throttle must be between -100 and 100')
+	return (throttle,)
+
+def SetpointArguments(temperature_limits, setpoint):
+	setpoint = Number(setpoint)
+	if temperature_limits is None:
+		raise ValueError('temperature limits not known yet')
+	return (min(max(setpoint, temperature_limits['min']), temperature_limits['max']),)
+
+def RampArguments(temperature_limits, repeats, log_end_on_profile_end, profile_path, profile_table):
+	# Either a profile file on this machine or a table of rows as in a profile file (see RampManager.py), with every
+	# temperature within the limits.
+	if ((profile_path is None) == (profile_table is None)):
+		raise ValueError('give one of profile_path and profile_table')
+	if profile_path is not None:
+		profile_path = Text(profile_path)
+	else:
+		if ((type(profile_table) is not list) or (len(profile_table) == 0)):
+			raise ValueError('profile_table must be a list of rows')
+		rows = []
+		for row in profile_table:
+			if ((type(row) is not list) or (len(row) == 0)):
+				raise ValueError('bad profile row ' + repr(row))
+			if ((row[0] == 'hold') and (len(row) == 2)):
+				rows.append(['hold', PositiveNumber(row[1])])
+			elif ((row[0] == 'setpoint') and (len(row) == 2)):
+				rows.append(['setpoint', Temperature(row[1], temperature_limits)])
+			elif ((row[0] == 'ramp') and (len(row) == 4)):
+				rows.append(['ramp', Temperature(row[1], temperature_limits), Temperature(row[2], temperature_limits), Number(row[3])])
+			else:
+				raise ValueError('bad profile row ' + repr(row))
+		profile_table = rows
+	return (PositiveInteger(repeats), Flag(log_end_on_profile_end), profile_path, profile_table)
+
+def CalibrationLimitArguments(temperature_limits, calibration_limit):
+	return (None if calibration_limit is None else Number(calibration_limit),)
+
+def VideoResolutionArguments(temperature_limits, resolution):
+	dimensions = Text(resolution).split('x')
+	if ((len(dimensions) != 2) or (dimensions[0].isdigit() == False) or (dimensions[1].isdigit() == False)):
+		raise ValueError('resolution must be like 640x480, not ' + repr(resolution))
+	return (resolution,)
+
+# For each command accepted from clients, a function that checks its arguments (the channel's temperature limits are
+# passed first) and returns them ready for Messages.Message(). Any command not listed is refused.
+COMMAND_ARGUMENTS = {
+	Messages.BackEndOp.THROTTLE: ThrottleArguments,
+	Messages.BackEndOp.SETPOINT: SetpointArguments,
+	Messages.BackEndOp.RAMP: RampArguments,
+	Messages.BackEndOp.PID_CONFIG: lambda temperature_limits, P, I, D, power_multiplier: (Number(P), Number(I), Number(D), Number(power_multiplier)),
+	Messages.BackEndOp.LOGGING_RATE: lambda temperature_limits, logging_rate: (PositiveInteger(logging_rate),),
+	Messages.BackEndOp.START_LOGGING: lambda temperature_limits, file_path, force_video_off, force_log_data_file_path: (Text(file_path), Flag(force_video_off), Flag(force_log_data_file_path)),
+	Messages.BackEndOp.STOP_LOGGING: lambda temperature_limits: (),
+	Messages.BackEndOp.SET_TIME_STEP: lambda temperature_limits, time_step: (PositiveNumber(time_step),),
+	Messages.BackEndOp.NEW_DATUM_TIME: lambda temperature_limits: (),
+	Messages.BackEndOp.CALIBRATION_OFF: lambda temperature_limits: (),
+	Messages.BackEndOp.CALIBRATION_ON: lambda temperature_limits: (),
+	Messages.BackEndOp.SET_CALIBRATION_LIMIT: CalibrationLimitArguments,
+	Messages.BackEndOp.OFF: lambda temperature_limits: (),
+	Messages.BackEndOp.CHANGE_VIDEO_RES: VideoResolutionArguments,
+	Messages.BackEndOp.CHANGE_LOG_VIDEO_SPLIT_FLAG: lambda temperature_limits, log_video_split_flag: (Flag(log_video_split_flag),),
+	Messages.BackEndOp.FREEZE_DETECTION: lambda temperature_limits, freeze_detection_flag: (Flag(freeze_detection_flag),),
+}
+
+def AcceptKey(key):
+	return base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+
+def EncodeFrame(payload, opcode = 0x1):
+	# A single unmasked server frame (text by default).
+	length = len(payload)
+	if length < 126:
+		header = struct.pack('!BB', 0x80 | opcode, length)
+	elif length < 65536:
+		header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+	else:
+		header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+	return header + payload
+
+class WebSocketProtocolError(Exception):
+	def __init__ (self, message, status_code):
+		# status_code is the close frame status to send, eg 1002 (protocol error) or 1009 (message too big).
+		super().__init__(message)
+		self.status_code = status_code
+
+def DecodeFrame(buffer):
+	# Returns ((opcode, payload), remaining buffer) for the first complete (masked, client) frame in buffer, or
+	# (None, buffer) if it is not all here yet. Fragmented messages are not used by the clients we expect, so aren't
+	# reassembled. Raises WebSocketProtocolError for an unmasked frame (clients must mask, RFC 6455 section 5.1) or one
+	# longer than MAX_CLIENT_FRAME_BYTES, as soon as its header arrives, so the buffer never holds more than one frame.
+	if len(buffer) < 2:
+		return None, buffer
+	opcode = buffer[0] & 0x0F
+	masked = buffer[1] & 0x80
+	length = buffer[1] & 0x7F
+	offset = 2
+	if length == 126:
+		if len(buffer) < 4:
+			return None, buffer
+		length = struct.unpack('!H', buffer[2:4])[0]
+		offset = 4
+	elif length == 127:
+		if len(buffer) < 10:
+			return None, buffer
+		length = struct.unpack('!Q', buffer[2:10])[0]
+		offset = 10
+	if not masked:
+		raise WebSocketProtocolError('unmasked client frame', 1002)
+	if length > MAX_CLIENT_FRAME_BYTES:
+		raise WebSocketProtocolError('client frame of ' + str(length) + ' bytes', 1009)
+	mask = buffer[offset:offset + 4]
+	offset += 4
+	if len(buffer) < offset + length:
+		return None, buffer
+	payload = buffer[offset:offset + length]
+	payload = bytes(payload[i] ^ mask[i % 4] for i in range(length))
+	return (opcode, payload), buffer[offset + length:]
+
+def JSONDefault(value):
+	# numpy scalars (ie, from telemetry records) as plain numbers.
+	if hasattr(value, 'item'):
+		value = value.item()
+		if ((type(value) is float) and (math.isnan(value))):
+			return None
+		return value
+	return str(value)
+
+# The service for this process, if one has been started.
+_service = None
+
+def StartService(device_parameter_defaults, command_queues):
+	# Start the service if enabled in the defaults. command_queues are the front end -> back end queues, one per channel.
+	global _service
+	if device_parameter_defaults['web_service_enabled'] == True:
+		temperature_limits = [{'max': device_parameter_defaults['max_temperature_limit'][i], 'min': device_parameter_defaults['min_temperature_limit'][i]} for i in range(len(command_queues))]
+		try:
+			_service = WebService(device_parameter_defaults['web_service_host'], device_parameter_defaults['web_service_port'], command_queues,
+			                      device_parameter_defaults['web_service_token'], device_parameter_defaults['web_service_client_queue_length'], temperature_limits)
+		except ValueError as error:
+			print('WARNING: web service not started, ' + str(error) + '!')
+			return None
+		if device_parameter_defaults['metrics_enabled'] == True:
+			metrics_directory = device_parameter_defaults['metrics_output_directory']
+			_service.RegisterEndpoint('/metrics', lambda: ('text/plain; version=0.0.4', Metrics.CollectFiles(metrics_directory)))
+	return _service
+
+def GetService():
+	return _service
+
+def Publish(channel_id, message_type, data):
+	# Safe to call whether or not the service is running.
+	if _service is not None:
+		_service.Publish(channel_id, message_type, data)
+
+def StopService():
+	global _service
+	if _service is not None:
+		_service.Shutdown()
+		_service = None
@@ -0,0 +1,137 @@
+# Handshake and command round trips against a local WebService, with a plain socket client. Run with
+# 'python -m pytest tests' (or 'python -m unittest discover tests') from the top directory.
+
+import os
+import sys
+import json
+import queue
+import base64
+import socket
+import struct
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Messages
+import WebService
+
+class WebSocketTestClient():
+	def __init__ (self, port, path = '/ws'):
+		self.connection = socket.create_connection(('127.0.0.1', port), timeout = 5.0)
+		self.key = base64.b64encode(os.urandom(16)).decode('ascii')
+		self.connection.sendall(('GET ' + path + ' HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+		                         'Sec-WebSocket-Key: ' + self.key + '\r\nSec-WebSocket-Version: 13\r\n\r\n').encode('ascii'))
+		self.buffer = b''
+		while b'\r\n\r\n' not in self.buffer:
+			data = self.connection.recv(4096)
+			if len(data) == 0:
+				break
+			self.buffer += data
+		response, self.buffer = self.buffer.split(b'\r\n\r\n', 1)
+		lines = response.decode('ascii').split('\r\n')
+		self.status_line = lines[0]
+		self.headers = {line.split(':', 1)[0].strip().lower(): line.split(':', 1)[1].strip() for line in lines[1:]}
+	
+	def SendFrame(self, payload, opcode = 0x1, masked = True, length = None):
+		length = len(payload) if length is None else length
+		if length < 126:
+			header = struct.pack('!BB', 0x80 | opcode, (0x80 if masked else 0) | length)
+		elif length < 65536:
+			header = struct.pack('!BBH', 0x80 | opcode, (0x80 if masked else 0) | 126, length)
+		else:
+			header = struct.pack('!BBQ', 0x80 | opcode, (0x80 if masked else 0) | 127, length)
+		if masked:
+			mask = os.urandom(4)
+			header += mask
+			payload = bytes(payload[i] ^ mask[i % 4] for i in range(len(payload)))
+		self.connection.sendall(header + payload)
+	
+	def ReceiveFrame(self):
+		# Server frames are never masked.
+		while True:
+			if len(self.buffer) >= 2:
+				length = self.buffer[1] & 0x7F
+				offset = 2
+				if length == 126:
+					length = struct.unpack('!H', self.buffer[2:4])[0]
+					offset = 4
+				elif length == 127:
+					length = struct.unpack('!Q', self.buffer[2:10])[0]
+					offset = 10
+				if len(self.buffer) >= offset + length:
+					opcode = self.buffer[0] & 0x0F
+					payload = self.buffer[offset:offset + length]
+					self.buffer = self.buffer[offset + length:]
+					return opcode, payload
+			data = self.connection.recv(65536)
+			if len(data) == 0:
+				return None, None
+			self.buffer += data
+	
+	def Command(self, request):
+		self.SendFrame(json.dumps(request).encode('utf-8'))
+		while True:
+			opcode, payload = self.ReceiveFrame()
+			message = json.loads(payload.decode('utf-8'))
+			if message['type'] == 'reply':
+				return message
+	
+	def Close(self):
+		self.connection.close()
+
+class WebServiceTest(unittest.TestCase):
+	def setUp(self):
+		self.command_queues = [queue.Queue()]
+		self.service = WebService.WebService('127.0.0.1', 0, self.command_queues, token = 'secret', temperature_limits = [{'max': 30.0, 'min': -40.0}])
+		self.port = self.service.server.server_address[1]
+	
+	def tearDown(self):
+		self.service.Shutdown()
+	
+	def testAcceptKey(self):
+		# The sample handshake from RFC 6455, section 1.3.
+		self.assertEqual(WebService.AcceptKey('dGhlIHNhbXBsZSBub25jZQ=='), 's3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+	
+	def testHandshake(self):
+		client = WebSocketTestClient(self.port, '/ws?token=secret')
+		self.assertEqual(client.status_line.split(' ')[:2], ['HTTP/1.1', '101'])
+		self.assertEqual(client.headers['sec-websocket-accept'], WebService.AcceptKey(client.key))
+		client.Close()
+	
+	def testBadToken(self):
+		client = WebSocketTestClient(self.port, '/ws?token=wrong')
+		self.assertIn(' 403 ', client.status_line)
+		client.Close()
+	
+	def testCommands(self):
+		client = WebSocketTestClient(self.port, '/ws?token=secret')
+		self.assertTrue(client.Command({'channel': 0, 'command': 'THROTTLE', 'args': [50.0]})['ok'])
+		self.assertEqual(self.command_queues[0].get(timeout = 1.0), Messages.Message(Messages.BackEndOp.THROTTLE, 50.0))
+		# Setpoints are clamped to the temperature limits, which follow the back end's SET_TEMP_LIMITS events.
+		self.assertTrue(client.Command({'channel': 0, 'command': 'SETPOINT', 'args': {'setpoint': -100.0}})['ok'])
+		self.assertEqual(self.command_queues[0].get(timeout = 1.0), Messages.Message(Messages.BackEndOp.SETPOINT, -40.0))
+		self.service.Publish(0, 'event', Messages.Message(Messages.FrontEndOp.SET_TEMP_LIMITS, '10.00', '-20.00'))
+		self.assertTrue(client.Command({'channel': 0, 'command': 'SETPOINT', 'args': [-100.0]})['ok'])
+		self.assertEqual(self.command_queues[0].get(timeout = 1.0), Messages.Message(Messages.BackEndOp.SETPOINT, -20.0))
+		for request in [{'channel': 0, 'command': 'THROTTLE', 'args': [1e9]}, {'channel': 0, 'command': 'THROTTLE', 'args': ['nan']},
+		                {'channel': 0, 'command': 'LOGGING_RATE', 'args': [0]}, {'channel': 0, 'command': 'START_LOGGING', 'args': [1, False, False]},
+		                {'channel': 0, 'command': 'SHUT_DOWN'}, {'channel': 1, 'command': 'OFF'}, {'channel': 0, 'command': 'NO_SUCH_COMMAND'}]:
+			self.assertFalse(client.Command(request)['ok'], request)
+		self.assertTrue(self.command_queues[0].empty())
+		client.Close()
+	
+	def testUnmaskedFrame(self):
+		client = WebSocketTestClient(self.port, '/ws?token=secret')
+		client.SendFrame(b'{}', masked = False)
+		self.assertEqual(client.ReceiveFrame(), (0x8, struct.pack('!H', 1002)))
+		client.Close()
+	
+	def testOversizedFrame(self):
+		# Closed as soon as the header arrives, without waiting for (or buffering) the payload.
+		client = WebSocketTestClient(self.port, '/ws?token=secret')
+		client.SendFrame(b'', length = 1 << 40)
+		self.assertEqual(client.ReceiveFrame(), (0x8, struct.pack('!H', 1009)))
+		client.Close()
+
+if __name__ == '__main__':
+	unittest.main()